@@ -0,0 +1,165 @@
+"""
+An asyncio version of the db interface, for loads and DDL of independent tables, that would otherwise wait on each other's round trips.
+Each table gets its own pooled connection and transaction, and at most max_concurrency of them run at the same time.
+Synchronous code calls it through run_async, or the DBInterface methods that wrap it, for example:
+
+db_interface.copy_new_csv_rows_concurrently([dataset_properties.properties_by_csv_sql_dataset['oil_price_by_date'], ...])
+db_interface.execute_engineering_queries_concurrently([fold_1_table_queries, fold_2_table_queries])
+"""
+import asyncio
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Any, Coroutine, Iterable, TypeVar, cast, LiteralString
+from psycopg import AsyncConnection
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+from csv_sql_dataset_utils import CsvSqlDatasetProperties
+from csv_utils import get_csv_column_range
+
+T = TypeVar('T')
+
+def _run_in_new_event_loop(coroutine:Coroutine[Any, Any, T]) -> T:
+    #psycopg can't use the proactor event loop, which is the default on windows.
+    loop_factory = asyncio.SelectorEventLoop if sys.platform == 'win32' else None
+    with asyncio.Runner(loop_factory=loop_factory) as runner:
+        return runner.run(coroutine)
+
+def run_async(coroutine:Coroutine[Any, Any, T]) -> T:
+    """Run a coroutine from synchronous code. Where an event loop is already running, like in notebooks, it runs in another thread with its own loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return _run_in_new_event_loop(coroutine)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(_run_in_new_event_loop, coroutine).result()
+
+
+class AsyncDBInterface:
+    """
+    Runs queries and COPY loads on a pool of async connections, with a semaphore limiting how many tables are processed at once.
+    Use it as an async context manager, so the pool is opened and closed:
+    async with AsyncDBInterface(conninfo) as async_db_interface:
+        await async_db_interface.copy_new_csv_rows_concurrently(datasets_properties)
+    """
+    def __init__(self, conninfo:str, max_concurrency:int=4, copy_block_rows:int=10_000):
+        """copy_block_rows: The csv rows sent to COPY per write, so a file is streamed instead of read into memory."""
+        self.conninfo = conninfo
+        self.max_concurrency = max_concurrency
+        self.copy_block_rows = copy_block_rows
+        self._pool:AsyncConnectionPool|None = None
+        self._semaphore:asyncio.Semaphore|None = None
+
+    @classmethod
+    def from_db_interface(cls, db_interface, max_concurrency:int=4) -> 'AsyncDBInterface':
+        """Connect with the data engineering user and database of a DBInterface."""
+        conninfo = make_conninfo(
+            host=db_interface.db_host,
+            port=db_interface.db_port,
+            dbname=db_interface.db_name,
+            user=db_interface.db_data_engineer_user,
+            password=db_interface.db_data_engineer_password
+        )
+        return cls(conninfo, max_concurrency)
+
+    async def __aenter__(self) -> 'AsyncDBInterface':
+        self._pool = AsyncConnectionPool(self.conninfo, min_size=1, max_size=self.max_concurrency, open=False)
+        await self._pool.open(wait=True)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if self._pool is not None:
+            await self._pool.close()
+        self._pool = None
+        self._semaphore = None
+
+    def _get_pool_and_semaphore(self) -> tuple[AsyncConnectionPool, asyncio.Semaphore]:
+        if self._pool is None or self._semaphore is None:
+            raise RuntimeError('AsyncDBInterface must be used inside an async with block, to open its connection pool')
+        return self._pool, self._semaphore
+
+    async def execute_queries(self, queries:Iterable[str]) -> None:
+        """Execute the queries in order, in a single transaction, commiting them only if they are all sucesfull."""
+        pool, semaphore = self._get_pool_and_semaphore()
+        async with semaphore, pool.connection() as connection: #The pool connection commits on exit, or rolls back if there was an exception.
+            async with connection.cursor() as cursor:
+                for query in queries:
+                    await cursor.execute(cast(LiteralString, query))
+
+    async def copy_csv_rows(self, table_name:str, csv_file_path:str, csv_column_names_to_sql:dict[str,str], rows_to_skip:int=0) -> int:
+        """
+        Load the rows of a csv file into an existing table with COPY, skipping the header and the first rows_to_skip rows.
+        The csv columns are matched to the table columns with csv_column_names_to_sql, they must all have an equivalent.
+        Returns the number of rows copied.
+        """
+        pool, semaphore = self._get_pool_and_semaphore()
+        async with semaphore, pool.connection() as connection:
+            return await self._copy_csv_rows_with_connection(connection, table_name, csv_file_path, csv_column_names_to_sql, rows_to_skip)
+
+    async def _copy_csv_rows_with_connection(self, connection:AsyncConnection, table_name:str, csv_file_path:str, csv_column_names_to_sql:dict[str,str], rows_to_skip:int) -> int:
+        rows_copied = 0
+        with open(csv_file_path, encoding='utf-8') as csv_file:
+            csv_column_names = csv_file.readline().strip().split(',')
+            missing_csv_columns = [csv_column_name for csv_column_name in csv_column_names if csv_column_name not in csv_column_names_to_sql]
+            if missing_csv_columns:
+                raise ValueError(f'The columns {missing_csv_columns} of {csv_file_path} have no equivalent in {table_name}')
+            #COPY matches the columns by position, so they are listed in the order of the csv.
+            sql_column_names = ', '.join(csv_column_names_to_sql[csv_column_name] for csv_column_name in csv_column_names)
+            for _ in range(rows_to_skip):
+                csv_file.readline()
+
+            copy_query = cast(LiteralString, f'COPY {table_name} ({sql_column_names}) FROM STDIN WITH (FORMAT csv)')
+            async with connection.cursor() as cursor:
+                async with cursor.copy(copy_query) as copy:
+                    block:list[str] = []
+                    for csv_row in csv_file:
+                        block.append(csv_row)
+                        if len(block) == self.copy_block_rows:
+                            await copy.write(''.join(block))
+                            rows_copied += len(block)
+                            block = []
+                    if block:
+                        await copy.write(''.join(block))
+                        rows_copied += len(block)
+        return rows_copied
+
+    async def copy_new_csv_rows(self, dataset_properties:CsvSqlDatasetProperties) -> int:
+        """Load the rows of the csv of a dataset that are not yet in its table, counting the stored rows the same way BaseDataManager does."""
+        pool, semaphore = self._get_pool_and_semaphore()
+        csv_column_names_to_sql = {csv_column_name: sql_column_name for sql_column_name, csv_column_name in dataset_properties.sql_col_csv_equivalents.items()}
+        async with semaphore, pool.connection() as connection:
+            cursor = await connection.execute(cast(LiteralString, f'SELECT count(*) FROM {dataset_properties.sql_table_name}'))
+            number_of_stored_rows = (await cursor.fetchone() or [0])[0]
+            #The partitions for the dates of the new rows must exist before they are copied, they are created in the same transaction.
+            partitioning = dataset_properties.table_spec.partitioning
+            if partitioning is not None:
+                csv_date_range = get_csv_column_range(dataset_properties.csv_file_path, dataset_properties.sql_col_csv_equivalents[partitioning.column], number_of_stored_rows)
+                if csv_date_range is not None:
+                    for create_partition_script in dataset_properties.table_spec.get_create_partitions_scripts(*map(date.fromisoformat, csv_date_range)):
+                        await connection.execute(cast(LiteralString, create_partition_script))
+            return await self._copy_csv_rows_with_connection(
+                connection,
+                dataset_properties.sql_table_name,
+                dataset_properties.csv_file_path,
+                csv_column_names_to_sql,
+                number_of_stored_rows
+            )
+
+    async def _gather_raising_after_all_finish(self, coroutines:Iterable[Coroutine[Any, Any, T]], description:str) -> list[T]:
+        """Run the coroutines concurrently. A failure doesn't cancel the others, they all finish first, and then the failures are raised together."""
+        results = await asyncio.gather(*coroutines, return_exceptions=True)
+        exceptions = [result for result in results if isinstance(result, Exception)]
+        if exceptions:
+            raise ExceptionGroup(f'{len(exceptions)} of {len(results)} {description} failed, the rest were commited', exceptions)
+        return cast(list[T], results)
+
+    async def execute_queries_concurrently(self, queries_per_table:Iterable[Iterable[str]]) -> None:
+        """Execute each group of queries in its own transaction, concurrently. For example the DDL of each per fold feature table."""
+        await self._gather_raising_after_all_finish([self.execute_queries(queries) for queries in queries_per_table], 'groups of queries')
+
+    async def copy_new_csv_rows_concurrently(self, datasets_properties:Iterable[CsvSqlDatasetProperties]) -> dict[str,int]:
+        """Load the new csv rows of each dataset concurrently, returning the number of rows copied by table name."""
+        datasets_properties = list(datasets_properties)
+        rows_copied = await self._gather_raising_after_all_finish([self.copy_new_csv_rows(dataset_properties) for dataset_properties in datasets_properties], 'csv loads')
+        return {dataset_properties.sql_table_name: table_rows_copied for dataset_properties, table_rows_copied in zip(datasets_properties, rows_copied)}
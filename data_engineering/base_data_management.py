@@ -1,39 +1,61 @@
 from pyspark import RDD
 from pyspark.sql import SparkSession
 from pyspark.sql.dataframe import DataFrame
+from pyspark.sql.functions import min as spark_min, max as spark_max
 from psycopg import Connection
 from typing import cast, LiteralString
 from csv_sql_dataset_utils import CsvSqlDatasetProperties
+from table_specs import TableSpec
 import dataset_properties
 from csv_utils import get_csv_rows_skipping
-from db_interfacing import db_interface #TODO consider assigning it as a variable instead of using directly from import
-#Though its probably unnecesary since you could just overwrite it by assigning a variable in python.
-#It could take a db_interface on the constructor though.
+from instrumentation import instrumented, instrumented_span, current_span, iterate_adding_rows_bytes
+from spark_profiles import get_spark_execution_profile
+from spark_persistence import PersistenceScope, persist_in_current_scope
+from db_interfacing import DBInterface, db_interface_provider
 
 class BaseDataManager:
-    def __init__(self, spark:SparkSession, spark_sql_options:dict[str,str]):
+    def __init__(self, spark:SparkSession, spark_sql_options:dict[str,str], db_interface:DBInterface|None=None):
+        """db_interface: The interface used to store the rows, the one of db_interface_provider if None."""
         self.spark = spark
         self.spark_sql_options = spark_sql_options
+        self.db_interface = db_interface if db_interface is not None else db_interface_provider.get()
 
     #TODO remove remaining sql implementation form here?
-    def append_rows_pyscopg(self, table_to_store_in, df:DataFrame):
-        """Insert new rows into an existing database table. Requires the table and columns to exist, and all other columns to be nullable/have a default value"""
+    @instrumented()
+    def append_rows_pyscopg(self, table_to_store_in, df:DataFrame, commit_each_chunk:bool=False):
+        """
+        Insert new rows into an existing database table. Requires the table and columns to exist, and all other columns to be nullable/have a default value
+        commit_each_chunk: Commit each chunk of rows, so if one fails the rows before it stay stored, and the next run only reads the csv rows after them.
+        By default all the rows are stored in one transaction, and an error stores none of them.
+        """
+        current_span().set_attribute('table_name', table_to_store_in)
         column_names = df.columns
         update_query = cast(LiteralString, f"INSERT INTO {table_to_store_in} ({', '.join(column_names)}) VALUES ({('%s, '*len(column_names))[:-2]})")
         try:
-            column_values = df.collect() #Might want to limit how much of the dataset to collect here
-            db_interface.execute_multi_valued_query(update_query, column_values)
+            #Stream the rows a partition at a time instead of collecting them all, so the driver memory doesn't grow with the table.
+            with instrumented_span('BaseDataManager.append_rows_pyscopg.stream', spark=self.spark) as stream_span:
+                rows_appended = self.db_interface.execute_multi_valued_query_in_chunks(
+                    update_query,
+                    iterate_adding_rows_bytes(df.toLocalIterator(prefetchPartitions=True), stream_span),
+                    chunk_size=get_spark_execution_profile().jdbc_batch_size,
+                    commit_each_chunk=commit_each_chunk
+                )
+                stream_span.set_rows_out(rows_appended)
+            current_span().set_rows_in(rows_appended)
         except Exception as e:
-            print(f'There was an error storing database features of table {table_to_store_in}.
-                  With update query: {update_query}
-                  Will cancel the operation and safely roll back any changes. The error was:\n {e}')
+            print(f'There was an error storing database features of table {table_to_store_in}.\n'
+                  f'With update query: {update_query}\n'
+                  f'Cancelling the operation, the changes of the {"chunk" if commit_each_chunk else "rows"} being stored were rolled back. The error was:\n {e}')
+            raise
             
+    @instrumented()
     def get_new_csv_data(self, csv_file_path:str, sql_col_csv_equivalents:dict[str,str], current_sql_table_name:str) -> DataFrame:
         stored_data = self.spark.read.format('jdbc').options(**self.spark_sql_options).option('dbtable', current_sql_table_name).load().select(list(sql_col_csv_equivalents.keys()))
         stored_data_with_col_names_as_csv = stored_data.withColumnsRenamed(sql_col_csv_equivalents)
         
         csv_schema =  stored_data_with_col_names_as_csv.schema
         number_of_stored_rows = stored_data.count()
+        current_span().set_attribute('number_of_stored_rows', number_of_stored_rows)
         new_csv_data = self.spark.read.csv(
             path=get_csv_rows_skipping(self.spark, csv_file_path, number_of_stored_rows), # type: ignore <- Ignoring this type error because it doesnt actually generate any problem.
             header=True, #Let spark know to ignore header
@@ -48,14 +70,32 @@ class BaseDataManager:
     def get_new_data_from_csv_dataset_of_name(self, name):
         return self.get_new_data_from_csv_sql_dataset_of_properties(dataset_properties.properties_by_csv_sql_dataset[name])
 
-    def update_sql_with_new_csv_data(self, csv_file_path:str, csv_to_sql_cols:dict[str,str], current_sql_table_name:str):
+    def create_partitions_for_new_data(self, table_spec:TableSpec, new_data:DataFrame):
+        """Create the partitions for the dates of the new rows, that must exist before they are stored."""
+        if table_spec.partitioning is None:
+            return
+        first_date, last_date = new_data.agg(spark_min(table_spec.partitioning.column), spark_max(table_spec.partitioning.column)).first() # type: ignore <- agg always returns a row
+        if first_date is not None:
+            self.db_interface.create_partitions_for_date_range(table_spec, first_date, last_date)
+
+    @instrumented()
+    def update_sql_with_new_csv_data(self, csv_file_path:str, csv_to_sql_cols:dict[str,str], current_sql_table_name:str, table_spec:TableSpec|None=None, commit_each_chunk:bool=False):
+        """
+        table_spec: The spec of the table, if it is partitioned the partitions for the new dates are created before storing them.
+        commit_each_chunk: Passed to append_rows_pyscopg, to keep the chunks stored before an error.
+        """
         data = self.get_new_csv_data(csv_file_path, csv_to_sql_cols, current_sql_table_name)
-        self.append_rows_pyscopg(current_sql_table_name, data)
+        with PersistenceScope(self.spark, name='BaseDataManager.update_sql_with_new_csv_data'):
+            if table_spec is not None and table_spec.partitioning is not None:
+                #The new rows are read twice, to find their dates and to store them, so the csv is only parsed once.
+                data = persist_in_current_scope(data)
+                self.create_partitions_for_new_data(table_spec, data)
+            self.append_rows_pyscopg(current_sql_table_name, data, commit_each_chunk)
         return data
         
     def update_csv_sql_dataset_of_properties(self, dataset_props:CsvSqlDatasetProperties):
         """calls update_sql_with_new_csv_data without having manually obtain the parameters from csv_sql_dataset_properties"""
-        self.update_sql_with_new_csv_data(dataset_props.csv_file_path, dataset_props.sql_col_csv_equivalents, dataset_props.sql_table_name)
+        self.update_sql_with_new_csv_data(dataset_props.csv_file_path, dataset_props.sql_col_csv_equivalents, dataset_props.sql_table_name, dataset_props.table_spec)
     
     def update_csv_sql_dataset_of_name(self, name):
         """calls update_sql_with_new_csv_data without having to manually search for the dataset properties """
@@ -94,6 +134,17 @@ class BaseDataManager:
     def update_transactions_base_data(self):
         return self.update_csv_sql_dataset_of_name('transactions_agg_by_date_store')
     
+    def update_all_base_data_concurrently(self, max_concurrency:int=4):
+        """
+        Load the new csv rows of every dataset with COPY, without spark, loading the tables that only reference stores at the same time.
+        Faster than update_all_base_data when there are many new rows, since the tables don't wait on each other and the rows aren't converted by spark.
+        """
+        self.db_interface.copy_new_csv_rows_concurrently([dataset_properties.properties_by_csv_sql_dataset['stores']])
+        self.db_interface.copy_new_csv_rows_concurrently(
+            [csv_sql_dataset_properties for dataset_name, csv_sql_dataset_properties in dataset_properties.properties_by_csv_sql_dataset.items() if dataset_name != 'stores'],
+            max_concurrency
+        )
+
     def update_all_base_data(self):#Could try except all of them to make sure a failure in one stops all as long as they raise the exception, but is it benefitial?
         self.update_stores_base_data()
         self.update_oil_base_data()
@@ -0,0 +1,150 @@
+"""
+A batch forecasting command, that predicts the sales of test.csv with a fitted create_pipeline, and writes the submission file.
+Instead of loading the whole test.csv and pushing it through the pipeline at once, it streams the test rows in bounded chunks of whole dates,
+prepending the rows of the last window_size - 1 dates before each chunk, of the previous chunk, or of train.csv for the first one.
+The window step lags each series on its own, so every series gets its lags from its own previous dates,
+the same as if train.csv and test.csv were transformed together at once.
+The predictions of each chunk are made with inplace_predict on a thread pool while the next chunk is being transformed, and written as soon as they are ready,
+so memory stays flat no matter the size of test.csv.
+
+Usage:
+python batch_forecasting.py --model-path ./models/pipeline.joblib --output ./submission.csv
+"""
+import argparse
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Iterator
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+import data_preparation_attempt4 as data_prep
+
+def iterate_date_aligned_chunks(test_csv_path:str, rows_per_chunk:int) -> Iterator[pd.DataFrame]:
+    """Read a csv sorted by date in chunks of about rows_per_chunk rows, that always contain all the rows of each of their dates."""
+    rows_of_incomplete_date = None
+    for chunk in pd.read_csv(test_csv_path, index_col='id', chunksize=rows_per_chunk):
+        if rows_of_incomplete_date is not None:
+            chunk = pd.concat([rows_of_incomplete_date, chunk])
+        #The last date of the chunk may continue in the next chunk, so keep its rows for the next one.
+        is_last_date_of_chunk = chunk['date'] == chunk['date'].iat[-1]
+        rows_of_incomplete_date = chunk[is_last_date_of_chunk]
+        if not is_last_date_of_chunk.all():
+            yield chunk[~is_last_date_of_chunk]
+    if rows_of_incomplete_date is not None and len(rows_of_incomplete_date):
+        yield rows_of_incomplete_date
+
+def get_rows_of_last_dates(rows:pd.DataFrame, number_of_dates:int) -> pd.DataFrame:
+    """The rows of the last number_of_dates dates of a frame sorted by date."""
+    if number_of_dates <= 0:
+        return rows.iloc[:0]
+    last_dates = rows['date'].drop_duplicates().iloc[-number_of_dates:]
+    return rows[rows['date'].isin(last_dates)]
+
+def read_last_dates_of_csv(csv_path:str, number_of_dates:int, rows_per_read:int=1_000_000) -> pd.DataFrame:
+    """Read the rows of the last number_of_dates dates of a csv sorted by date, like train.csv, keeping only rows_per_read rows in memory at a time."""
+    rows_of_last_dates = None
+    for chunk in pd.read_csv(csv_path, index_col='id', chunksize=rows_per_read):
+        if rows_of_last_dates is not None:
+            chunk = pd.concat([rows_of_last_dates, chunk])
+        rows_of_last_dates = get_rows_of_last_dates(chunk, number_of_dates)
+    return rows_of_last_dates
+
+def get_booster(model):
+    """Get the xgboost booster of the model step, be it an XGBRegressor or a QuantileDMatrixXGBRegressor"""
+    return model.get_booster() if hasattr(model, 'get_booster') else model.booster_
+
+class BatchForecaster:
+    """
+    Predicts the rows of a csv in chunks using a fitted pipeline made with create_pipeline.
+    days_since_start_origin: The first date of the data the pipeline was fit with, so days_since_start doesn't restart from 0 on each chunk.
+    training_tail: The raw rows, with their sales, of at least the last window_size - 1 dates before the csv, for example from read_last_dates_of_csv.
+    The lags of the first dates come from them, without them the first dates get backfilled lags.
+    """
+    def __init__(
+        self,
+        fitted_pipeline:Pipeline,
+        supplemental_dfs:dict[str, pd.DataFrame],
+        days_since_start_origin:str,
+        prediction_threads:int=2,
+        training_tail:pd.DataFrame|None=None
+    ):
+        self.fitted_pipeline = fitted_pipeline
+        self.supplemental_dfs = supplemental_dfs
+        self.prediction_threads = prediction_threads
+        window_step = fitted_pipeline.named_steps['window_dataset']
+        if getattr(window_step, 'func', None) is not data_prep.rolling_window_dataset_by_series:
+            raise ValueError(f'The window step of the pipeline is {window_step}, chunks of whole dates can only be windowed with rolling_window_dataset_by_series.')
+        self.window_size:int = window_step.kw_args['window_size']
+        self.training_tail = get_rows_of_last_dates(training_tail, self.window_size - 1) if training_tail is not None else None
+        self.fitted_pipeline.set_params(replace_date_with_date_related_columns__kw_args={'start_date': days_since_start_origin})
+        self.merging_pipeline = data_prep.create_merging_pipeline()
+
+    def transform_chunk(self, chunk_with_context:pd.DataFrame, number_of_context_rows:int) -> pd.DataFrame:
+        """Merge and transform a chunk of raw rows, returning the features of the rows that are not context rows."""
+        chunk_with_context = chunk_with_context.copy()
+        chunk_with_context.attrs.update(self.supplemental_dfs)
+        merged_chunk = self.merging_pipeline.transform(chunk_with_context)
+        if len(merged_chunk) != len(chunk_with_context):
+            raise ValueError(f'Merging the supplemental data changed the number of rows of the chunk from {len(chunk_with_context)} to {len(merged_chunk)}, so the predictions cant be matched to their ids.')
+        if 'sales' not in merged_chunk.columns:
+            merged_chunk['sales'] = np.nan #The target isn't known, but the pipeline expects the column for its lag features.
+        features = self.fitted_pipeline[:-1].transform(merged_chunk)
+        return features.iloc[number_of_context_rows:]
+
+    def forecast_to_csv(self, test_csv_path:str, output_path:str, rows_per_chunk:int=100_000) -> float:
+        """Write the predictions of every row of test_csv_path into output_path as a submission file. Returns the rows predicted per second."""
+        booster = get_booster(self.fitted_pipeline[-1])
+        start_time = time.perf_counter()
+        rows_predicted = 0
+        context_rows = self.training_tail
+        pending_predictions:deque[tuple[pd.Index, Future]] = deque()
+
+        def write_oldest_predictions(submission_file):
+            nonlocal rows_predicted
+            ids, predictions_future = pending_predictions.popleft()
+            pd.DataFrame({'id': ids, 'sales': np.clip(predictions_future.result(), 0, None)}).to_csv(submission_file, header=False, index=False)
+            rows_predicted += len(ids)
+            print(f'Predicted {rows_predicted} rows, {rows_predicted / (time.perf_counter() - start_time):.0f} rows per second')
+
+        with ThreadPoolExecutor(self.prediction_threads) as executor, open(output_path, 'w', newline='') as submission_file:
+            submission_file.write('id,sales\n')
+            for chunk in iterate_date_aligned_chunks(test_csv_path, rows_per_chunk):
+                #Prepend the rows of the dates before the chunk, so the first dates of each series get their lag features.
+                chunk_with_context = chunk if context_rows is None else pd.concat([context_rows, chunk])
+                features = self.transform_chunk(chunk_with_context, 0 if context_rows is None else len(context_rows))
+                context_rows = get_rows_of_last_dates(chunk_with_context, self.window_size - 1)
+
+                #inplace_predict releases the gil, so the prediction runs while the next chunk is transformed.
+                pending_predictions.append((chunk.index, executor.submit(booster.inplace_predict, features)))
+                #Keep at most one pending chunk per thread, to keep memory bounded.
+                while len(pending_predictions) > self.prediction_threads:
+                    write_oldest_predictions(submission_file)
+            while pending_predictions:
+                write_oldest_predictions(submission_file)
+
+        rows_per_second = rows_predicted / (time.perf_counter() - start_time)
+        print(f'Wrote the predictions of {rows_predicted} rows to {output_path} at {rows_per_second:.0f} rows per second')
+        return rows_per_second
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Predict the sales of test.csv in chunks with a fitted pipeline, and write a submission file.')
+    argument_parser.add_argument('--model-path', required=True, help='A fitted create_pipeline pipeline, stored with joblib.dump')
+    argument_parser.add_argument('--dataset-path', default='./dataset', help='The folder containing test.csv and the supplemental csv files')
+    argument_parser.add_argument('--output', default='./submission.csv')
+    argument_parser.add_argument('--rows-per-chunk', type=int, default=100_000)
+    argument_parser.add_argument('--prediction-threads', type=int, default=2)
+    argument_parser.add_argument('--days-since-start-origin', default='2013-01-01', help='The first date of the data the pipeline was fit with')
+    arguments = argument_parser.parse_args()
+
+    fitted_pipeline = joblib.load(arguments.model_path)
+    batch_forecaster = BatchForecaster(
+        fitted_pipeline,
+        data_prep.get_supplemental_dfs(arguments.dataset_path),
+        arguments.days_since_start_origin,
+        arguments.prediction_threads,
+        read_last_dates_of_csv(f'{arguments.dataset_path}/train.csv', fitted_pipeline.named_steps['window_dataset'].kw_args['window_size'] - 1)
+    )
+    batch_forecaster.forecast_to_csv(f'{arguments.dataset_path}/test.csv', arguments.output, arguments.rows_per_chunk)
@@ -0,0 +1,72 @@
+"""
+A calendar dimension, holding the date related features of each date, computed once per date instead of once per row.
+There are only about 1700 distinct dates in the dataset, but millions of rows, so joining the features by a date code
+makes creating them effectively independent of the number of rows.
+It can be used by the pandas path directly, or be turned into a spark dataframe for the spark path.
+"""
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pandas.tseries.offsets import MonthEnd
+
+UNIX_EPOCH = pd.Timestamp('1970-01-01')
+
+def to_date_codes(dates:pd.DatetimeIndex|pd.Series) -> np.ndarray:
+    """Turn dates into date codes, the number of days since the unix epoch, as int32 since there are no nulls and they are small."""
+    return np.asarray((pd.DatetimeIndex(dates) - UNIX_EPOCH) // pd.Timedelta('1D'), dtype='int32')
+
+@lru_cache(maxsize=8)
+def get_calendar_dimension(first_date:pd.Timestamp, last_date:pd.Timestamp) -> pd.DataFrame:
+    """
+    Returns a dataframe with one row per day between first_date and last_date (both included), indexed by date_code.
+    It's cached, so the features are computed only once for each range of dates, no matter how many times it's used.
+    Please don't modify the returned dataframe in place, since that would modify the cached one.
+    """
+    dates = pd.date_range(first_date, last_date, freq='D')
+    calendar = pd.DataFrame({
+        'date': dates,
+        'day_of_year': dates.dayofyear.astype('int16'),
+        'day_of_month': dates.day.astype('int8'),
+        'day_of_week': dates.dayofweek.astype('int8'),
+        'is_15th': (dates.day == 15).astype('int8'),
+        'is_last_day_of_month': (dates == dates + MonthEnd(1)).astype('int8'),
+    }, index=pd.Index(to_date_codes(dates), name='date_code'))
+    return calendar
+
+def get_calendar_features_of_dates(date_strings:pd.Series, start_date:str|pd.Timestamp|None=None) -> pd.DataFrame:
+    """
+    Get the calendar features of each row of a date column, along with days_since_start, without parsing every row.
+    Only the distinct dates are parsed, and the features of each row are taken from the calendar dimension by position.
+    start_date: the date days_since_start is counted from. If None, the first date in date_strings is used.
+    The returned dataframe has the same index as date_strings. Missing dates raise a ValueError, since days_since_start can't be null.
+    """
+    #Factorize is a single hash pass over the rows, and the rest of the work is done on the distinct dates only.
+    #Providing a date_time format speeds the method up.https://www.kaggle.com/code/kuldeepnpatel/to-datetime-is-too-slow-on-large-dataset
+    position_of_distinct_date_per_row, distinct_date_strings = pd.factorize(date_strings)
+    #Factorize gives missing values the position -1, which would take the features of the last distinct date.
+    if (position_of_distinct_date_per_row == -1).any():
+        raise ValueError(f'There are {(position_of_distinct_date_per_row == -1).sum()} rows with a missing date, which have no calendar features')
+    distinct_dates = pd.to_datetime(distinct_date_strings, format='%Y-%m-%d')#%Y-%m-%d # = yyyy-mm-dd, ex= 2013-01-21
+
+    calendar = get_calendar_dimension(distinct_dates.min(), distinct_dates.max())
+    date_code_per_row = to_date_codes(distinct_dates)[position_of_distinct_date_per_row]
+
+    #Since the calendar has one row per day, the position of a date in it is its date_code minus the first date_code.
+    calendar_position_per_row = date_code_per_row - calendar.index[0]
+    features_per_row = {
+        column_name: calendar[column_name].to_numpy()[calendar_position_per_row]
+        for column_name in ['day_of_year', 'day_of_month', 'day_of_week', 'is_15th', 'is_last_day_of_month']
+    }
+
+    start_date_code = date_code_per_row.min() if start_date is None else to_date_codes(pd.DatetimeIndex([start_date]))[0]
+    days_since_start = (date_code_per_row - start_date_code).astype('int32')
+
+    return pd.DataFrame({'days_since_start': days_since_start, **features_per_row}, index=date_strings.index)
+
+def make_spark_calendar_dimension(spark, first_date:str|pd.Timestamp, last_date:str|pd.Timestamp):
+    """
+    Get the calendar dimension as a spark dataframe, so the spark path can join the same features by date.
+    Pyspark is imported by the caller, which passes the spark session, so the pandas path doesn't need it.
+    """
+    calendar = get_calendar_dimension(pd.Timestamp(first_date), pd.Timestamp(last_date)).reset_index()
+    return spark.createDataFrame(calendar)
@@ -0,0 +1,177 @@
+"""
+Out of core execution of the preprocessing steps of create_pipeline, for datasets whose merged, one hot encoded and windowed features don't fit in memory.
+The rows are first partitioned by series, store and product family, into csv files of whole series, so each chunk has every row its lag features need.
+Then two passes are made over the chunks, so only one chunk is in memory at a time:
+    The first pass fits the stateful steps, fitting them on the first chunk and merging each next chunk into them with partial_fit,
+    the min max scalers extend their range, and the one hot encoders add the categories not seen yet.
+    The second pass transforms each chunk with the fitted steps, windows each series separately, and writes its features to a parquet file of the feature store.
+Peak memory is bounded by the size of the chunks, set with number_of_chunks, instead of the size of the dataset.
+
+Example usage:
+series_chunks = partition_csv_by_series('./dataset/train.csv', './work/series_chunks', number_of_chunks=32)
+chunked_runner = ChunkedPipelineRunner(create_pipeline(window_size=3), get_supplemental_dfs('./dataset'))
+chunked_runner.fit(series_chunks)
+chunked_runner.transform_to_feature_store(series_chunks, './work/feature_store')
+for features, target in iterate_feature_store_chunks('./work/feature_store'):
+    ...
+"""
+import glob
+import os
+from typing import Iterator, NamedTuple
+import pandas as pd
+from sklearn.compose import ColumnTransformer
+from sklearn.pipeline import Pipeline, FunctionTransformer
+import data_preparation_attempt4 as data_prep
+from parallel_series import ParallelSeriesExecutor
+
+class SeriesChunks(NamedTuple):
+    """The csv files with the rows of each chunk of series, and the first date of all of them, which days_since_start is counted from."""
+    chunk_paths: list[str]
+    first_date: str
+    number_of_rows: int
+
+def partition_csv_by_series(csv_path:str, output_path:str, number_of_chunks:int, series_columns:tuple[str, ...]=('store_nbr', 'family'), rows_per_read:int=1_000_000) -> SeriesChunks:
+    """
+    Split the rows of a csv like train.csv into number_of_chunks csv files, putting all the rows of each series in the same file, in their original order.
+    The series of each row is chosen by the hash of its series_columns, so it's the same on every read, and only rows_per_read rows are in memory at a time.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    chunk_paths = [os.path.join(output_path, f'chunk_{chunk_number:05d}.csv') for chunk_number in range(number_of_chunks)]
+    for chunk_path in chunk_paths: #Rows are appended to the files, so the files of a previous partitioning are removed first.
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+    first_date, number_of_rows = None, 0
+    for rows in pd.read_csv(csv_path, chunksize=rows_per_read):
+        chunk_number_of_rows = pd.util.hash_pandas_object(rows[list(series_columns)], index=False) % number_of_chunks
+        for chunk_number, chunk_rows in rows.groupby(chunk_number_of_rows.to_numpy(), sort=False):
+            chunk_path = chunk_paths[chunk_number]
+            chunk_rows.to_csv(chunk_path, mode='a', header=not os.path.exists(chunk_path), index=False)
+        #The dates are iso strings, so their order is the order of the dates.
+        rows_first_date = rows['date'].min()
+        first_date = rows_first_date if first_date is None else min(first_date, rows_first_date)
+        number_of_rows += len(rows)
+
+    if first_date is None:
+        raise ValueError(f'There are no rows in {csv_path} to partition')
+    return SeriesChunks([chunk_path for chunk_path in chunk_paths if os.path.exists(chunk_path)], first_date, number_of_rows)
+
+def partial_fit_step(step_name:str, step, chunk:pd.DataFrame, is_first_chunk:bool):
+    """
+    Fit a pipeline step on the first chunk, and merge each next chunk into it with partial_fit.
+    The transformers of a ColumnTransformer are merged one by one, on their columns, since it has no partial_fit of its own.
+    Stateless steps, like FunctionTransformers, are only fit on the first chunk.
+    """
+    if is_first_chunk:
+        step.fit(chunk)
+    elif isinstance(step, ColumnTransformer):
+        for transformer_name, fitted_transformer, columns in step.transformers_:
+            #passthrough and drop, newer scikitlearn versions store passthrough as a FunctionTransformer.
+            if isinstance(fitted_transformer, (str, FunctionTransformer)):
+                continue
+            if not hasattr(fitted_transformer, 'partial_fit'):
+                raise ValueError(f'The transformer {transformer_name} of the step {step_name} has no partial_fit, so it cant be fit in chunks')
+            fitted_transformer.partial_fit(chunk[columns])
+    elif hasattr(step, 'partial_fit'):
+        step.partial_fit(chunk)
+    elif not isinstance(step, FunctionTransformer) and hasattr(step, 'fit'):
+        raise ValueError(f'The step {step_name} has no partial_fit, so it cant be fit in chunks')
+
+def iterate_feature_store_chunks(feature_store_path:str, target_column:str='sales') -> Iterator[tuple[pd.DataFrame, pd.Series]]:
+    """Read the features and target of each chunk written by ChunkedPipelineRunner.transform_to_feature_store, one chunk at a time."""
+    for chunk_path in sorted(glob.glob(os.path.join(feature_store_path, 'chunk_*.parquet'))):
+        features = pd.read_parquet(chunk_path)
+        yield features.drop(columns=target_column), features[target_column]
+
+
+class ChunkedPipelineRunner:
+    """
+    Fits and runs the steps of a create_pipeline pipeline before the model, on chunks of whole series made with partition_csv_by_series.
+    The stateful steps are fit in a single pass, each one on the output of the partially fit steps before it. That gives the same result as fitting
+    them on the whole dataset as long as their fitted state doesn't depend on the values the steps before them rescale, which holds for create_pipeline,
+    where the scaling and the one hot encoding are fit on different columns.
+    The steps after the window step must be stateless.
+    supplemental_dfs: Like the ones of data_preparation_attempt4.get_supplemental_dfs, merged into each chunk.
+    n_series_workers: Window the series of each chunk on a process pool of this many processes with a ParallelSeriesExecutor, one after the other if None.
+    """
+    def __init__(
+        self,
+        pipeline:Pipeline,
+        supplemental_dfs:dict[str, pd.DataFrame],
+        series_columns:tuple[str, ...]=('store_nbr', 'product_family'),
+        window_step_name:str='window_dataset',
+        n_series_workers:int|None=None
+    ):
+        self.pipeline = pipeline
+        self.n_series_workers = n_series_workers
+        self.supplemental_dfs = supplemental_dfs
+        self.series_columns = series_columns
+        step_names = [step_name for step_name, _ in pipeline.steps]
+        self.window_step_position = step_names.index(window_step_name)
+        self.merging_pipeline = data_prep.create_merging_pipeline()
+
+    def read_merged_chunk(self, chunk_path:str) -> pd.DataFrame:
+        """Read the rows of a chunk, sorted by series keeping their date order, with the supplemental data merged into them."""
+        chunk = pd.read_csv(chunk_path, index_col='id')
+        chunk.attrs.update(self.supplemental_dfs)
+        merged_chunk = self.merging_pipeline.transform(chunk)
+        if len(merged_chunk) != len(chunk):
+            raise ValueError(f'Merging the supplemental data changed the number of rows of {chunk_path} from {len(chunk)} to {len(merged_chunk)}')
+        #The merges don't keep the id index, which is recovered from the chunk since they keep the order of the rows.
+        merged_chunk.index = chunk.index
+        return merged_chunk.sort_values(list(self.series_columns), kind='stable')
+
+    def _set_days_since_start_origin(self, series_chunks:SeriesChunks):
+        #Each chunk would otherwise count days_since_start from its own first date.
+        if 'replace_date_with_date_related_columns' in self.pipeline.named_steps:
+            self.pipeline.set_params(replace_date_with_date_related_columns__kw_args={'start_date': series_chunks.first_date})
+
+    def fit(self, series_chunks:SeriesChunks) -> 'ChunkedPipelineRunner':
+        """The first pass, fitting the steps before the window step, reading one chunk at a time."""
+        self._set_days_since_start_origin(series_chunks)
+        for chunk_number, chunk_path in enumerate(series_chunks.chunk_paths):
+            features = self.read_merged_chunk(chunk_path)
+            for step_name, step in self.pipeline.steps[:self.window_step_position]:
+                partial_fit_step(step_name, step, features, is_first_chunk=chunk_number == 0)
+                features = step.transform(features)
+        return self
+
+    def transform_chunk(self, merged_chunk:pd.DataFrame, is_first_chunk:bool=False) -> pd.DataFrame:
+        """Transform a merged chunk with the fitted steps, windowing each of its series separately, so no lag comes from another series."""
+        features = self.pipeline[:self.window_step_position].transform(merged_chunk)
+        window_step = self.pipeline.steps[self.window_step_position][1]
+        if is_first_chunk:
+            window_step.fit(features)
+
+        #The window step lags each series on its own, so the whole chunk can be windowed at once,
+        #or its series, which are together since the chunk is sorted by them, spread over a process pool.
+        if self.n_series_workers is not None:
+            series_number_of_rows = merged_chunk.groupby(list(self.series_columns), sort=False).ngroup()
+            features = ParallelSeriesExecutor([window_step.transform], n_workers=self.n_series_workers).transform(features, series_number_of_rows)
+        else:
+            features = window_step.transform(features)
+
+        for _, step in self.pipeline.steps[self.window_step_position + 1:-1]:
+            if is_first_chunk:
+                step.fit(features)
+            features = step.transform(features)
+        return features
+
+    def transform_to_feature_store(self, series_chunks:SeriesChunks, feature_store_path:str, target_column:str='sales') -> int:
+        """
+        The second pass, writing the features of each chunk, with its target as target_column, into a parquet file of the feature store.
+        Returns the number of rows written.
+        """
+        os.makedirs(feature_store_path, exist_ok=True)
+        for stale_chunk_path in glob.glob(os.path.join(feature_store_path, 'chunk_*.parquet')): #Of a previous run, that may have had more chunks.
+            os.remove(stale_chunk_path)
+        self._set_days_since_start_origin(series_chunks)
+        rows_written = 0
+        for chunk_number, chunk_path in enumerate(series_chunks.chunk_paths):
+            merged_chunk = self.read_merged_chunk(chunk_path)
+            features = self.transform_chunk(merged_chunk, is_first_chunk=chunk_number == 0)
+            features[target_column] = merged_chunk[target_column]
+            features.to_parquet(os.path.join(feature_store_path, f'chunk_{chunk_number:05d}.parquet'))
+            rows_written += len(features)
+            print(f'Wrote the features of {rows_written} of {series_chunks.number_of_rows} rows to {feature_store_path}')
+        return rows_written
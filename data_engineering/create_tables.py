@@ -7,11 +7,19 @@ or when for some reason you want to recreate them.
 """
 import dataset_properties
 from db_interfacing import db_interface
+from special_days import make_create_special_days_by_date_store_view_statements
 
 properties_per_dataset = dataset_properties.properties_by_csv_sql_dataset
-sql_table_creation_queries = [dataset_properties.create_sql_table_script for dataset_properties in dataset_properties.properties_by_csv_sql_dataset.values()]
+table_specs = [dataset_properties.table_spec for dataset_properties in dataset_properties.properties_by_csv_sql_dataset.values()]
 
 try:
-    db_interface.execute_engineering_queries(sql_table_creation_queries)
+    #The partitions of the partitioned tables are created when rows of their dates are stored.
+    db_interface.create_tables_of_specs(table_specs)
+    #One row per event and store it is relevant to, the source of the special days feature group.
+    db_interface.execute_engineering_queries(make_create_special_days_by_date_store_view_statements(
+        'special_days_by_date_store',
+        dataset_properties.get_sql_table_name_of_dataset_of_name('events_by_date'),
+        dataset_properties.get_sql_table_name_of_dataset_of_name('stores'),
+    ))
 except Exception as e:
     print(f'There was an error while trying to create the database tables, {e}')
\ No newline at end of file
@@ -5,18 +5,27 @@ from csv_utils import read_filtered_csv
 from sql_utils import get_last_sql_table_entry
 from filter_utils import create_newer_rows_filter
 from order_utils import create_desc_filter
+from table_specs import TableSpec
 
 from dataclasses import dataclass
 @dataclass
 class CsvSqlDatasetProperties():
     csv_file_path:str
-    sql_table_name:str
-    create_sql_table_script:str
+    table_spec:TableSpec
     sql_col_csv_equivalents:dict[str,str]
     #columns_that_define_newness:list[str]
     #It could be reasoanble to have a list of column names as they are expected in the csv file, por make base_columns a dict
     #To ensure that if any unexpected column changes happen in the csv file no bugs occur.
 
+    @property
+    def sql_table_name(self) -> str:
+        return self.table_spec.name
+
+    @property
+    def create_sql_table_script(self) -> str:
+        """The table, comment and index creation statements, the partitions are created when rows are stored."""
+        return ';\n'.join(self.table_spec.get_creation_scripts())
+
 
     
 def get_csv_new_rows(spark:SparkSession, spark_sql_options:dict[str,str], sql_table_name:str, columns_to_order_by:list[str], csv_file_path:str)-> SparkDataFrame:
@@ -67,3 +67,22 @@ def get_csv_rows_numbered(spark:SparkSession, file_path:str, column_separator=',
         .map(lambda row_row_number_tuple: f'{row_row_number_tuple[1]}{column_separator}{row_row_number_tuple[0]}')
     )
     return csv_rows
+
+def get_csv_column_range(file_path:str, column_name:str, rows_to_skip:int=0) -> tuple[str, str]|None:
+    """
+    Get the smallest and biggest value of a column of a csv file, skipping the first rows_to_skip rows after the header, without spark.
+    The values are compared as text, so it works for numbers of the same length, and iso dates. None if there are no rows left.
+    """
+    import csv
+    with open(file_path, encoding='utf-8', newline='') as csv_file:
+        csv_rows = csv.reader(csv_file)
+        column_position = next(csv_rows).index(column_name)
+        column_values = (csv_row[column_position] for row_number, csv_row in enumerate(csv_rows) if row_number >= rows_to_skip)
+        first_value = next(column_values, None)
+        if first_value is None:
+            return None
+        smallest_value = biggest_value = first_value
+        for column_value in column_values:
+            smallest_value = min(smallest_value, column_value)
+            biggest_value = max(biggest_value, column_value)
+    return smallest_value, biggest_value
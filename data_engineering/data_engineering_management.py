@@ -1,19 +1,25 @@
 from dataclasses import dataclass
 from pyspark.sql.dataframe import DataFrame
-from typing import Iterable
+from typing import Iterable, Literal
 from dataset_properties import get_sql_table_name_of_dataset_of_name
-from sql_utils import create_table_columns_if_not_exist, make_update_columns_with_values_statement, make_where_each_column_equals_values_statement
+from sql_utils import create_table_columns_if_not_exist, make_update_columns_with_values_statement, make_where_each_column_equals_values_statement, make_create_narrow_table_statements, make_create_joined_view_statements
 from df_utils import find_matching_rows, split_dataframe_sequentially
 from train_test_splitting_utils import TrainTestSplit, make_kfold_train_test_splits
 from itertools import chain
 from pyspark.ml.feature import VectorAssembler, MinMaxScaler, OneHotEncoder, StringIndexer
 from pyspark.ml import Pipeline
-from spark_utils import ColumnDropper, ColumnSelector, VectorFirstValueExtractor, get_current_data_in_sql_table
+from spark_utils import AsofValueFiller, ColumnDropper, ColumnSelector, VectorFirstValueExtractor, GroupAggregator, SeriesLagFeaturesMaker, get_current_data_in_sql_table, convert_vector_columns_to_arrays
 from pyspark.sql.types import FloatType
 from db_interfacing import DBInterface 
 from spark_interfacing import SparkInterface
 import db_interfacing
 import spark_interfacing
+from instrumentation import instrumented, instrumented_span, current_span, iterate_adding_rows_bytes
+from providers import LazyProvider, make_module_getattr
+from spark_profiles import tune_shuffle_partitions_for_tables, get_spark_execution_profile
+from snapshot_publishing import publish_table_snapshot, rollback_table_snapshot
+from special_days import special_day_count_columns
+from training_set_assembly import TrainingSetAssembler, FeatureTableJoin
 
 @dataclass
 class FeatureGroup:
@@ -26,11 +32,33 @@ class FeatureGroup:
     source_dataset_table_name:str #May want to change for a component that is a source dataset provider.
     db_interface:DBInterface
     spark_interface:SparkInterface
-    
+    #source_table_columns: The features are added as columns of the source table, and filled with an UPDATE per row.
+    #narrow_table: The features are stored in their own table, with the identity columns, which is rebuilt with a bulk insert on each refresh,
+    #   leaving the source table as is, instead of rewritting each of its rows. Consumers read them from a view of the source table joined to them.
+    #snapshot_swap: Like narrow_table, but each refresh builds a new version of the table and swaps it in, see snapshot_publishing.
+    #   For features whose values all change on each refresh, since readers never wait for, or see, a half done refresh.
+    storage_mode:Literal['source_table_columns', 'narrow_table', 'snapshot_swap'] = 'source_table_columns'
+    versions_to_keep:int = 3 #The replaced versions kept for rolling back, in snapshot_swap mode.
+
+    def __post_init__(self):
+        if self.storage_mode != 'source_table_columns' and self.name_of_table_to_store_features_in == self.source_dataset_table_name:
+            raise ValueError(f'A {self.storage_mode} feature group must store its features in a table other than its source table {self.source_dataset_table_name}')
+
+    @property
+    def name_of_view_with_features(self) -> str:
+        """The view of the source table, with the features of the narrow table."""
+        return f'{self.source_dataset_table_name}_with_{self.name_of_table_to_store_features_in}'
+
+    @instrumented()
     def make_features(self, base_dataset:DataFrame):
         return self.pipeline.fit(base_dataset).transform(base_dataset)
     
+    @instrumented()
     def engineer_features_and_store(self):
+        current_span().set_attribute('table_name', self.name_of_table_to_store_features_in)
+        #Small dimension tables get a few partitions, instead of hundreds of tiny tasks.
+        shuffle_partitions = tune_shuffle_partitions_for_tables(self.spark_interface.spark, [self.source_dataset_table_name], self.db_interface)
+        current_span().set_attribute('shuffle_partitions', shuffle_partitions)
         dataset_for_pipeline = self.get_current_data_in_source_storage()
         engineered_features = self.make_features(dataset_for_pipeline)
         self.store_engineered_features(engineered_features)
@@ -40,7 +68,14 @@ class FeatureGroup:
 
     def get_current_data_in_target_storage(self):
         return self.spark_interface.get_current_data_in_sql_table(self.name_of_table_to_store_features_in)
+
+    def get_current_data_with_features(self):
+        """The source data with the features added, regardless of where they are stored."""
+        if self.storage_mode != 'source_table_columns':
+            return self.spark_interface.get_current_data_in_sql_table(self.name_of_view_with_features)
+        return self.get_current_data_in_target_storage()
     
+    @instrumented()
     def update_columns(self, df_with_values_to_store:DataFrame):
         """
         Update a sql table, with the values provided in df_with_values_to_store.
@@ -57,11 +92,15 @@ class FeatureGroup:
         #Get a view of the dataframe with the columns we need in the order we need them to replace %s
         df_with_values_to_store_in_order = df_with_values_to_store.select(names_of_columns_in_required_order)
         
-        #Get the values used to replace the placeholders
-        column_values = df_with_values_to_store_in_order.collect() #Might want to limit how much of the dataset to collect here
-        
-        #Execute the sql query to update the column values.
-        self.db_interface.execute_multi_valued_query(full_statement, column_values)
+        #Execute the sql query to update the column values, streaming the values used to replace the placeholders a partition at a time.
+        with instrumented_span('FeatureGroup.update_columns.stream', spark=self.spark_interface.spark) as stream_span:
+            rows_updated = self.db_interface.execute_multi_valued_query_in_chunks(
+                full_statement,
+                iterate_adding_rows_bytes(df_with_values_to_store_in_order.toLocalIterator(prefetchPartitions=True), stream_span),
+                chunk_size=get_spark_execution_profile().jdbc_batch_size
+            )
+            stream_span.set_rows_out(rows_updated)
+        current_span().set_rows_in(rows_updated)
 
 
     def get_values_for_linked_train_test_split(self, linked_table:DataFrame, linked_table_name:str, main_train_test_split:TrainTestSplit, matching_columns:dict[str,str]):
@@ -81,7 +120,14 @@ class FeatureGroup:
         )
         return linked_train_test_split
 
+    @instrumented()
     def store_engineered_features(self, engineered_features:DataFrame):
+        if self.storage_mode == 'narrow_table':
+            self.store_engineered_features_in_narrow_table(engineered_features)
+            return
+        if self.storage_mode == 'snapshot_swap':
+            self.publish_engineered_features_snapshot(engineered_features)
+            return
         self.db_interface.create_table_columns_if_not_exist(
             self.name_of_table_to_store_features_in,
             self.engineered_columns_definition,
@@ -90,6 +136,44 @@ class FeatureGroup:
             engineered_features
         )
 
+    @instrumented()
+    def store_engineered_features_in_narrow_table(self, engineered_features:DataFrame):
+        """Rebuild the narrow table of the features with a bulk insert, and (re)create the view of the source table joined to it."""
+        current_span().set_attribute('table_name', self.name_of_table_to_store_features_in)
+        self.db_interface.execute_engineering_queries(
+            make_create_narrow_table_statements(self.name_of_table_to_store_features_in, self.source_dataset_table_name, self.identity_columns, self.engineered_columns_definition),
+            verbose=False
+        )
+        features_with_identity = convert_vector_columns_to_arrays(engineered_features.select([*chain(self.identity_columns, self.name_of_features_to_store)]))
+        #Truncating keeps the table, its index and the view, and unlike deleting or updating rows doesn't leave dead rows behind.
+        self.spark_interface.save_table(features_with_identity, self.name_of_table_to_store_features_in, truncate=True)
+        self.db_interface.execute_engineering_queries(self._make_create_view_with_features_statements(), verbose=False)
+
+    def _make_create_view_with_features_statements(self) -> list[str]:
+        return make_create_joined_view_statements(self.name_of_view_with_features, self.source_dataset_table_name, self.name_of_table_to_store_features_in, self.identity_columns, self.name_of_features_to_store)
+
+    @instrumented()
+    def publish_engineered_features_snapshot(self, engineered_features:DataFrame):
+        """Build a new version of the features table with COPY, and swap it in, recreating the view with features in the same transaction."""
+        current_span().set_attribute('table_name', self.name_of_table_to_store_features_in)
+        column_names = [*chain(self.identity_columns, self.name_of_features_to_store)]
+        features_with_identity = convert_vector_columns_to_arrays(engineered_features.select(column_names))
+        publish_table_snapshot(
+            self.db_interface,
+            self.name_of_table_to_store_features_in,
+            self.source_dataset_table_name,
+            self.identity_columns,
+            self.engineered_columns_definition,
+            column_names,
+            iterate_adding_rows_bytes(features_with_identity.toLocalIterator(prefetchPartitions=True), current_span()),
+            statements_after_swap=self._make_create_view_with_features_statements(),
+            versions_to_keep=self.versions_to_keep
+        )
+
+    def rollback_features_snapshot(self) -> str:
+        """Put back the previous version of the features of a snapshot_swap feature group, discarding the current one. Returns the name of the version put back."""
+        return rollback_table_snapshot(self.db_interface, self.name_of_table_to_store_features_in, self._make_create_view_with_features_statements())
+
 class KFoldSplitDataset():
     """A dataset representing all the kfold splits of a base table"""
     def __init__(self, source_table_name:str, target_table_base_name:str, row_number_col, spark_interface:SparkInterface):
@@ -113,13 +197,22 @@ class KFoldSplitDataset():
             self.spark_interface.save_table(split.test_data, split.get_test_identifier()) #Make the split call save_table?
             
     def store_splits(self) ->None:
-        self.store_this_splits(self.get_train_test_splits())
+        #The folds overlap, so the base data is kept cached while all of them are stored, instead of being read through jdbc for each one.
+        with self.spark_interface.persistence_scope(name='KFoldSplitDataset.store_splits'):
+            self.store_this_splits(self.get_train_test_splits())
 
         
 class DataEngineeringManager:
-    def __init__(self, db_interface:DBInterface, spark_interface:SparkInterface):
+    def __init__(self, db_interface:DBInterface, spark_interface:SparkInterface, feature_storage_mode:Literal['source_table_columns', 'narrow_table', 'snapshot_swap']='source_table_columns'):
+        """
+        feature_storage_mode: The storage_mode of the feature groups made. source_table_columns by default, so existing databases keep their features where they are,
+        except for the feature groups whose source can't hold them, which always use narrow tables.
+        To move to narrow_table, update the engineered data once with a manager in that mode, which creates the narrow tables and the views joining them
+        to their sources, and read the features from the views. The features stored as source table columns are then no longer updated, and can be dropped.
+        """
         self.db_interface= db_interface
         self.spark_interface = spark_interface
+        self.feature_storage_mode = feature_storage_mode
         
     def _make_feature_group(
         self,
@@ -129,17 +222,24 @@ class DataEngineeringManager:
         engineered_columns_names:list[str],
         engineered_columns_sql_definitions:list[str], #We could merge this and the following one into a tuple, but its probably not worth it or convenient
         feature_group_storage_table_name:str,
+        storage_mode:Literal['source_table_columns', 'narrow_table', 'snapshot_swap']|None=None,
     ) -> FeatureGroup:
-        """Makes a feature group passing data engineering manager's db and spark interface"""
+        """
+        Makes a feature group passing data engineering manager's db and spark interface
+        feature_group_storage_table_name: The narrow table the features are stored in, in source_table_columns mode they are stored in the source table instead.
+        storage_mode: The storage mode of the feature group, the feature_storage_mode of the manager if None.
+        """
+        storage_mode = storage_mode or self.feature_storage_mode
         return FeatureGroup(
-        pipeline,
-        source_dataset_table_name, #May want to change for a component that is a source dataset provider.
-        engineered_columns_names,
-        engineered_columns_sql_definitions, #We could merge this and the following one into a tuple, but its probably not worth it or convenient
-        identity_columns,
-        feature_group_storage_table_name,
-        self.db_interface,
-        self.spark_interface
+            pipeline=pipeline,
+            name_of_table_to_store_features_in=feature_group_storage_table_name if storage_mode != 'source_table_columns' else source_dataset_table_name,
+            name_of_features_to_store=engineered_columns_names,
+            engineered_columns_definition=engineered_columns_sql_definitions,
+            identity_columns=identity_columns,
+            source_dataset_table_name=source_dataset_table_name,
+            db_interface=self.db_interface,
+            spark_interface=self.spark_interface,
+            storage_mode=storage_mode
         )
     
     def _make_split_feature_group(
@@ -158,12 +258,14 @@ class DataEngineeringManager:
             original_feature_group.identity_columns,
             f'{split_id}_{original_feature_group.source_dataset_table_name}',
             self.db_interface,
-            self.spark_interface
+            self.spark_interface,
+            original_feature_group.storage_mode
         )
 
     #Might want to have this and other similar ones in engineered feature groups.py or something maybe renamed to Engineerablefeature group or something
     def create_oil_prices_feature_group(self) -> FeatureGroup:
         base_column_selector = ColumnSelector(['date','oil_price']) #Could be a dropper for columns in output columns instead. or error handling if its possible for existing columns
+        oil_price_filler = AsofValueFiller('date', ['oil_price']) #The dates without a price get the latest price before them
         assembler = VectorAssembler(inputCols=['oil_price'],outputCol='oil_price_vect', handleInvalid='keep') #Make sure null oil prices dont prevent the pipeline from being fit
         scaler = MinMaxScaler(inputCol='oil_price_vect', outputCol="oil_price_scaled_0_to_1")
         unvectorizer = VectorFirstValueExtractor([
@@ -171,7 +273,7 @@ class DataEngineeringManager:
             
         ])
         dropper = ColumnDropper(['oil_price_vect'])
-        pipeline = Pipeline(stages=[base_column_selector, assembler, scaler, unvectorizer, dropper])
+        pipeline = Pipeline(stages=[base_column_selector, oil_price_filler, assembler, scaler, unvectorizer, dropper])
         
         oil_feature_group = self._make_feature_group(
             'oil_price_by_date',#get_sql_table_name_of_dataset_of_name('oil_price_by_date')
@@ -179,7 +281,9 @@ class DataEngineeringManager:
             pipeline,
             ['oil_price_scaled_0_to_1'],
             [ 'oil_price_scaled_0_to_1 FLOAT'],
-            'oil_price_by_date'
+            'oil_price_features',
+            #A new minimum or maximum price changes every scaled price, so each refresh is published as a whole new version.
+            'snapshot_swap' if self.feature_storage_mode == 'narrow_table' else None
         )
         
         return oil_feature_group
@@ -189,10 +293,11 @@ class DataEngineeringManager:
         cat_cols = ['city', 'state', 'type', 'cluster']
         
         names_of_cat_cols_turned_numeric_names = [f'{cat_col}_numeric' for cat_col in cat_cols]
-        sql_definition_of_cat_cols_turned_numeric = [f'INTEGER {cat_col_numeric_name}' for cat_col_numeric_name in names_of_cat_cols_turned_numeric_names]
+        sql_definition_of_cat_cols_turned_numeric = [f'{cat_col_numeric_name} INTEGER' for cat_col_numeric_name in names_of_cat_cols_turned_numeric_names]
         
         names_of_cat_cols_ohe = [f'{cat_col}_ohe' for cat_col in cat_cols]
-        sql_definitions_of_cat_cols_ohe = [f'LIST {cat_cols_ohe_name}' for cat_cols_ohe_name in names_of_cat_cols_ohe]
+        #The ohe vectors are stored as arrays.
+        sql_definitions_of_cat_cols_ohe = [f'{cat_cols_ohe_name} DOUBLE PRECISION[]' for cat_cols_ohe_name in names_of_cat_cols_ohe]
         
         #pyspark requires columns to be numerical in order to OHE them. Indexer assigns them a number based on frequency order.
         columns_indexer = StringIndexer(inputCols=cat_cols, outputCols=names_of_cat_cols_turned_numeric_names)
@@ -205,9 +310,61 @@ class DataEngineeringManager:
             pipeline,
             [*chain(names_of_cat_cols_turned_numeric_names, names_of_cat_cols_ohe)],
             [*chain(sql_definition_of_cat_cols_turned_numeric, sql_definitions_of_cat_cols_ohe)],
-            'stores',#get_sql_table_name_of_dataset_of_name('stores')
+            'store_features',
         )
     
+    def create_special_days_feature_group(self) -> FeatureGroup:
+        """
+        The special days relevant to each store, aggregated to one row per date and store, so joining them to the sales doesn't repeat rows.
+        Made from the special_days_by_date_store view, created by create_tables, with a row per event and store it is relevant to.
+        """
+        from pyspark.sql import functions as F
+        aggregator = GroupAggregator(['date', 'store_id'], [
+            F.expr('bit_or(day_type_bit)').cast('smallint').alias('special_day_types_bitmask'),
+            F.expr('bit_or(locale_type_bit)').cast('smallint').alias('special_day_locale_types_bitmask'),
+            F.count('*').cast('smallint').alias('special_days_count'),
+            F.sum(F.col('was_transferred').cast('int')).cast('smallint').alias('transferred_special_days_count'),
+        ])
+        pipeline = Pipeline(stages=[aggregator])
+
+        return self._make_feature_group(
+            'special_days_by_date_store',
+            ['date', 'store_id'],
+            pipeline,
+            special_day_count_columns,
+            [f'{special_day_count_column} SMALLINT' for special_day_count_column in special_day_count_columns],
+            'special_day_features',
+            #The source has a row per event, so the features can't be stored as its columns.
+            'narrow_table' if self.feature_storage_mode == 'source_table_columns' else None
+        )
+
+    def create_sales_lag_feature_group(self, lags:Iterable[int]=(1, 7, 14, 28), rolling_horizons_in_days:Iterable[int]=(7, 14, 28)) -> FeatureGroup:
+        """
+        The lags, and rolling means, sums and standard deviations of the sales of each store and product family series, keyed by the sales id.
+        Stored once here, so training can read them with the training set, see training_set_assembly, instead of windowing the whole frame in memory on every run.
+        """
+        lag_features_maker = SeriesLagFeaturesMaker(['store_id', 'product_family'], 'date', 'sales_total', lags, rolling_horizons_in_days)
+        lag_feature_names = lag_features_maker.get_output_columns()
+        pipeline = Pipeline(stages=[lag_features_maker])
+
+        return self._make_feature_group(
+            'sales_agg_by_date_store_productfamily',#get_sql_table_name_of_dataset_of_name('sales_agg_by_date_store_productfamily')
+            ['id'],
+            pipeline,
+            lag_feature_names,
+            [f'{lag_feature_name} DOUBLE PRECISION' for lag_feature_name in lag_feature_names],
+            'sales_lag_features',
+            #Updating every row of the biggest table one by one would be too slow, so the features are always stored in their own table.
+            'narrow_table' if self.feature_storage_mode == 'source_table_columns' else None
+        )
+
+    def make_training_set_assembler(self) -> TrainingSetAssembler:
+        """
+        Assembles the training set with the stored sales lag features, for pipelines made with create_pipeline(precomputed_lags=True).
+        Read it with training_set_assembly.read_training_set_parquet, or get_as_pandas, which leave the id and year out of the features.
+        """
+        return TrainingSetAssembler(self.db_interface, [FeatureTableJoin.of_feature_group(self.create_sales_lag_feature_group(), {'id': 'id'})])
+
     def make_sales_splits_dataset(self):
         return KFoldSplitDataset(
             'sales',
@@ -219,18 +376,18 @@ class DataEngineeringManager:
     def engineer_and_store_all_features(self):
         feature_groups = [
             self.create_oil_prices_feature_group(),
-            self.create_store_feature_group()
+            self.create_store_feature_group(),
+            self.create_special_days_feature_group(),
+            self.create_sales_lag_feature_group(),
         ]
         for feature_group in feature_groups:
             feature_group.engineer_features_and_store()
             
-        sales_splits_dataset = self.make_sales_splits_dataset()
-        
-        
         #Todo make a train test splitter
         
-        full_sales_data_sequential_splits = 
-        sales_data_kfold_splits = make_kfold_train_test_splits(sequentially_split_dataset=full_sales_data_sequential_splits, dataset_name='sales') #Will make splits named sales_1, sales_2 ...
+        #sales_splits_dataset = self.make_sales_splits_dataset()
+        #full_sales_data_sequential_splits = 
+        #sales_data_kfold_splits = make_kfold_train_test_splits(sequentially_split_dataset=full_sales_data_sequential_splits, dataset_name='sales') #Will make splits named sales_1, sales_2 ...
 
         #Grab the main dataset > k fold split > grab the splits > 
 
@@ -263,7 +420,12 @@ class DataEngineeringManager:
         
         #
         #
-data_engineering_manager:DataEngineeringManager = DataEngineeringManager(db_interfacing.db_interface, spark_interfacing.spark_interface)
+#Made on first use, so importing this module doesn't start spark.
+data_engineering_manager_provider:LazyProvider[DataEngineeringManager] = LazyProvider(
+    lambda: DataEngineeringManager(db_interfacing.db_interface_provider.get(), spark_interfacing.spark_interface_provider.get()),
+    name='data_engineering_manager'
+)
+__getattr__ = make_module_getattr(__name__, {'data_engineering_manager': data_engineering_manager_provider})
 
 
 
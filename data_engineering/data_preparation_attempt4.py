@@ -5,12 +5,23 @@ from pandas.tseries.offsets import MonthEnd
 from sklearn.preprocessing import StandardScaler, MinMaxScaler
 from typing import NamedTuple
 import data_preparation_utils as prep_utils
+from calendar_dimension import get_calendar_features_of_dates
+from special_days import aggregate_special_days_by_date_store, merge_special_days_by_date_store
 
 def download_dataset():
     prep_utils.download_kaggle_competition_dataset('./.kaggle/kaggle.json', 'store-sales-time-series-forecasting', './dataset')
 
 
-def get_train_dataset(length:int, drop_sales=True) -> pd.DataFrame:
+def get_supplemental_dfs(dataset_path='./dataset') -> dict[str, pd.DataFrame]:
+    """Returns the suplemental dataframes, by the name of the attribute the datasets store them in."""
+    return dict(
+        stores_df = pd.read_csv(f'{dataset_path}/stores.csv', index_col='store_nbr'),
+        oil_df = pd.read_csv(f'{dataset_path}/oil.csv'),
+        transactions_df = pd.read_csv(f'{dataset_path}/transactions.csv'),
+        special_days_df = pd.read_csv(f'{dataset_path}/holidays_events.csv'),
+    )
+
+def get_train_dataset(length:int, drop_sales=True, dataset_path='./dataset') -> pd.DataFrame:
     """
     Returns the train dataset
     Its formatted as a base dataframe, which will determine the end number of rows
@@ -18,16 +29,13 @@ def get_train_dataset(length:int, drop_sales=True) -> pd.DataFrame:
     This way it can be fed into a scikitlearn pipeline and is even compatible with cross validate
     And the suplemental data can be used inside the pipeline, to add columns, etc.
     """
-    dataset = pd.read_csv('./dataset/train.csv', index_col='id')
+    dataset = pd.read_csv(f'{dataset_path}/train.csv', index_col='id')
 
     if length in [ None, 'all', 'full']:
         length = len(dataset)
 
     dataset = dataset.head(length)
-    dataset.attrs['stores_df'] = pd.read_csv('./dataset/stores.csv', index_col='store_nbr')
-    dataset.attrs['oil_df'] = pd.read_csv('./dataset/oil.csv')
-    dataset.attrs['transactions_df'] = pd.read_csv('./dataset/transactions.csv')
-    dataset.attrs['special_days_df'] = pd.read_csv('./dataset/holidays_events.csv')
+    dataset.attrs.update(get_supplemental_dfs(dataset_path))
     
     if drop_sales:
         dataset.attrs['sales'] = dataset.pop('sales') #Make y available for feature engineering, but remove it from the features
@@ -68,7 +76,8 @@ def merge_data_sources(dataset:pd.DataFrame, merge_oil:bool, merge_stores:bool,
     attrs = dataset.attrs #Save the attributes, since they are lost on dataset merges, and we need them
 
     if merge_oil:
-        dataset = dataset.merge(attrs['oil_df'], on='date',how='left')
+        #Oil prices aren't registered on weekends and holidays, each date gets the last known price instead.
+        dataset = prep_utils.asof_join(dataset, attrs['oil_df'], on='date', value_columns=['oil_price'])
 
     if merge_stores:
         dataset = dataset.merge(attrs['stores_df'], on=['store_nbr'], how='left')
@@ -77,7 +86,9 @@ def merge_data_sources(dataset:pd.DataFrame, merge_oil:bool, merge_stores:bool,
         dataset = dataset.merge(attrs['transactions_df'], on=['date', 'store_nbr'], how='left')
     
     if merge_special_days:
-        dataset = dataset.merge(attrs['special_days_df'], on=['date'], how='left')
+        #Merging the special days by date alone would repeat the rows of dates with many special days, they are aggregated per date and store first.
+        special_days_by_date_store = aggregate_special_days_by_date_store(attrs['special_days_df'], attrs['stores_df'])
+        dataset = merge_special_days_by_date_store(dataset, special_days_by_date_store)
 
     dataset.attrs = attrs #Recover the attributes
 
@@ -89,6 +100,7 @@ def reorder_features_dataset(features_df):
                 'store_nbr', 'store_city', 'store_state', 'store_type', 'store_cluster',
                 'days_since_start', 'day_of_week','day_of_month', 'is_15th', 'is_last_day_of_month', 'day_of_year',  
                 'day_type', 'special_day_reason', 'special_day_offset', 'special_day_transferred', 'special_day_reason_subtype', 'special_day_locale_type', 'special_day_locale',
+                'special_day_types_bitmask', 'special_day_locale_types_bitmask', 'special_days_count', 'transferred_special_days_count',
                 'oil_price', 'all_products_transactions', 
                 'product_family', 'products_of_family_on_promotion',
                 'sales'
@@ -140,12 +152,24 @@ class CustomOneHotEncoder(BaseEstimator):
             self.categories[name_of_column_to_ohe] = features_df[name_of_column_to_ohe].unique()
         return self
 
+    def partial_fit(self, features_df:pd.DataFrame, y=None):
+        """Add the categories of features_df not seen yet after the ones already found, so the data can be fit in chunks, keeping the order of first appearance."""
+        if not self.categories:
+            return self.fit(features_df)
+        for name_of_column_to_ohe in self.names_of_columns_to_ohe:
+            seen_and_new_categories = np.concatenate([
+                np.asarray(self.categories[name_of_column_to_ohe], dtype=object),
+                np.asarray(features_df[name_of_column_to_ohe].unique(), dtype=object)
+            ])
+            self.categories[name_of_column_to_ohe] = pd.unique(seen_and_new_categories)
+        return self
+
     def transform(self, features_df):
         #create new columns for each unique category in the original columns
         #then drop the original column as it has been one-hot encoded
         for name_of_column_to_ohe in self.names_of_columns_to_ohe:
             for category in self.categories[name_of_column_to_ohe]:
-                features_df[name_of_column_to_ohe + '_' + str(category)] = (features_df[name_of_column_to_ohe] == category).astype(int)
+                features_df[name_of_column_to_ohe + '_' + str(category)] = (features_df[name_of_column_to_ohe] == category).astype('int8') #int8 takes an eighth of the memory of int
             features_df.drop(name_of_column_to_ohe, axis=1, inplace=True)
 
         if self.output_type == 'pandas':
@@ -182,15 +206,6 @@ def fill_missing_transactions(features_df):
     features_df.all_products_transactions = features_df.all_products_transactions.fillna(0)
     return features_df
 
-def fill_missing_oil_values(features_df):
-    # Oil price highly varies over time, making average imputing inaddecuate.
-    # While we could use the average between the previous day and the next day, that wouldnt work for forecasting.
-    # Instead just use the last known price, sinceFill down
-    features_df['oil_price'] = features_df['oil_price'].ffill()#.fillna(method='ffill')
-    features_df['oil_price'] = features_df['oil_price'].bfill() #Make sure that if the first elements are blank they still get a price (the price after them).
-    #features_df['oil_price'].interpolate(limit_direction="both")
-    return features_df
-
 
 def refine_special_day_reason(features_df):
     """Assign the same reason to special days that have the same reason but with a small variation, storing otherwise lost information in other columns"""
@@ -239,24 +254,21 @@ def refine_special_day_reason(features_df):
     return features_df
 
 
-def replace_date_with_date_related_columns(features_df):
-    """"Removes date, and adds many date_related_columns """
-    #Providing a date_time format speeds the method up.https://www.kaggle.com/code/kuldeepnpatel/to-datetime-is-too-slow-on-large-dataset
-    features_df['date'] = pd.to_datetime(features_df['date'],format='%Y-%m-%d')#%Y-%m-%d # = yyyy-mm-dd, ex= 2013-01-21
+def replace_date_with_date_related_columns(features_df, start_date=None):
+    """"Removes date, and adds many date_related_columns
+        The features are taken from the calendar dimension, which computes them once per distinct date, and joined by date code.
+        start_date: the date days_since_start is counted from. If None the first date of features_df is used.
+    """
     #Calculate the absolute date (from unix epoch), which is a standard start date used by many siystems and libraries working with time series data.
     #While this would work its probably worth for the nn to learn.
     #UNIX_EPOCH = pd.Timestamp("1970-01-01")
     #features_df['absolute_day_number'] = (features_df['date'] - UNIX_EPOCH) // pd.Timedelta('1D')
 
-    #Calculate the number of days since the first date in the dataset. Change the type from int64 to in32 since it won't have nulls.
-    features_df['days_since_start'] = ( (features_df['date'] - features_df['date'].min()) // pd.Timedelta('1D') ).astype('int32')
-
-    features_df['day_of_year'] = features_df['date'].dt.dayofyear
-    features_df['day_of_month'] = features_df['date'].dt.day
-    features_df['day_of_week'] = features_df['date'].dt.dayofweek
-
-    features_df['is_15th'] = (features_df['date'].dt.day == 15).astype(int)
-    features_df['is_last_day_of_month'] = (features_df['date'] == features_df['date'] + MonthEnd(1)).astype(int)
+    #days_since_start is the number of days since the first date in the dataset, as int32 since it won't have nulls.
+    #The rest of the columns use the smallest int type that fits them, since they are small.
+    date_related_columns = get_calendar_features_of_dates(features_df['date'], start_date)
+    for column_name in date_related_columns.columns:
+        features_df[column_name] = date_related_columns[column_name]
 
     features_df = features_df.drop(columns=['date'])
     return features_df
@@ -267,7 +279,6 @@ def prepare_features_df(features_df:pd.DataFrame, stores_df, oil_df, transaction
     """Call all the preprocessing methods in order, and prepare a features dataframe for deep learning, be it the train set or the test set"""
     #features_df = merge_data_sources(features_df, stores_df, oil_df, transactions_df, special_days_df) #Careful, do not move this later, since the rest of the methods need access to all the columns.
     features_df = reorder_features_dataset(features_df) #Careful, do not move this later, the rest of the methods try to respect the order of the dataframe, so theyll end up in messy places otherwise.
-    features_df = fill_missing_oil_values(features_df)     
     features_df = refine_special_day_reason(features_df)
     features_df = process_numerical_features(features_df) #Rename or include fill missing oil values here?
     features_df = one_hot_encode_necessary_features(features_df) #Careful moving this earlier since one hot encoding properly requires categorical variables to have been processed.
@@ -312,6 +323,32 @@ def rolling_window_dataset(df:pd.DataFrame, window_size):
     #     },
     #     axis=1)   
 
+def add_series_id(features_df:pd.DataFrame, series_columns=('store_nbr', 'product_family')):
+    """Number the series (store and product family) of each row, so the window step can still tell them apart after they are one hot encoded."""
+    features_df['series_id'] = features_df.groupby(list(series_columns), sort=False).ngroup()
+    return features_df
+
+def rolling_window_dataset_by_series(df:pd.DataFrame, window_size, series_id_column='series_id'):
+    """
+    Like rolling_window_dataset, but the lags of each row come from the previous rows of its own series, instead of the previous rows of the frame,
+    which in the csvs sorted by date are other series of the same date. The series_id_column, made by add_series_id, is dropped.
+    The rows of each series must be in date order, which they are both in frames sorted by date and in frames sorted by series and date.
+    """
+    series_ids = df[series_id_column].to_numpy()
+    df = df.drop(columns=series_id_column)
+    df_by_series = df.groupby(series_ids, sort=False)
+    dataframes = [df]
+    for lag in range(1, window_size):
+        with pd.option_context('future.no_silent_downcasting', True): #Avoid a pandas warning about tchanges in future behavior
+            df_shifted = df_by_series.shift(lag)
+            #The first rows of each series get the lags of the next rows of their series, and the series too short for that get their own values.
+            df_shifted = df_shifted.infer_objects(copy=False).groupby(series_ids, sort=False).bfill().fillna(df)
+            df_shifted = df_shifted.astype(df.dtypes)
+            dataframes.append(df_shifted.add_suffix(f'_lag_{lag}'))
+    df['row_was_lagg_backfilled'] = df_by_series.cumcount().to_numpy() < window_size - 1 #The first rows of each series, which lack some of their lags
+
+    return pd.concat(dataframes, axis=1)
+
 def drop_target(df:pd.DataFrame):
     """Drop the target for prediction from the values
        It is convenient/necessary for having windowing inside the pipeline
@@ -332,8 +369,9 @@ def drop_target(df:pd.DataFrame):
 from sklearn.pipeline import FunctionTransformer
 from sklearn.pipeline import Pipeline
 
-def create_merging_pipeline()->Pipeline:
+def create_merging_pipeline(merge_oil=True, merge_stores=True, merge_special_days=True, merge_transactions=True)->Pipeline:
     """Create a pipeline for renaming columns and merging dataframes
+       The merge_ parameters choose the supplemental dataframes merged, see merge_data_sources.
        We rename them to make the merging code and end result clearer.
        We do it separately from the main pipeline in order to be able to use scikitlearn cross_validate.
        cross_validate enforces the input having the same number of rows as the target value.
@@ -342,7 +380,7 @@ def create_merging_pipeline()->Pipeline:
     """
     merging_pipeline = Pipeline([
         ('rename_columns', FunctionTransformer(rename_raw_dfs_cols)),
-        ('merge_dataframes', FunctionTransformer(merge_data_sources))
+        ('merge_dataframes', FunctionTransformer(merge_data_sources, kw_args={'merge_oil':merge_oil, 'merge_stores':merge_stores, 'merge_special_days':merge_special_days, 'merge_transactions':merge_transactions}))
     ])
     return merging_pipeline
 
@@ -351,15 +389,25 @@ from sklearn.compose import ColumnTransformer
 from sklearn.linear_model import LinearRegression
 from sklearn.compose import TransformedTargetRegressor
 from xgboost import XGBRegressor
+from dtype_compaction import DtypeCompactor, add_memory_reports
 
-def create_pipeline(window_size=3, verbose=False):
+def create_pipeline(window_size=3, verbose=False, memory=None, model=None, compact_dtypes=False, report_memory=False, precomputed_lags=False):
     """Create a pipeline for data processing
        Keep in mind that pipelines are extremely practical, and easy to debug.
        You can call parts of the pipeline for debugging purposes by adding a list slicer next to it, for example pipeline[:1].fit_transform(dataset) or by name of the step.
        You can also call the pipeline with 'verbose=True' to analyze the time taken by each step.
        You can use ipython.display to display a graph of the pipeline steps too. Though it seems functiontransformer isnt really named with this way of defining them, you can create a class extending function transformer instead.
        Please note that while we could save processing time by separating the processing pipeline from the predictor for optuna trials, we wouldnt be able to tune the processing if we did that.
-       Unless we cache the preprocessing results, and grab them dinamically, but it seems overly complicated unless necessary, plus I don't know if optuna caches something at some point or not, so it may be pointless.
+       Instead you can pass a pipeline_caching.PipelineStepCache as memory, which caches the results of each step keyed on its input data and parameters.
+       That way trials that only change the model hyperparameters, or the window_size, reuse the results of every step before them.
+       model: the last step of the pipeline, XGBRegressor() if None. xgboost_stage.QuantileDMatrixXGBRegressor can be used to reuse the xgboost matrix across fits.
+       compact_dtypes: Add a dtype_compaction.DtypeCompactor step before prepare_features, turning the strings into categories, and downcasting the ints and floats.
+       It's placed after the steps that treat the special day reasons and dates as python strings. It can also be added at any other position with pipeline.steps.insert.
+       report_memory: Print the memory used by the dataframe before the first step and after each step.
+       The lag features of the window step are made within each store and product family series, so the rows can be sorted by date or by series, and
+       the pipeline can be fit on the whole frame, or on chunks of whole series like chunked_preprocessing does, and gives the lags RecursiveForecaster uses.
+       precomputed_lags: Leave out the window_dataset step, for training sets that already have the lag features stored by the sales lag feature group,
+       like the ones of DataEngineeringManager.make_training_set_assembler. window_size is ignored then.
        An interesting alternative would be to create a feature store, and on tuning just decide which features tp grab features from the store.
        In that case a separate pipeline for creating the features to store could be built TODO: move the ideas to separate notes.
     """
@@ -370,8 +418,8 @@ def create_pipeline(window_size=3, verbose=False):
 
     
 
-    pipeline = Pipeline([
-        ('fill_missing_oil_values', FunctionTransformer(fill_missing_oil_values)), #Could be achievable with sklearn most likely
+    steps = [
+        ('add_series_id', FunctionTransformer(add_series_id)), #Before prepare_features one hot encodes the store and product family.
         ('fill_missing_transactions', FunctionTransformer(fill_missing_transactions)),
         ('refine_special_day_reason', FunctionTransformer(refine_special_day_reason)), #Isnt placed where the column came from.
         ('replace_date_with_date_related_columns', FunctionTransformer(replace_date_with_date_related_columns)), #Careful, moving calling this earlier could be problematic since it eliminates date column.
@@ -380,10 +428,17 @@ def create_pipeline(window_size=3, verbose=False):
             ('standardize_numerical_features', MinMaxScaler(), numerical_features_to_min_max_scale), 
             ('prepare_categorical_columns', CustomOneHotEncoder(cat_cols_to_ohe), cat_cols_to_ohe),
         ], remainder='passthrough', sparse_threshold=0, n_jobs=3, verbose_feature_names_out=False).set_output(transform='pandas')),
-        ('window_dataset', FunctionTransformer(rolling_window_dataset, kw_args={'window_size': window_size})),
+        ('window_dataset', FunctionTransformer(rolling_window_dataset_by_series, kw_args={'window_size': window_size})), #Lags each series on its own, whatever the order of the rows.
         ('drop_target', FunctionTransformer(drop_target)),
-        ('model', XGBRegressor()) #instead of linear regressor
-    ], verbose=verbose)
+        ('model', model if model is not None else XGBRegressor()) #instead of linear regressor
+    ]
+    if precomputed_lags:
+        steps = [(step_name, step) for step_name, step in steps if step_name not in ('add_series_id', 'window_dataset')]
+    if compact_dtypes:
+        steps.insert([step_name for step_name, _ in steps].index('prepare_features'), ('compact_dtypes', DtypeCompactor()))
+    if report_memory:
+        steps = add_memory_reports(steps)
+    pipeline = Pipeline(steps, memory=memory, verbose=verbose)
 
     #return TransformedTargetRegressor(regressor=pipeline, transformer=FunctionTransformer(trim_target_to_laggable_range, kw_args={'window_size':2}))
 
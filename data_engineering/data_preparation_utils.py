@@ -19,4 +19,27 @@ def download_kaggle_competition_dataset(credentials_path, competition_name, targ
 
     kaggle.api.competition_download_files(competition=competition_name, path=target_path, force=False, quiet=True)
     with ZipFile(f'{target_path}/{competition_name}.zip') as dataset_zip:
-        dataset_zip.extractall(target_path)
\ No newline at end of file
+        dataset_zip.extractall(target_path)
+
+def asof_join(df, dimension_df, on:str, value_columns:list[str]|None=None, by:list[str]|None=None):
+    """
+    Add to each row of df the value_columns of the latest row of dimension_df at or before its date, like pandas merge_asof, for sparse dimensions like the oil prices.
+    Rows of dimension_df with missing values are skipped, so each row gets the latest known values. Dates before the first known values get the first ones.
+    df doesn't need to be sorted: the as of matching is done on its distinct dates (and by columns), which are then merged into df by exact match.
+    on: The date column, in both dataframes, as dates or iso date strings.
+    by: Columns that must match exactly, for dimensions with one series per group, for example per store.
+    """
+    import pandas as pd
+    by = by or []
+    value_columns = value_columns or [column for column in dimension_df.columns if column != on and column not in by]
+    key_columns = [*by, on]
+
+    known_values = dimension_df.dropna(subset=value_columns)[[*key_columns, *value_columns]]
+    known_values = known_values.assign(asof_date=pd.to_datetime(known_values[on])).drop(columns=on).sort_values('asof_date')
+    distinct_keys = df[key_columns].drop_duplicates()
+    distinct_keys = distinct_keys.assign(asof_date=pd.to_datetime(distinct_keys[on])).sort_values('asof_date', ignore_index=True)
+
+    latest_values = pd.merge_asof(distinct_keys, known_values, on='asof_date', by=by or None, direction='backward')
+    first_values = pd.merge_asof(distinct_keys, known_values, on='asof_date', by=by or None, direction='forward')
+    latest_values[value_columns] = latest_values[value_columns].fillna(first_values[value_columns])
+    return df.merge(latest_values.drop(columns='asof_date'), on=key_columns, how='left')
@@ -1,11 +1,19 @@
 """ A file containing the db_interface that should be used,
     and its definition containing the logic making it work.
 """
-from typing import Iterable, LiteralString
+import io
+from contextlib import contextmanager
+from datetime import date
+from itertools import islice
+from typing import Iterable, Iterator, LiteralString, cast
 import psycopg
 #TODO rename, split, or remove create_engineering_user_if... from sql_utils
 import sql_utils
 from sql_utils import create_postgres_db
+from csv_sql_dataset_utils import CsvSqlDatasetProperties
+from table_specs import TableSpec
+from instrumentation import instrumented, current_span
+from providers import LazyProvider, make_module_getattr
 class DBInterface:
     """
     A class to allow modifiying our postgres database
@@ -15,6 +23,8 @@ class DBInterface:
         - allowing us to keep the db configuration/credentials in a single place.
             - preventing other classes from needing to obtain it.
     """
+    supports_unlogged_tables = True
+    supports_renaming_indexed_tables = True
     def __init__(
         self,
         db_host,
@@ -59,45 +69,288 @@ class DBInterface:
             if verbose:
                 print(f'Sucessfully created the postgres db: {self.db_name} at host={self.db_host} port={self.db_port} and the postgres user: {self.db_data_engineer_user}')
     
+    @instrumented()
     def create_table_columns_if_not_exist(self, table_name, sql_column_strings:Iterable[str]):
         connection = self._make_data_engineering_connection()
         sql_utils.create_table_columns_if_not_exist(table_name, sql_column_strings, connection)
         connection.close()
     
+    @instrumented()
     def execute_engineering_queries(self, queries, verbose=True):
+        """Execute the queries in a single transaction, if any of them fails they are all rolled back and the error is raised."""
         engineering_connection = self._make_data_engineering_connection()
-        sql_utils.execute_queries(queries, engineering_connection)
-        engineering_connection.close()
+        try:
+            sql_utils.execute_queries_in_transaction(queries, engineering_connection)
+        finally:
+            engineering_connection.close()
         
         if verbose:
             print(f'Sucesfully created the tables in host={self.db_host} port={self.db_port} db_name={self.db_name} . Queries used:')
             for query in queries: #Print the queries in an easily readable format without \n symbols
                 print(query)
     
+    def create_tables_of_specs(self, table_specs:Iterable[TableSpec], verbose=True):
+        """Create the tables, with their comments, indexes and partitioning, in a single transaction."""
+        self.execute_engineering_queries([creation_script for table_spec in table_specs for creation_script in table_spec.get_creation_scripts()], verbose)
+
+    def create_partitions_for_date_range(self, table_spec:TableSpec, first_date:date, last_date:date):
+        """Create the partitions the table needs to store rows from first_date to last_date, if it is partitioned and they don't exist yet."""
+        create_partitions_scripts = table_spec.get_create_partitions_scripts(first_date, last_date)
+        if create_partitions_scripts:
+            self.execute_engineering_queries(create_partitions_scripts, verbose=False)
+
+    @instrumented()
+    def execute_engineering_queries_concurrently(self, queries_per_table:Iterable[Iterable[str]], max_concurrency:int=4):
+        """
+        Execute each group of queries in its own transaction, with up to max_concurrency groups at the same time.
+        Meant for the DDL of independent tables, like per fold feature tables. Groups that fail are rolled back and raised together after the rest finish.
+        """
+        from async_db_interfacing import AsyncDBInterface, run_async
+        async def execute_queries_concurrently():
+            async with AsyncDBInterface.from_db_interface(self, max_concurrency) as async_db_interface:
+                await async_db_interface.execute_queries_concurrently(queries_per_table)
+        run_async(execute_queries_concurrently())
+
+    @instrumented()
+    def copy_new_csv_rows_concurrently(self, datasets_properties:Iterable[CsvSqlDatasetProperties], max_concurrency:int=4) -> dict[str,int]:
+        """
+        Load the csv rows that are not yet stored of each dataset with COPY, with up to max_concurrency tables at the same time.
+        The tables should not reference each other, load the referenced ones first. Returns the rows copied by table name.
+        """
+        from async_db_interfacing import AsyncDBInterface, run_async
+        async def copy_new_csv_rows_concurrently():
+            async with AsyncDBInterface.from_db_interface(self, max_concurrency) as async_db_interface:
+                return await async_db_interface.copy_new_csv_rows_concurrently(datasets_properties)
+        rows_copied_by_table_name = run_async(copy_new_csv_rows_concurrently())
+        current_span().set_rows_out(sum(rows_copied_by_table_name.values()))
+        return rows_copied_by_table_name
+
+    def get_table_names_starting_with(self, prefix:str) -> list[str]:
+        """The names of the tables of the current schema that start with prefix."""
+        engineering_connection = self._make_data_engineering_connection()
+        with engineering_connection.cursor() as cursor:
+            cursor.execute(sql_utils.get_table_names_starting_with_query, (prefix,))
+            table_names = [table_name for table_name, in cursor.fetchall()]
+        engineering_connection.close()
+        return table_names
+
+    @instrumented()
+    def copy_rows(self, table_name:str, column_names:Iterable[str], rows:Iterable) -> int:
+        """Bulk load rows into an existing table with COPY, streaming them, so any number of rows takes the same memory. Returns the rows copied."""
+        current_span().set_attribute('table_name', table_name)
+        rows_copied = 0
+        engineering_connection = self._make_data_engineering_connection()
+        try:
+            with engineering_connection.cursor() as cursor:
+                with cursor.copy(cast(LiteralString, f"COPY {table_name} ({', '.join(column_names)}) FROM STDIN")) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+                        rows_copied += 1
+            engineering_connection.commit()
+        finally:
+            engineering_connection.close()
+        current_span().set_rows_out(rows_copied)
+        return rows_copied
+
+    @contextmanager
+    def _open_query_as_arrow_batches(self, engineering_connection:psycopg.Connection, query:str, parameters:Iterable|None=None) -> Iterator:
+        """
+        Stream the result of a query with COPY (query) TO STDOUT as csv, parsed into arrow record batches by the arrow csv reader as the data arrives.
+        The arrow type of each column comes from its postgres type, so it doesn't depend on the rows of the first batch.
+        The reader is used in a with block, that ends the copy and closes its cursor, even when the batches weren't all read.
+        parameters: The values of the %s placeholders of the query.
+        """
+        import pyarrow.csv
+        with engineering_connection.cursor() as cursor:
+            cursor.execute(cast(LiteralString, f'SELECT * FROM ({query}) AS query_rows LIMIT 0'), parameters)
+            column_names = [column.name for column in cursor.description or []]
+            column_types = {column.name: get_arrow_type_of_postgres_type(engineering_connection, column.type_code) for column in cursor.description or []}
+        with engineering_connection.cursor() as copy_cursor, copy_cursor.copy(cast(LiteralString, f'COPY ({query}) TO STDOUT WITH (FORMAT csv)'), parameters) as copy:
+            batches = pyarrow.csv.open_csv(
+                CopyOutStream(copy),
+                read_options=pyarrow.csv.ReadOptions(column_names=column_names, block_size=16 * 2**20),
+                #COPY writes nulls as empty fields, and empty texts as "", booleans as t and f.
+                convert_options=pyarrow.csv.ConvertOptions(column_types=column_types, strings_can_be_null=True, quoted_strings_can_be_null=False, true_values=['t'], false_values=['f'])
+            )
+            try:
+                yield batches
+            finally:
+                batches.close()
+
+    @instrumented()
+    def query_as_arrow(self, query:str, parameters:Iterable|None=None):
+        """
+        Run a query in the database, returning the result as an arrow table, streamed with COPY instead of fetched row by row.
+        parameters: The values of the %s placeholders of the query.
+        """
+        engineering_connection = self._make_data_engineering_connection()
+        try:
+            with self._open_query_as_arrow_batches(engineering_connection, query, parameters) as batches:
+                table = batches.read_all()
+        finally:
+            engineering_connection.close()
+        current_span().set_rows_out(table.num_rows)
+        current_span().add_bytes_transferred(table.nbytes)
+        return table
+
+    @instrumented()
+    def export_query_to_parquet(self, query:str, output_path:str, partition_by:list[str]|None=None) -> int:
+        """
+        Write the result of a query as parquet files, partitioned hive style by the partition_by columns, replacing the partitions already in output_path.
+        The rows are streamed from the database into the files a batch at a time, so the result doesn't need to fit in memory. Returns the number of rows.
+        """
+        import pyarrow.dataset
+        engineering_connection = self._make_data_engineering_connection()
+        rows_written = 0
+        try:
+            def count_rows(batches):
+                nonlocal rows_written
+                for batch in batches:
+                    rows_written += batch.num_rows
+                    yield batch
+            with self._open_query_as_arrow_batches(engineering_connection, query) as batches:
+                pyarrow.dataset.write_dataset(
+                    count_rows(batches), output_path, schema=batches.schema, format='parquet',
+                    partitioning=partition_by, partitioning_flavor='hive' if partition_by else None, existing_data_behavior='delete_matching'
+                )
+        finally:
+            engineering_connection.close()
+        current_span().set_rows_out(rows_written)
+        return rows_written
+
+    def get_table_sizes_in_bytes(self, table_names:Iterable[str]) -> dict[str,int]:
+        """Get the size of each table, including its indexes and toasted values, from the postgres catalog. Tables that don't exist have size 0."""
+        table_names = list(table_names)
+        engineering_connection = self._make_data_engineering_connection()
+        with engineering_connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT table_name, COALESCE(pg_total_relation_size(to_regclass(table_name)), 0) FROM unnest(%s::text[]) AS table_name',
+                (table_names,)
+            )
+            table_sizes_in_bytes = {table_name: int(table_size) for table_name, table_size in cursor.fetchall()}
+        engineering_connection.close()
+        return table_sizes_in_bytes
+
+    @instrumented()
     def execute_multi_valued_query(self, query:LiteralString, values:Iterable):
         """
         Executes efficiently a query that needs to be applied to multiple rows with diferent values
         The most common examples being ALTER and UPDATE queries
         """
+        if hasattr(values, '__len__'):
+            current_span().set_rows_in(len(values)) # type: ignore <- Checked it has a length
         engineering_connection = self._make_data_engineering_connection()
         with engineering_connection.cursor() as cursor: #Automatically close the cursor when done
             cursor.executemany(query, values)
+            current_span().set_rows_out(cursor.rowcount)
             engineering_connection.commit()
             engineering_connection.close()
-    
-    
-    
 
-import os
-from dotenv import load_dotenv
-
-load_dotenv('.\db_settings.env') #Load the database configuration into
-db_interface = DBInterface(
-    os.getenv('db_host'),
-    os.getenv('db_port'),
-    os.getenv('db_admin_user'),
-    os.getenv('db_admin_password'),
-    os.getenv('db_data_engineer_user'),
-    os.getenv('db_data_engineer_password'),
-    os.getenv('db_name')
+    @instrumented()
+    def execute_multi_valued_query_in_chunks(
+        self,
+        query:LiteralString,
+        values:Iterable,
+        chunk_size:int=10_000,
+        commit_each_chunk:bool=False,
+        checkpoint_name:str|None=None
+    ) -> int:
+        """
+        Streaming version of execute_multi_valued_query, for values that don't fit in memory, like the rows of DataFrame.toLocalIterator().
+        Only one chunk of values is in memory at a time, and each chunk is sent with pipeline mode and a prepared statement,
+        so the rows don't wait for a round trip each, and the query is only parsed once.
+        commit_each_chunk: Commit after each chunk, so an error only rolls back the chunk it happened in, instead of every row.
+        checkpoint_name: Implies commit_each_chunk. The number of rows committed is saved with each chunk,
+            and rerunning with the same checkpoint_name skips them, continuing after the last committed chunk.
+            For that the values must come in the same order on every run. The checkpoint is deleted when all the rows are written.
+        Returns the number of rows affected.
+        """
+        commit_each_chunk = commit_each_chunk or checkpoint_name is not None
+        engineering_connection = self._make_data_engineering_connection()
+        engineering_connection.prepare_threshold = 0 #Prepare the query on its first execution instead of its fifth.
+        rows_written = 0
+        rows_affected = 0
+        try:
+            if checkpoint_name is not None:
+                rows_written = sql_utils.get_write_checkpoint(checkpoint_name, engineering_connection)
+                if rows_written:
+                    print(f'Resuming {checkpoint_name}, skipping the {rows_written} rows already committed.')
+                values = islice(values, rows_written, None)
+            with engineering_connection.cursor() as cursor:
+                for chunk in sql_utils.iterate_in_chunks(values, chunk_size):
+                    with engineering_connection.pipeline():
+                        cursor.executemany(query, chunk)
+                    rows_written += len(chunk)
+                    rows_affected += max(cursor.rowcount, 0)
+                    if checkpoint_name is not None:
+                        sql_utils.save_write_checkpoint(checkpoint_name, rows_written, engineering_connection)
+                    if commit_each_chunk:
+                        engineering_connection.commit()
+                if checkpoint_name is not None:
+                    sql_utils.delete_write_checkpoint(checkpoint_name, engineering_connection)
+                engineering_connection.commit()
+        except Exception:
+            engineering_connection.rollback()
+            raise
+        finally:
+            current_span().set_rows_in(rows_written)
+            current_span().set_rows_out(rows_affected)
+            engineering_connection.close()
+        return rows_affected
+
+
+
+class CopyOutStream(io.RawIOBase):
+    """A readable file over the blocks of data of a COPY TO STDOUT, so readers like the arrow csv reader can parse them as they arrive."""
+    def __init__(self, copy):
+        self._blocks = iter(copy)
+        self._pending_data = b''
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending_data:
+            try:
+                self._pending_data = bytes(next(self._blocks))
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self._pending_data))
+        buffer[:size] = self._pending_data[:size]
+        self._pending_data = self._pending_data[size:]
+        return size
+
+_arrow_type_name_by_postgres_type_name = dict(
+    int2='int16', int4='int32', int8='int64', float4='float32', float8='float64', numeric='float64',
+    text='string', varchar='string', bpchar='string', bool='bool', date='date32', timestamp='timestamp[us]',
 )
+
+def get_arrow_type_of_postgres_type(connection:psycopg.Connection, type_oid:int):
+    """The arrow type that stores the values of a postgres type, strings for the types without an equivalent."""
+    import pyarrow as pa
+    postgres_type = connection.adapters.types.get(type_oid)
+    arrow_type_name = _arrow_type_name_by_postgres_type_name.get(postgres_type.name if postgres_type else '', 'string')
+    return pa.timestamp('us') if arrow_type_name == 'timestamp[us]' else pa.type_for_alias(arrow_type_name)
+
+
+def _make_db_interface():
+    import os
+    from dotenv import load_dotenv
+    load_dotenv('.\db_settings.env') #Load the database configuration into
+    if os.getenv('storage_backend', 'postgres') == 'duckdb':
+        #An embedded database file, with the same methods, for running without a postgres server.
+        from duckdb_interfacing import DuckDBInterface
+        return DuckDBInterface(os.getenv('duckdb_path', './store_sales.duckdb'))
+    return DBInterface(
+        os.getenv('db_host'),
+        os.getenv('db_port'),
+        os.getenv('db_admin_user'),
+        os.getenv('db_admin_password'),
+        os.getenv('db_data_engineer_user'),
+        os.getenv('db_data_engineer_password'),
+        os.getenv('db_name')
+    )
+
+#Made when db_interface is first used, use db_interface_provider.override to inject another implementation.
+db_interface_provider:LazyProvider[DBInterface] = LazyProvider(_make_db_interface, name='db_interface')
+__getattr__ = make_module_getattr(__name__, {'db_interface': db_interface_provider})
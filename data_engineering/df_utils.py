@@ -1,5 +1,6 @@
 from pyspark.sql.dataframe import DataFrame
 from functools import reduce
+from spark_persistence import persist_in_current_scope
 
 def concat_spark_dfs(*dfs):
     """takes all the objects that you passed as parameters and reduces with python reduce them using unionAll"""
@@ -13,6 +14,8 @@ def find_matching_rows(df_to_filter:DataFrame, reference_df:DataFrame,  matching
     return df_to_filter
 
 def split_dataframe_sequentially(df:DataFrame, row_number_col:str, number_of_splits:int) -> list[DataFrame]:
+    #The count and every split read the dataframe, inside a persistence scope it is only read once.
+    df = persist_in_current_scope(df)
     total_rows = df.count()
     rows_per_split = total_rows // number_of_splits
     
@@ -23,4 +26,45 @@ def split_dataframe_sequentially(df:DataFrame, row_number_col:str, number_of_spl
         split_df = df.select(row_number_col).filter(f'({row_number_col} >= {split_start}) & ({row_number_col} < {split_end})')
         df_splits.append(split_df)
 
-    return df_splits
\ No newline at end of file
+    return df_splits
+
+def asof_join(df:DataFrame, dimension_df:DataFrame, on:str, value_columns:list[str], by:list[str]|None=None) -> DataFrame:
+    """
+    Add to each row of df the value_columns of the latest row of dimension_df at or before its date, for sparse daily dimensions like the oil prices.
+    Rows of dimension_df with missing values are skipped, dates before the first known values get the first ones, and after the last known values the last ones.
+    Instead of a range join, that compares every row of df with every row of the dimension, each known row of the small dimension is expanded into
+    one row per day until the next known row, so it can be broadcast and joined on the exact date.
+    on: The date column in both dataframes, of date type.
+    by: Columns that must match exactly, for dimensions with one series per group, for example per store.
+    """
+    from pyspark.sql import functions as F, Window
+    by = by or []
+    key_columns = [*by, on]
+    known_values = dimension_df.select(*key_columns, *value_columns).dropna(subset=value_columns)
+
+    by_date = Window.partitionBy(*by).orderBy(on)
+    values_by_day = (
+        known_values
+        .withColumn('_valid_until', F.coalesce(F.date_sub(F.lead(on).over(by_date), 1), F.col(on)))
+        .withColumn(on, F.explode(F.sequence(F.col(on), F.col('_valid_until'))))
+        .drop('_valid_until')
+    )
+    #The known values of the dates before the first, and after the last, known date.
+    by_date_all_rows = by_date.rowsBetween(Window.unboundedPreceding, Window.unboundedFollowing)
+    edge_values = (
+        known_values
+        .select(
+            *by,
+            F.min(on).over(by_date_all_rows).alias('_first_known_date'),
+            *[F.first(value_column).over(by_date_all_rows).alias(f'_first_{value_column}') for value_column in value_columns],
+            *[F.last(value_column).over(by_date_all_rows).alias(f'_last_{value_column}') for value_column in value_columns],
+        )
+    )
+    edge_values = edge_values.dropDuplicates(by) if by else edge_values.limit(1) #Every row of a group has the same edge values.
+
+    joined_df = df.join(F.broadcast(values_by_day), on=key_columns, how='left')
+    joined_df = joined_df.join(F.broadcast(edge_values), on=by, how='left') if by else joined_df.crossJoin(F.broadcast(edge_values))
+    for value_column in value_columns:
+        edge_value = F.when(F.col(on) < F.col('_first_known_date'), F.col(f'_first_{value_column}')).otherwise(F.col(f'_last_{value_column}'))
+        joined_df = joined_df.withColumn(value_column, F.coalesce(F.col(value_column), edge_value))
+    return joined_df.drop('_first_known_date', *[f'_first_{value_column}' for value_column in value_columns], *[f'_last_{value_column}' for value_column in value_columns])
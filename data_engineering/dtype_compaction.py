@@ -0,0 +1,143 @@
+"""
+Compaction of the dtypes of the pandas feature frame, and a report of its memory between the steps of the pipeline.
+After reading and merging the csvs, the strings are object columns, the ids int64 and the prices float64, which takes several times the memory needed.
+DtypeCompactor turns low cardinality strings into categories, downcasts the ints to the smallest width that fits them, and the floats to float32
+when it doesn't lose more precision than the tolerance. It decides the dtype of each column, including the width of the ints, on fit,
+so the train and test frames, and every chunk of the chunked preprocessing, get the same ones.
+
+Example usage:
+pipeline = create_pipeline(compact_dtypes=True, report_memory=True)
+"""
+import numpy as np
+import pandas as pd
+from sklearn.base import BaseEstimator, TransformerMixin
+from memory_utils import get_rss_bytes
+
+#From the narrowest, the signed ones only, like pd.to_numeric(downcast='integer').
+integer_dtypes = ['int8', 'int16', 'int32', 'int64']
+
+def get_memory_report(features_df:pd.DataFrame, label:str) -> str:
+    """The deep memory usage of the dataframe, counting the python strings of object columns, and the rss of the process."""
+    rss_bytes = get_rss_bytes()
+    rss_report = f', process rss {rss_bytes / 2**20:.1f} MiB' if rss_bytes is not None else ''
+    return f'{label}: {features_df.shape[0]} rows x {features_df.shape[1]} columns, {features_df.memory_usage(deep=True).sum() / 2**20:.1f} MiB{rss_report}'
+
+
+class DtypeCompactor(BaseEstimator, TransformerMixin):
+    """
+    Compacts the dtypes of a pandas dataframe, can be placed anywhere in a pipeline that passes dataframes between steps.
+    max_category_ratio: The string columns with at most this ratio of distinct values to rows become categories.
+    float32_tolerance: The maximum relative error allowed when turning a float64 column into float32. None to keep the floats as they are.
+    exclude_columns: The columns to leave as they are, for example ones a later step treats as python strings.
+    verbose: Print the memory used by the dataframe before and after compacting it.
+    """
+    def __init__(self, max_category_ratio:float=0.5, float32_tolerance:float|None=1e-6, exclude_columns:tuple[str, ...]=(), verbose:bool=False):
+        self.max_category_ratio = max_category_ratio
+        self.float32_tolerance = float32_tolerance
+        self.exclude_columns = exclude_columns
+        self.verbose = verbose
+
+    def _get_compact_dtype(self, column:pd.Series):
+        """The compact dtype of a column, or None to keep its dtype."""
+        if pd.api.types.is_object_dtype(column.dtype) or pd.api.types.is_string_dtype(column.dtype):
+            if len(column) > 0 and column.nunique(dropna=False) / len(column) <= self.max_category_ratio:
+                return 'category'
+        elif pd.api.types.is_bool_dtype(column.dtype):
+            return None
+        elif pd.api.types.is_integer_dtype(column.dtype) and isinstance(column.dtype, np.dtype): #The nullable ints are left as they are.
+            return self._get_integer_dtype(column)
+        elif column.dtype == np.float64 and self.float32_tolerance is not None:
+            values = column.to_numpy()
+            values_as_float32 = values.astype(np.float32)
+            #Values out of the float32 range become inf, which allclose doesn't consider close to the original.
+            if np.allclose(values, values_as_float32, rtol=self.float32_tolerance, atol=0, equal_nan=True):
+                return 'float32'
+        return None
+
+    @staticmethod
+    def _get_integer_dtype(column:pd.Series) -> str|None:
+        """The name of the smallest signed int dtype that fits the values of the column, None if it has no values or none fits them."""
+        if len(column) == 0:
+            return None
+        column_min, column_max = column.min(), column.max()
+        for integer_dtype in integer_dtypes:
+            integer_info = np.iinfo(integer_dtype)
+            if integer_info.min <= column_min and column_max <= integer_info.max:
+                return integer_dtype
+        return None
+
+    def _get_compact_dtype_by_column(self, features_df:pd.DataFrame) -> dict[str,str]:
+        if not isinstance(features_df, pd.DataFrame):
+            raise ValueError(f'DtypeCompactor requires a pandas DataFrame as input, but found: {type(features_df)}')
+        return {
+            column_name: compact_dtype
+            for column_name in features_df.columns
+            if column_name not in self.exclude_columns and (compact_dtype := self._get_compact_dtype(features_df[column_name])) is not None
+        }
+
+    def fit(self, features_df:pd.DataFrame, y=None):
+        self.compact_dtype_by_column_ = self._get_compact_dtype_by_column(features_df)
+        return self
+
+    def partial_fit(self, features_df:pd.DataFrame, y=None):
+        """
+        Fit on one more chunk of the data, keeping only the compact dtypes that every chunk agrees on.
+        The ints are widened to fit the values of every chunk.
+        """
+        if not hasattr(self, 'compact_dtype_by_column_'):
+            return self.fit(features_df)
+        compact_dtype_by_column_of_chunk = self._get_compact_dtype_by_column(features_df)
+        merged_compact_dtype_by_column = {}
+        for column_name, compact_dtype in self.compact_dtype_by_column_.items():
+            compact_dtype_of_chunk = compact_dtype_by_column_of_chunk.get(column_name)
+            if compact_dtype_of_chunk == compact_dtype:
+                merged_compact_dtype_by_column[column_name] = compact_dtype
+            elif compact_dtype in integer_dtypes and compact_dtype_of_chunk in integer_dtypes:
+                merged_compact_dtype_by_column[column_name] = np.promote_types(compact_dtype, compact_dtype_of_chunk).name
+        self.compact_dtype_by_column_ = merged_compact_dtype_by_column
+        return self
+
+    def transform(self, features_df:pd.DataFrame) -> pd.DataFrame:
+        if self.verbose:
+            print(get_memory_report(features_df, 'Before compacting the dtypes'))
+        compact_columns = {}
+        for column_name, compact_dtype in self.compact_dtype_by_column_.items():
+            if column_name not in features_df.columns:
+                continue
+            column = features_df[column_name]
+            if compact_dtype in integer_dtypes:
+                if not pd.api.types.is_integer_dtype(column.dtype): #For example made float by missing values.
+                    continue
+                #astype would wrap the values that don't fit around silently.
+                integer_info = np.iinfo(compact_dtype)
+                if len(column) > 0 and column.min() < integer_info.min or column.max() > integer_info.max:
+                    raise ValueError(f'The values of the column {column_name} are out of the range of {compact_dtype}, the width fit for it, refit the DtypeCompactor on data with them')
+            compact_columns[column_name] = column.astype(compact_dtype)
+        features_df = features_df.assign(**compact_columns)
+        if self.verbose:
+            print(get_memory_report(features_df, 'After compacting the dtypes'))
+        return features_df
+
+
+class MemoryReporter(BaseEstimator, TransformerMixin):
+    """A pipeline step that prints the memory used by the dataframe passing through it, and returns it as is."""
+    def __init__(self, label:str):
+        self.label = label
+
+    def fit(self, features_df, y=None):
+        return self
+
+    def transform(self, features_df):
+        print(get_memory_report(features_df, self.label))
+        return features_df
+
+def add_memory_reports(steps:list[tuple[str, object]]) -> list[tuple[str, object]]:
+    """
+    Add a MemoryReporter before the first step, and after every step but the last, which is usually the model.
+    The original steps keep their names, so the parameters set with their names keep working.
+    """
+    steps_with_memory_reports = [(f'memory_before_{steps[0][0]}', MemoryReporter(f'Before {steps[0][0]}'))]
+    for step_name, step in steps[:-1]:
+        steps_with_memory_reports.extend([(step_name, step), (f'memory_after_{step_name}', MemoryReporter(f'After {step_name}'))])
+    steps_with_memory_reports.append(steps[-1])
+    return steps_with_memory_reports
@@ -0,0 +1,271 @@
+""" A storage backend that keeps the tables in an embedded duckdb database file, instead of a postgres server.
+    DuckDBInterface and DuckDBSparkInterface have the same methods as DBInterface and SparkInterface, so they can be used in their place,
+    which is done when storage_backend=duckdb in db_settings.env.
+    That way the pipeline can be run, tested and benchmarked without any external service, and scans, counts and aggregates run in process on a columnar engine.
+"""
+import re
+from datetime import date
+from itertools import islice
+from typing import Iterable, LiteralString, cast
+import duckdb
+import pandas as pd
+import pyarrow as pa
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, DataFrame
+from spark_persistence import PersistenceScope
+from spark_profiles import get_spark_execution_profile
+import sql_utils
+from csv_sql_dataset_utils import CsvSqlDatasetProperties
+from table_specs import TableSpec
+
+def translate_psycopg_placeholders(query:str) -> str:
+    """Replace the %s placeholders psycopg uses with the ? placeholders duckdb uses"""
+    return re.sub(r'(?<!%)%s', '?', query).replace('%%', '%')
+
+def get_duckdb_spark_sql_options(database_path:str) -> dict[str,str]:
+    """The jdbc options to connect spark to a duckdb file, like get_spark_sql_options for postgres. The duckdb jdbc driver must be in the spark packages."""
+    return {
+        'driver': 'org.duckdb.DuckDBDriver',
+        'url': f'jdbc:duckdb:{database_path}',
+        'format': 'jdbc',
+        **get_spark_execution_profile().get_jdbc_options()
+    }
+
+class DuckDBInterface:
+    """
+    A class to modify a duckdb database, with the same methods as DBInterface, and the same parameters, tested in test_storage_backends.
+    It also has a few methods of its own, like get_table_as_pandas or replace_table, used by DuckDBSparkInterface.
+    There are no users in duckdb, so the methods related to them do nothing, and the file is created on the first connection.
+    Keep in mind only one process can write into a duckdb file at a time.
+    """
+    supports_unlogged_tables = False
+    supports_renaming_indexed_tables = False
+    def __init__(self, database_path:str='./store_sales.duckdb'):
+        self.database_path = database_path
+
+    def _make_data_engineering_connection(self) -> duckdb.DuckDBPyConnection:
+        return duckdb.connect(self.database_path)
+
+    def create_db(self):
+        self._make_data_engineering_connection().close()
+
+    def create_engineering_user_if_not_exists_and_allowed(self, verbose=True):
+        if verbose:
+            print(f'duckdb has no users, {self.database_path} can be modified by anyone who can write the file.')
+
+    def create_table_columns_if_not_exist(self, table_name, sql_column_strings:Iterable[str]):
+        #duckdb only allows one ADD COLUMN per ALTER TABLE statement, so they are executed one by one, in a single transaction.
+        self.execute_engineering_queries([f'ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {sql_column_string}' for sql_column_string in sql_column_strings], verbose=False)
+
+    def execute_engineering_queries(self, queries, verbose=True):
+        """Execute the queries, commiting the results only if they are all sucesfull, otherwise they are rolled back and the error raised."""
+        connection = self._make_data_engineering_connection()
+        connection.begin()
+        try:
+            for query in queries:
+                connection.execute(query)
+        except Exception as e:
+            print(f"{type(e).__name__}: {e}")
+            print(f"Query: {query}")
+            connection.rollback()
+            raise
+        else:
+            connection.commit()
+            if verbose:
+                print(f'Sucesfully executed the queries in {self.database_path}. Queries used:')
+                for query in queries:
+                    print(query)
+        finally:
+            connection.close()
+
+    def execute_multi_valued_query(self, query:LiteralString, values:Iterable):
+        """
+        Executes a query that needs to be applied to multiple rows with diferent values, written with psycopg %s placeholders.
+        To insert many rows append_rows is much faster, since it doesn't go row by row.
+        """
+        connection = self._make_data_engineering_connection()
+        try:
+            connection.executemany(translate_psycopg_placeholders(query), [tuple(row) for row in values])
+        finally:
+            connection.close()
+
+    def execute_multi_valued_query_in_chunks(
+        self,
+        query:LiteralString,
+        values:Iterable,
+        chunk_size:int=10_000,
+        commit_each_chunk:bool=False,
+        checkpoint_name:str|None=None
+    ) -> int:
+        """Same as DBInterface.execute_multi_valued_query_in_chunks, duckdb runs in process so there are no round trips to pipeline. Returns the number of rows written."""
+        commit_each_chunk = commit_each_chunk or checkpoint_name is not None
+        query = translate_psycopg_placeholders(query)
+        connection = self._make_data_engineering_connection()
+        rows_written = 0
+        try:
+            connection.begin()
+            if checkpoint_name is not None:
+                connection.execute(sql_utils.create_write_checkpoints_table_query)
+                checkpoint = connection.execute(translate_psycopg_placeholders(sql_utils.get_write_checkpoint_query), [checkpoint_name]).fetchone()
+                rows_written = checkpoint[0] if checkpoint else 0
+                values = islice(values, rows_written, None)
+            for chunk in sql_utils.iterate_in_chunks(values, chunk_size):
+                connection.executemany(query, [tuple(row) for row in chunk])
+                rows_written += len(chunk)
+                if checkpoint_name is not None:
+                    connection.execute(translate_psycopg_placeholders(sql_utils.save_write_checkpoint_query), [checkpoint_name, rows_written])
+                if commit_each_chunk:
+                    connection.commit()
+                    connection.begin()
+            if checkpoint_name is not None:
+                connection.execute(translate_psycopg_placeholders(sql_utils.delete_write_checkpoint_query), [checkpoint_name])
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+        return rows_written
+
+    def create_tables_of_specs(self, table_specs:Iterable[TableSpec], verbose=True):
+        """
+        duckdb has no declarative partitioning, its min max indexes of each row group already skip the dates not read, so the tables aren't partitioned.
+        It only has one kind of secondary index, so the index methods are left out.
+        """
+        self.execute_engineering_queries([
+            creation_script
+            for table_spec in table_specs
+            for creation_script in table_spec.get_creation_scripts(partitioned=False, with_index_methods=False)
+        ], verbose)
+
+    def create_partitions_for_date_range(self, table_spec:TableSpec, first_date:date, last_date:date):
+        pass #The tables aren't partitioned in duckdb.
+
+    def execute_engineering_queries_concurrently(self, queries_per_table:Iterable[Iterable[str]], max_concurrency:int=4):
+        """Same as DBInterface.execute_engineering_queries_concurrently, but one group after the other, since duckdb only has one writer at a time."""
+        for queries in queries_per_table:
+            self.execute_engineering_queries(list(queries), verbose=False)
+
+    def copy_new_csv_rows_concurrently(self, datasets_properties:Iterable[CsvSqlDatasetProperties], max_concurrency:int=4) -> dict[str,int]:
+        """Same as DBInterface.copy_new_csv_rows_concurrently, but one table after the other, since duckdb only has one writer at a time."""
+        rows_copied_by_table_name = {}
+        for dataset_properties in datasets_properties:
+            number_of_stored_rows = self.query_as_arrow(f'SELECT count(*) AS number_of_stored_rows FROM {dataset_properties.sql_table_name}')['number_of_stored_rows'][0].as_py()
+            new_rows = pd.read_csv(dataset_properties.csv_file_path, skiprows=range(1, number_of_stored_rows + 1))
+            new_rows = new_rows.rename(columns={csv_column_name: sql_column_name for sql_column_name, csv_column_name in dataset_properties.sql_col_csv_equivalents.items()})
+            self.append_rows(dataset_properties.sql_table_name, new_rows)
+            rows_copied_by_table_name[dataset_properties.sql_table_name] = len(new_rows)
+        return rows_copied_by_table_name
+
+    def get_table_names_starting_with(self, prefix:str) -> list[str]:
+        return self.query_as_arrow(sql_utils.get_table_names_starting_with_query, [prefix])['table_name'].to_pylist()
+
+    def copy_rows(self, table_name:str, column_names:Iterable[str], rows:Iterable) -> int:
+        """Same as DBInterface.copy_rows, inserting the rows in chunks. Returns the rows copied."""
+        column_names = list(column_names)
+        insert_query = cast(LiteralString, f"INSERT INTO {table_name} ({', '.join(column_names)}) VALUES ({', '.join(['%s'] * len(column_names))})")
+        return self.execute_multi_valued_query_in_chunks(insert_query, rows)
+
+    def get_table_sizes_in_bytes(self, table_names:Iterable[str]) -> dict[str,int]:
+        """Estimate the size of each table from its estimated row count and number of columns, assuming 8 bytes per value, since duckdb doesn't keep the size per table."""
+        table_names = list(table_names)
+        table_sizes = self.query_as_arrow(
+            'SELECT table_name, estimated_size * column_count * 8 AS size_in_bytes FROM duckdb_tables() WHERE list_contains(%s, table_name)',
+            [table_names]
+        ).to_pylist()
+        size_in_bytes_by_table_name = {table_size['table_name']: int(table_size['size_in_bytes']) for table_size in table_sizes}
+        return {table_name: size_in_bytes_by_table_name.get(table_name, 0) for table_name in table_names}
+
+    def append_rows(self, table_name:str, rows:pd.DataFrame|pa.Table):
+        """Bulk insert the rows of a pandas dataframe or arrow table into an existing table, matching the columns by name."""
+        connection = self._make_data_engineering_connection()
+        try:
+            connection.register('rows_to_append', rows)
+            column_names = ', '.join(rows.columns if isinstance(rows, pd.DataFrame) else rows.column_names)
+            connection.execute(f'INSERT INTO {table_name} ({column_names}) SELECT {column_names} FROM rows_to_append')
+        finally:
+            connection.close()
+
+    def replace_table(self, table_name:str, rows:pd.DataFrame|pa.Table):
+        """Create or overwrite a table with the rows of a pandas dataframe or arrow table."""
+        connection = self._make_data_engineering_connection()
+        try:
+            connection.register('rows_to_store', rows)
+            connection.execute(f'CREATE OR REPLACE TABLE {table_name} AS SELECT * FROM rows_to_store')
+        finally:
+            connection.close()
+
+    def replace_table_rows(self, table_name:str, rows:pd.DataFrame|pa.Table):
+        """Replace the rows of an existing table, keeping its columns types and indexes, in a single transaction."""
+        connection = self._make_data_engineering_connection()
+        try:
+            connection.begin()
+            connection.register('rows_to_store', rows)
+            column_names = ', '.join(rows.columns if isinstance(rows, pd.DataFrame) else rows.column_names)
+            connection.execute(f'DELETE FROM {table_name}')
+            connection.execute(f'INSERT INTO {table_name} ({column_names}) SELECT {column_names} FROM rows_to_store')
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        finally:
+            connection.close()
+
+    def query_as_arrow(self, query:str, parameters:Iterable|None=None) -> pa.Table:
+        """Run a query, for example a scan, count or aggregate, returning the result as an arrow table without converting it row by row."""
+        connection = self._make_data_engineering_connection()
+        try:
+            result = connection.execute(translate_psycopg_placeholders(query), parameters).arrow()
+            #Newer duckdb versions return a reader of the record batches instead of a table.
+            return result.read_all() if isinstance(result, pa.RecordBatchReader) else result
+        finally:
+            connection.close()
+
+    def export_query_to_parquet(self, query:str, output_path:str, partition_by:list[str]|None=None) -> int:
+        """Write the result of a query as parquet files, partitioned hive style by the partition_by columns, with the native COPY of duckdb. Returns the number of rows."""
+        partitioning_options = f", PARTITION_BY ({', '.join(partition_by)}), OVERWRITE_OR_IGNORE" if partition_by else ''
+        connection = self._make_data_engineering_connection()
+        try:
+            rows_written = connection.execute(cast(LiteralString, f"COPY ({query}) TO '{output_path}' (FORMAT parquet{partitioning_options})")).fetchone()
+        finally:
+            connection.close()
+        return rows_written[0] if rows_written else 0
+
+    def get_table_as_arrow(self, table_name:str, column_names:Iterable[str]|None=None) -> pa.Table:
+        return self.query_as_arrow(f"SELECT {', '.join(column_names) if column_names else '*'} FROM {table_name}")
+
+    def get_table_as_pandas(self, table_name:str, column_names:Iterable[str]|None=None) -> pd.DataFrame:
+        return self.get_table_as_arrow(table_name, column_names).to_pandas()
+
+
+class DuckDBSparkInterface:
+    """
+    A class with the same methods and attributes as SparkInterface, that reads and writes the tables of a duckdb database, moving them through arrow.
+    spark_sql_options: For the code that writes with spark jdbc directly, like SparkTableStorageHandler, through the duckdb jdbc driver.
+    """
+    def __init__(self, spark:SparkSession, duckdb_interface:DuckDBInterface):
+        self.spark = spark
+        self.duckdb_interface = duckdb_interface
+        self.spark_sql_options = get_duckdb_spark_sql_options(duckdb_interface.database_path)
+        #Makes the conversions between spark and pandas go through arrow, instead of row by row.
+        self.spark.conf.set('spark.sql.execution.arrow.pyspark.enabled', 'true')
+
+    def get_current_data_in_sql_table(self, table_name:str) -> DataFrame:
+        """Get the data in a duckdb table as a spark dataframe. Unlike with jdbc, the data is read when called, not lazily."""
+        return self.spark.createDataFrame(self.duckdb_interface.get_table_as_pandas(table_name))
+
+    def get_data_in_sql_table_between_dates(self, table_name:str, first_date, last_date, date_column:str='date') -> DataFrame:
+        """Get the rows of a duckdb table from first_date to last_date, both included, filtering them in duckdb before moving them to spark."""
+        rows_between_dates = self.duckdb_interface.query_as_arrow(f'SELECT * FROM {table_name} WHERE {date_column} BETWEEN %s AND %s', [first_date, last_date])
+        return self.spark.createDataFrame(rows_between_dates.to_pandas())
+
+    def save_table(self, table:DataFrame, table_name:str, truncate:bool=False):
+        """Save a spark dataframe into a duckdb table, overwritting any existing table, or emptying it and keeping its column types if truncate."""
+        if truncate:
+            self.duckdb_interface.replace_table_rows(table_name, table.toPandas())
+        else:
+            self.duckdb_interface.replace_table(table_name, table.toPandas())
+
+    def persistence_scope(self, storage_level:StorageLevel=StorageLevel.MEMORY_AND_DISK, name:str='persistence_scope') -> PersistenceScope:
+        """Same as SparkInterface.persistence_scope, here it avoids recomputing the transformations of dataframes already read into spark."""
+        return PersistenceScope(self.spark, storage_level, name)
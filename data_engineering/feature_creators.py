@@ -61,10 +61,10 @@ class feature_provider:
 
 #Option 0, execute query directly for obtaining features, then for 
 from pyspark.sql import SparkSession
+from spark_profiles import get_spark_execution_profile
 spark_session_builder:SparkSession.Builder = SparkSession.builder # type: ignore <-Ignore a wrong pylance warning, and make type detection work properly
 spark:SparkSession = (
-    spark_session_builder
-    .master('local[3]')
+    get_spark_execution_profile().configure_builder(spark_session_builder)
     .appName('TimeSeriesForecastStoreSales Data Engineering')
     .getOrCreate()
 )
@@ -0,0 +1,270 @@
+"""
+Instrumentation of the ingestion and feature engineering stages, to find out which part of a run was slow.
+Each instrumented stage is a span, that records its wall time, rows in and out, bytes transferred, and when it runs spark jobs,
+their job and stage ids, with the task metrics of the stages.
+Spans are written as json lines to spans.jsonl, one per finished span, and the totals of each span name to a prometheus textfile,
+that node_exporter textfile collector can scrape, so runs can be compared over time.
+Recording is off by default, it's turned on with the instrumentation_enabled env variable or configure_instrumentation(enabled=True).
+The task metrics of the spark stages take a request to the spark rest api per stage, so they are only fetched when spark_stage_metrics is on too,
+otherwise the stages only have the task counts of the status tracker.
+
+Example usage:
+configure_instrumentation(enabled=True, spark_stage_metrics=True)
+
+@instrumented('FeatureGroup.update_columns')
+def update_columns(self, df):
+    column_values = df.collect()
+    current_span().set_rows_in(len(column_values))
+
+with instrumented_span('collect', spark=spark) as span:
+    rows = df.collect()
+    span.set_rows_out(len(rows))
+    span.add_bytes_transferred(estimate_rows_bytes(rows))
+"""
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterable, Iterator
+
+_output_path:str = os.getenv('instrumentation_path', './instrumentation')
+_enabled:bool = os.getenv('instrumentation_enabled', 'false').lower() == 'true'
+_spark_stage_metrics_enabled:bool = os.getenv('instrumentation_spark_stage_metrics', 'false').lower() == 'true'
+#Identifies the spans of this run, to compare runs with each other. Can be set from outside to group multiple processes.
+run_id:str = os.getenv('instrumentation_run_id', datetime.now().strftime('%Y%m%dT%H%M%S') + '_' + uuid.uuid4().hex[:6])
+
+_write_lock = threading.Lock()
+#Totals by span name and status, for the prometheus textfile.
+_totals_by_span_name_and_status:dict[tuple[str, str], dict[str, float]] = {}
+
+def configure_instrumentation(output_path:str|None=None, enabled:bool|None=None, spark_stage_metrics:bool|None=None):
+    """
+    Change where the spans are written, enable or disable recording them, and fetching the task metrics of the spark stages from the rest api.
+    By default they come from the instrumentation_path, instrumentation_enabled and instrumentation_spark_stage_metrics env variables.
+    """
+    global _output_path, _enabled, _spark_stage_metrics_enabled
+    if output_path is not None:
+        _output_path = output_path
+    if enabled is not None:
+        _enabled = enabled
+    if spark_stage_metrics is not None:
+        _spark_stage_metrics_enabled = spark_stage_metrics
+
+
+class Span:
+    """A stage being measured. The stage sets the rows and bytes it handled, the rest is measured by instrumented_span."""
+    def __init__(self, name:str, parent:'Span|None'=None, **attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attributes:dict[str, Any] = attributes
+        self.rows_in:int|None = None
+        self.rows_out:int|None = None
+        self.bytes_transferred:int|None = None
+        self.spark_jobs:list[dict] = []
+
+    def set_rows_in(self, rows_in:int):
+        self.rows_in = rows_in
+
+    def set_rows_out(self, rows_out:int):
+        self.rows_out = rows_out
+
+    def add_bytes_transferred(self, bytes_transferred:int):
+        self.bytes_transferred = (self.bytes_transferred or 0) + bytes_transferred
+
+    def set_attribute(self, key:str, value):
+        self.attributes[key] = value
+
+_current_span:ContextVar[Span|None] = ContextVar('current_span', default=None)
+
+def current_span() -> Span:
+    """The span of the innermost running stage. If there is none, a span that is never recorded is returned, so stages can always set their rows."""
+    return _current_span.get() or Span('unrecorded')
+
+
+def estimate_rows_bytes(rows:list, sample_size:int=1000) -> int:
+    """Estimate the memory taken by collected rows from a sample of them, since measuring every value would take as long as the transfer."""
+    if not rows:
+        return 0
+    sample = rows[:sample_size]
+    sample_bytes = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return int(sample_bytes / len(sample) * len(rows))
+
+def iterate_adding_rows_bytes(rows:Iterable, span:Span, sample_size:int=1000) -> Iterator:
+    """
+    Pass through the rows streamed to the driver, like those of DataFrame.toLocalIterator(), and when they run out add an estimate of their bytes to the span.
+    The estimate comes from the first sample_size rows, so only those are kept in memory.
+    """
+    sample = []
+    number_of_rows = 0
+    try:
+        for row in rows:
+            if number_of_rows < sample_size:
+                sample.append(row)
+            number_of_rows += 1
+            yield row
+    finally:
+        if sample:
+            span.add_bytes_transferred(int(estimate_rows_bytes(sample) / len(sample) * number_of_rows))
+
+
+def _get_spark_stage_metrics(spark, stage_id:int) -> dict:
+    """
+    Get the task metrics of a stage from the spark rest api, when spark_stage_metrics is enabled.
+    Otherwise, or if the ui is disabled, only the task counts of the status tracker are available.
+    """
+    spark_context = spark.sparkContext
+    if _spark_stage_metrics_enabled and spark_context.uiWebUrl:
+        try:
+            stage_url = f'{spark_context.uiWebUrl}/api/v1/applications/{spark_context.applicationId}/stages/{stage_id}'
+            with urllib.request.urlopen(stage_url, timeout=5) as response:
+                stage_attempts = json.load(response)
+            metric_names = [
+                'numTasks', 'numFailedTasks', 'executorRunTime', 'executorCpuTime', 'jvmGcTime', 'inputBytes', 'inputRecords', 'outputBytes', 'outputRecords',
+                'shuffleReadBytes', 'shuffleReadRecords', 'shuffleWriteBytes', 'shuffleWriteRecords', 'memoryBytesSpilled', 'diskBytesSpilled',
+            ]
+            return {'stage_id': stage_id, 'attempts': len(stage_attempts), **{metric_name: sum(attempt.get(metric_name, 0) for attempt in stage_attempts) for metric_name in metric_names}}
+        except Exception as e:
+            print(f'Could not get the metrics of spark stage {stage_id} from the spark rest api: {e!r}')
+
+    stage_info = spark_context.statusTracker().getStageInfo(stage_id)
+    if stage_info is None:
+        return {'stage_id': stage_id}
+    return {'stage_id': stage_id, 'numTasks': stage_info.numTasks, 'numCompletedTasks': stage_info.numCompletedTasks, 'numFailedTasks': stage_info.numFailedTasks}
+
+def _get_spark_jobs_of_group(spark, job_group_id:str) -> list[dict]:
+    status_tracker = spark.sparkContext.statusTracker()
+    spark_jobs = []
+    for job_id in sorted(status_tracker.getJobIdsForGroup(job_group_id)):
+        job_info = status_tracker.getJobInfo(job_id)
+        stage_ids = list(job_info.stageIds) if job_info is not None else []
+        spark_jobs.append({
+            'job_id': job_id,
+            'status': job_info.status if job_info is not None else None,
+            'stages': [_get_spark_stage_metrics(spark, stage_id) for stage_id in stage_ids],
+        })
+    return spark_jobs
+
+
+def _escape_prometheus_label(value:str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _write_prometheus_textfile():
+    """Rewrite the textfile with the totals of every span name. It's written to a temporary file and renamed, so it's never read half written."""
+    metric_definitions = [
+        ('store_sales_span_calls_total', 'counter', 'calls', 'Number of times the stage ran'),
+        ('store_sales_span_duration_seconds_total', 'counter', 'seconds', 'Total wall time of the stage'),
+        ('store_sales_span_last_duration_seconds', 'gauge', 'last_seconds', 'Wall time of the last run of the stage'),
+        ('store_sales_span_rows_in_total', 'counter', 'rows_in', 'Rows received by the stage'),
+        ('store_sales_span_rows_out_total', 'counter', 'rows_out', 'Rows produced by the stage'),
+        ('store_sales_span_bytes_transferred_total', 'counter', 'bytes_transferred', 'Bytes the stage moved between processes'),
+    ]
+    lines = []
+    for metric_name, metric_type, total_name, description in metric_definitions:
+        lines += [f'# HELP {metric_name} {description}', f'# TYPE {metric_name} {metric_type}']
+        for (span_name, status), totals in sorted(_totals_by_span_name_and_status.items()):
+            lines.append(f'{metric_name}{{span="{_escape_prometheus_label(span_name)}",status="{status}",run_id="{run_id}"}} {totals[total_name]}')
+    textfile_path = os.path.join(_output_path, 'store_sales_pipeline.prom')
+    with open(f'{textfile_path}.tmp', 'w') as textfile:
+        textfile.write('\n'.join(lines) + '\n')
+    os.replace(f'{textfile_path}.tmp', textfile_path)
+
+def _record_span(span_record:dict):
+    with _write_lock:
+        os.makedirs(_output_path, exist_ok=True)
+        with open(os.path.join(_output_path, 'spans.jsonl'), 'a') as spans_file:
+            spans_file.write(json.dumps(span_record, default=str) + '\n')
+
+        totals = _totals_by_span_name_and_status.setdefault((span_record['name'], span_record['status']), dict.fromkeys(['calls', 'seconds', 'last_seconds', 'rows_in', 'rows_out', 'bytes_transferred'], 0))
+        totals['calls'] += 1
+        totals['seconds'] += span_record['wall_seconds']
+        totals['last_seconds'] = span_record['wall_seconds']
+        for total_name in ('rows_in', 'rows_out', 'bytes_transferred'):
+            totals[total_name] += span_record[total_name] or 0
+        _write_prometheus_textfile()
+
+
+@contextmanager
+def instrumented_span(name:str, spark=None, **attributes) -> Iterator[Span]:
+    """
+    Measure the stage run inside the with block.
+    spark: The spark session the stage runs jobs on, if any. The jobs are put in a job group of the span, to find their ids and metrics afterwards.
+    The jobs of a nested span with its own spark session are recorded on the nested span.
+    """
+    span = Span(name, _current_span.get(), **attributes)
+    if not _enabled:
+        yield span
+        return
+
+    context_token = _current_span.set(span)
+    if spark is not None:
+        spark_context = spark.sparkContext
+        previous_job_group = spark_context.getLocalProperty('spark.jobGroup.id')
+        previous_job_description = spark_context.getLocalProperty('spark.job.description')
+        spark_context.setJobGroup(span.span_id, name)
+
+    started_at = datetime.now(timezone.utc)
+    start_time = time.perf_counter()
+    status, error = 'ok', None
+    try:
+        yield span
+    except BaseException as e:
+        status, error = 'error', repr(e)
+        raise
+    finally:
+        wall_seconds = time.perf_counter() - start_time
+        _current_span.reset(context_token)
+        if spark is not None:
+            spark_context.setLocalProperty('spark.jobGroup.id', previous_job_group)
+            spark_context.setLocalProperty('spark.job.description', previous_job_description)
+            try:
+                span.spark_jobs = _get_spark_jobs_of_group(spark, span.span_id)
+            except Exception as e:
+                print(f'Could not get the spark jobs of span {name}: {e!r}')
+
+        _record_span({
+            'run_id': run_id,
+            'span_id': span.span_id,
+            'parent_span_id': span.parent.span_id if span.parent is not None else None,
+            'name': name,
+            'started_at': started_at.isoformat(),
+            'wall_seconds': wall_seconds,
+            'status': status,
+            'error': error,
+            'rows_in': span.rows_in,
+            'rows_out': span.rows_out,
+            'bytes_transferred': span.bytes_transferred,
+            'spark_jobs': span.spark_jobs,
+            'attributes': span.attributes,
+        })
+
+
+def find_spark_session(instance):
+    """Find the spark session used by an instrumented method's object, so its jobs can be measured."""
+    for candidate in (instance, getattr(instance, 'spark_interface', None)):
+        spark = getattr(candidate, 'spark', None)
+        if spark is not None and hasattr(spark, 'sparkContext'):
+            return spark
+    return None
+
+def instrumented(name:str|None=None) -> Callable:
+    """
+    Decorator that runs a method inside an instrumented_span, named by default after its class and name.
+    When the object has a spark session, as spark or spark_interface.spark, the spark jobs the method runs are measured too.
+    """
+    def decorator(method:Callable) -> Callable:
+        span_name = name or method.__qualname__
+        @functools.wraps(method)
+        def instrumented_method(*args, **kwargs):
+            spark = find_spark_session(args[0]) if args else None
+            with instrumented_span(span_name, spark=spark):
+                return method(*args, **kwargs)
+        return instrumented_method
+    return decorator
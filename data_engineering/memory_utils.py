@@ -0,0 +1,21 @@
+"""Measure the memory of this process, for the memory reports of the pandas pipeline and the tuning trials."""
+import os
+
+try:
+    import resource #Only available on unix systems.
+except ImportError:
+    resource = None
+
+def get_peak_rss_bytes() -> int|None:
+    """Get the peak resident set size of this process in bytes, None if it can't be known."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 #Linux reports it in kilobytes
+
+def get_rss_bytes() -> int|None:
+    """Get the current resident set size of this process in bytes, or the peak one where the current one can't be read, None if neither can."""
+    try:
+        with open('/proc/self/statm') as statm_file:
+            return int(statm_file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return get_peak_rss_bytes()
@@ -0,0 +1,137 @@
+"""
+Run per series transforms, like the windowing and the date expansion of data_preparation_attempt4, on a process pool instead of a single thread.
+The roughly 1800 store and product family series are independent, so they are split into contiguous shards of whole series, one task per shard.
+Instead of pickling a DataFrame for every task, the frame is written once as an arrow ipc file in shared memory (/dev/shm where available),
+that every worker memory maps, reading its shard without copying the rest. Each worker writes its results the same way,
+and the results are put back together in the original order of the rows, with their original index.
+
+Example usage:
+series_executor = ParallelSeriesExecutor([
+    functools.partial(data_prep.replace_date_with_date_related_columns, start_date='2013-01-01'),
+    functools.partial(data_prep.rolling_window_dataset, window_size=3),
+])
+features_df = series_executor.transform(merged_features_df)
+"""
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+SeriesTransform = Callable[[pd.DataFrame], pd.DataFrame]
+
+def _write_arrow_file(df:pd.DataFrame, file_path:str):
+    table = pa.Table.from_pandas(df, preserve_index=True)
+    with pa.OSFile(file_path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+def _read_arrow_file(file_path:str) -> pa.Table:
+    """Read an arrow ipc file memory mapped, so its buffers are the pages of the file, shared by every process that reads it."""
+    with pa.memory_map(file_path, 'r') as source:
+        return pa.ipc.open_file(source).read_all()
+
+def transform_each_series(df:pd.DataFrame, series_ids:np.ndarray, series_transforms:Iterable[SeriesTransform]) -> pd.DataFrame:
+    """
+    Apply the transforms to each series of df, one after the other. df must have the rows of each series together.
+    Each series is transformed with a positional index, like a frame of its own, and gets its index back afterwards,
+    so the transforms must keep the number and order of the rows.
+    """
+    series_transforms = list(series_transforms)
+    series_starts = np.flatnonzero(np.r_[True, series_ids[1:] != series_ids[:-1]])
+    series_ends = np.r_[series_starts[1:], len(df)]
+    transformed_series = []
+    for series_start, series_end in zip(series_starts, series_ends):
+        series_df = df.iloc[series_start:series_end]
+        transformed_series_df = series_df.reset_index(drop=True)
+        for series_transform in series_transforms:
+            transformed_series_df = series_transform(transformed_series_df)
+        if len(transformed_series_df) != len(series_df):
+            raise ValueError(f'The per series transforms changed the number of rows of a series from {len(series_df)} to {len(transformed_series_df)}')
+        transformed_series_df.index = series_df.index
+        transformed_series.append(transformed_series_df)
+    return pd.concat(transformed_series)
+
+def _transform_series_shard(input_path:str, row_start:int, row_end:int, series_transforms:list[SeriesTransform], output_path:str) -> int:
+    """Process pool task, transforming the series in rows row_start to row_end of the input file, and writing them to output_path. Returns the rows written."""
+    table = _read_arrow_file(input_path)
+    shard = table.slice(row_start, row_end - row_start).to_pandas()
+    series_ids = shard.pop('_series_id').to_numpy()
+    transformed_shard = transform_each_series(shard, series_ids, series_transforms)
+    _write_arrow_file(transformed_shard, output_path)
+    return len(transformed_shard)
+
+
+class ParallelSeriesExecutor:
+    """
+    Runs a list of per series transforms on a process pool, sharding the series across the workers.
+    series_transforms: Functions that take the rows of a single series, with a positional index, and return them transformed, in the same order.
+    They are sent to the workers pickled, so they must be module level functions, or functools.partial of them.
+    series_columns: The columns that identify each series.
+    n_workers: The processes of the pool, the number of cores if None.
+    shards_per_worker: More shards than workers balance the load when some series take longer than others.
+    """
+    def __init__(
+        self,
+        series_transforms:list[SeriesTransform],
+        series_columns:tuple[str, ...]=('store_nbr', 'product_family'),
+        n_workers:int|None=None,
+        shards_per_worker:int=4,
+        shared_memory_path:str|None='/dev/shm'
+    ):
+        self.series_transforms = series_transforms
+        self.series_columns = series_columns
+        self.n_workers = n_workers or os.cpu_count() or 1
+        self.shards_per_worker = shards_per_worker
+        #tmpfs, so the arrow files are never written to disk. The default temporary folder is used where there is none.
+        self.shared_memory_path = shared_memory_path if shared_memory_path is not None and os.path.isdir(shared_memory_path) else None
+
+    def _get_shard_boundaries(self, series_ids:np.ndarray) -> list[tuple[int, int]]:
+        """Split the rows, sorted by series, into shards of about the same number of rows, without splitting any series."""
+        series_starts = np.flatnonzero(np.r_[True, series_ids[1:] != series_ids[:-1]])
+        number_of_shards = min(len(series_starts), self.n_workers * self.shards_per_worker)
+        target_shard_starts = np.linspace(0, len(series_ids), number_of_shards, endpoint=False)
+        shard_starts = np.unique(series_starts[np.searchsorted(series_starts, target_shard_starts, side='right') - 1])
+        shard_ends = np.r_[shard_starts[1:], len(series_ids)]
+        return list(zip(shard_starts.tolist(), shard_ends.tolist()))
+
+    def transform(self, df:pd.DataFrame, series_ids:pd.Series|None=None) -> pd.DataFrame:
+        """
+        Transform each series of df, returning the transformed rows in the order and with the index of df.
+        series_ids: The series of each row, aligned with df, for frames that no longer have the series columns, for example after one hot encoding.
+        """
+        if len(df) == 0:
+            return df
+        start_time = time.perf_counter()
+        if series_ids is None:
+            series_ids = df.groupby(list(self.series_columns), sort=False, dropna=False).ngroup()
+        original_index = df.index
+        #The position of each row is used as index while transforming, to put the rows back in order afterwards.
+        df = df.set_axis(pd.RangeIndex(len(df))).assign(_series_id=series_ids.to_numpy())
+        df = df.sort_values('_series_id', kind='stable')
+        shard_boundaries = self._get_shard_boundaries(df['_series_id'].to_numpy())
+
+        work_dir = tempfile.mkdtemp(prefix='parallel_series_', dir=self.shared_memory_path)
+        try:
+            input_path = os.path.join(work_dir, 'input.arrow')
+            _write_arrow_file(df, input_path)
+            del df
+            output_paths = [os.path.join(work_dir, f'shard_{shard_number:05d}.arrow') for shard_number in range(len(shard_boundaries))]
+            with ProcessPoolExecutor(min(self.n_workers, len(shard_boundaries))) as executor:
+                shard_futures = [
+                    executor.submit(_transform_series_shard, input_path, row_start, row_end, self.series_transforms, output_path)
+                    for (row_start, row_end), output_path in zip(shard_boundaries, output_paths)
+                ]
+                for shard_future in shard_futures:
+                    shard_future.result() #Raise the errors of the workers.
+
+            transformed_df = pa.concat_tables([_read_arrow_file(output_path) for output_path in output_paths], promote_options='default').to_pandas()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        transformed_df = transformed_df.sort_index().set_axis(original_index)
+        print(f'Transformed {len(transformed_df)} rows in {len(shard_boundaries)} shards of series on {self.n_workers} processes in {time.perf_counter() - start_time:.2f}s')
+        return transformed_df
@@ -0,0 +1,212 @@
+"""
+Run hyperparameter search trials for the model of create_pipeline in parallel, in a process pool.
+The features are preprocessed only once, and stored as a numpy memmap, so all the workers read the same feature matrix from the page cache
+instead of each one getting a pickled copy of it, or rebuilding it.
+Each worker's xgboost thread count is set so that trials * threads matches the available cores.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Callable, Iterable, NamedTuple
+import numpy as np
+import pandas as pd
+from xgboost import XGBRegressor
+from data_preparation_attempt4 import create_pipeline
+from memory_utils import get_peak_rss_bytes
+
+
+class SharedFeatureMatrix(NamedTuple):
+    """The paths of the memmapped features and target, along with the number of rows used for training, the rest being used for validation."""
+    features_path: str
+    target_path: str
+    number_of_train_rows: int
+    feature_names: list[str]
+
+class TrialResult(NamedTuple):
+    model_params: dict
+    validation_rmsle: float
+    fit_seconds: float
+    worker_peak_rss_bytes: int|None
+
+class ParallelSearchReport(NamedTuple):
+    trial_results: list[TrialResult]
+    best_trial: TrialResult
+    trials_per_hour: float
+    peak_rss_bytes: int|None
+
+
+def make_shared_feature_matrix(merged_features_df:pd.DataFrame, y:pd.Series, window_size:int, validation_fraction:float, work_dir:str) -> SharedFeatureMatrix:
+    """
+    Preprocess the features once using create_pipeline, and store them as float32 .npy files that can be memory mapped by the workers.
+    The preprocessing is fit on the train rows only, the last validation_fraction of the rows (the latest dates) are used for validation.
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    number_of_train_rows = int(len(merged_features_df) * (1 - validation_fraction))
+
+    preprocessing_pipeline = create_pipeline(window_size)[:-1] #Everything but the model
+    preprocessing_pipeline.fit(merged_features_df.iloc[:number_of_train_rows].copy(), y.iloc[:number_of_train_rows])
+    features_df:pd.DataFrame = preprocessing_pipeline.transform(merged_features_df.copy())
+
+    features_path = os.path.join(work_dir, 'features.npy')
+    target_path = os.path.join(work_dir, 'target.npy')
+    #Write the features directly into the memmapped file, to avoid having another full copy of them in memory.
+    features_memmap = np.lib.format.open_memmap(features_path, mode='w+', dtype='float32', shape=features_df.shape)
+    for column_number, column_name in enumerate(features_df.columns):
+        features_memmap[:, column_number] = features_df[column_name].to_numpy(dtype='float32')
+    features_memmap.flush()
+    np.save(target_path, y.to_numpy(dtype='float32'))
+
+    return SharedFeatureMatrix(features_path, target_path, number_of_train_rows, list(features_df.columns))
+
+
+#Set once on each worker by _open_shared_feature_matrix, so the trials in that worker don't need to open the files again.
+_worker_features:np.ndarray|None = None
+_worker_target:np.ndarray|None = None
+_worker_number_of_train_rows:int = 0
+
+def _open_shared_feature_matrix(shared_feature_matrix:SharedFeatureMatrix):
+    """Process pool initializer, that memory maps the shared feature matrix in read only mode."""
+    global _worker_features, _worker_target, _worker_number_of_train_rows
+    _worker_features = np.load(shared_feature_matrix.features_path, mmap_mode='r')
+    _worker_target = np.load(shared_feature_matrix.target_path, mmap_mode='r')
+    _worker_number_of_train_rows = shared_feature_matrix.number_of_train_rows
+
+def _run_trial(model_params:dict, nthread:int) -> TrialResult:
+    """Fit an xgboost model with the params on the train rows and evaluate it on the validation rows, both being views of the memmap."""
+    assert _worker_features is not None and _worker_target is not None, 'The worker was not initialized with _open_shared_feature_matrix'
+    train_features, validation_features = _worker_features[:_worker_number_of_train_rows], _worker_features[_worker_number_of_train_rows:]
+    train_target, validation_target = _worker_target[:_worker_number_of_train_rows], _worker_target[_worker_number_of_train_rows:]
+
+    fit_start = time.perf_counter()
+    #n_jobs is the scikitlearn name of xgboost nthread parameter.
+    model = XGBRegressor(**{**model_params, 'n_jobs': nthread, 'tree_method': 'hist'})
+    model.fit(train_features, train_target)
+    fit_seconds = time.perf_counter() - fit_start
+
+    #Sales can't be negative, so clip the predictions to be able to use the competition metric.
+    predictions = np.clip(model.predict(validation_features), 0, None)
+    validation_rmsle = float(np.sqrt(np.mean((np.log1p(predictions) - np.log1p(np.clip(validation_target, 0, None))) ** 2)))
+
+    return TrialResult(model_params, validation_rmsle, fit_seconds, get_peak_rss_bytes())
+
+
+def _get_trials_and_threads_per_trial(n_parallel_trials:int|None) -> tuple[int, int]:
+    available_cores = os.cpu_count() or 1
+    n_parallel_trials = n_parallel_trials or available_cores
+    n_parallel_trials = min(n_parallel_trials, available_cores)
+    return n_parallel_trials, max(1, available_cores // n_parallel_trials)
+
+def _run_trials_in_pool(
+    shared_feature_matrix:SharedFeatureMatrix,
+    get_next_model_params:Callable[[], tuple[object, dict]|None],
+    on_trial_finished:Callable[[object, TrialResult], None],
+    n_parallel_trials:int|None
+) -> ParallelSearchReport:
+    """
+    Keep n_parallel_trials trials running until get_next_model_params returns None.
+    get_next_model_params returns a tuple of a trial handle, and the model params for that trial. The handle is passed back to on_trial_finished.
+    """
+    n_parallel_trials, threads_per_trial = _get_trials_and_threads_per_trial(n_parallel_trials)
+    trial_results:list[TrialResult] = []
+    search_start = time.perf_counter()
+
+    with ProcessPoolExecutor(n_parallel_trials, initializer=_open_shared_feature_matrix, initargs=(shared_feature_matrix,)) as executor:
+        running_trials:dict[Future, object] = {}
+        no_more_trials = False
+        while running_trials or not no_more_trials:
+            while not no_more_trials and len(running_trials) < n_parallel_trials:
+                next_trial = get_next_model_params()
+                if next_trial is None:
+                    no_more_trials = True
+                    break
+                trial_handle, model_params = next_trial
+                running_trials[executor.submit(_run_trial, model_params, threads_per_trial)] = trial_handle
+
+            if not running_trials:
+                break
+            finished_futures, _ = wait(running_trials, return_when=FIRST_COMPLETED)
+            for finished_future in finished_futures:
+                trial_result = finished_future.result()
+                on_trial_finished(running_trials.pop(finished_future), trial_result)
+                trial_results.append(trial_result)
+
+    search_seconds = time.perf_counter() - search_start
+    worker_peak_rss = [trial_result.worker_peak_rss_bytes for trial_result in trial_results if trial_result.worker_peak_rss_bytes is not None]
+    main_process_peak_rss = get_peak_rss_bytes()
+    peak_rss_bytes = max([*worker_peak_rss, main_process_peak_rss]) if main_process_peak_rss is not None else None
+
+    report = ParallelSearchReport(
+        trial_results,
+        min(trial_results, key=lambda trial_result: trial_result.validation_rmsle),
+        len(trial_results) / search_seconds * 3600,
+        peak_rss_bytes
+    )
+    print(f'Ran {len(trial_results)} trials, {n_parallel_trials} at a time with {threads_per_trial} threads each: {report.trials_per_hour:.1f} trials per hour')
+    if peak_rss_bytes is not None:
+        print(f'Peak RSS of a single process: {peak_rss_bytes / 2**20:.1f} MiB')
+    return report
+
+
+def run_parallel_hyperparameter_search(
+    merged_features_df:pd.DataFrame,
+    y:pd.Series,
+    model_param_sets:Iterable[dict],
+    window_size:int=3,
+    n_parallel_trials:int|None=None,
+    validation_fraction:float=0.2,
+    work_dir:str='./.tuning'
+) -> ParallelSearchReport:
+    """
+    Evaluate each set of XGBRegressor params, running n_parallel_trials trials at a time (by default one per core).
+    merged_features_df: the output of the merging pipeline, sorted by date, so the last rows can be used for validation.
+    """
+    model_param_sets = list(model_param_sets)
+    if not model_param_sets:
+        raise ValueError('There are no model param sets to evaluate, at least one is needed to find the best one')
+    shared_feature_matrix = make_shared_feature_matrix(merged_features_df, y, window_size, validation_fraction, work_dir)
+    model_param_sets_iterator = iter(model_param_sets)
+
+    def get_next_model_params():
+        model_params = next(model_param_sets_iterator, None)
+        return None if model_params is None else (None, model_params)
+
+    return _run_trials_in_pool(shared_feature_matrix, get_next_model_params, lambda trial_handle, trial_result: None, n_parallel_trials)
+
+
+def run_parallel_optuna_study(
+    study,
+    suggest_model_params:Callable[[object], dict],
+    n_trials:int,
+    merged_features_df:pd.DataFrame,
+    y:pd.Series,
+    window_size:int=3,
+    n_parallel_trials:int|None=None,
+    validation_fraction:float=0.2,
+    work_dir:str='./.tuning'
+) -> ParallelSearchReport:
+    """
+    Like run_parallel_hyperparameter_search, but the params are suggested by an optuna study, using its ask and tell interface.
+    The study should minimize, since the value told is the validation rmsle.
+
+    Example usage:
+    def suggest_model_params(trial):
+        return {'max_depth': trial.suggest_int('max_depth', 3, 12), 'learning_rate': trial.suggest_float('learning_rate', 0.01, 0.3, log=True)}
+    report = run_parallel_optuna_study(optuna.create_study(direction='minimize'), suggest_model_params, 50, all_features, all_features['sales'])
+    """
+    if n_trials < 1:
+        raise ValueError(f'n_trials must be at least 1 to find the best trial, but got {n_trials}')
+    shared_feature_matrix = make_shared_feature_matrix(merged_features_df, y, window_size, validation_fraction, work_dir)
+    trials_asked = 0
+
+    def get_next_model_params():
+        nonlocal trials_asked
+        if trials_asked >= n_trials:
+            return None
+        trials_asked += 1
+        trial = study.ask()
+        return trial, suggest_model_params(trial)
+
+    def tell_study(trial, trial_result:TrialResult):
+        study.tell(trial, trial_result.validation_rmsle)
+
+    return _run_trials_in_pool(shared_feature_matrix, get_next_model_params, tell_study, n_parallel_trials)
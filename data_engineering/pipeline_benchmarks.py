@@ -0,0 +1,183 @@
+"""
+Benchmarks of the pipeline stages, on the synthetic datasets made by synthetic_data.py, to see how they scale past the kaggle data size.
+Each stage is timed, and its peak memory measured with tracemalloc, and the results are saved as a json file named after the git commit,
+so the results of two commits can be compared with compare_benchmark_results to find regressions.
+The spark stages only run when asked for, since they need a spark session, and ingestion also needs a database, which should be a scratch one, since rows are appended to it.
+
+Usage:
+python synthetic_data.py --scales 1 10
+python pipeline_benchmarks.py --scales 1 10
+python pipeline_benchmarks.py --compare ./benchmark_results/<old commit>.json ./benchmark_results/<new commit>.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, NamedTuple
+import pandas as pd
+import data_preparation_attempt4 as data_prep
+from dtype_compaction import DtypeCompactor, get_memory_report
+
+class BenchmarkResult(NamedTuple):
+    stage: str
+    scale: int
+    rows: int
+    seconds: float #The fastest of the timed repetitions
+    peak_memory_bytes: int #Of the python allocations, for spark stages it doesn't include the jvm memory.
+    error: str|None = None
+
+def measure_stage(stage:str, scale:int, rows:int, run_stage:Callable[[], object], repetitions:int=3) -> BenchmarkResult:
+    """
+    Time run_stage, keeping the fastest of the repetitions, and then run it once more tracing its memory.
+    Tracing slows down allocations, so it is done separately from timing. run_stage must copy any input it modifies.
+    """
+    try:
+        seconds = float('inf')
+        for _ in range(repetitions):
+            start_time = time.perf_counter()
+            run_stage()
+            seconds = min(seconds, time.perf_counter() - start_time)
+
+        tracemalloc.start()
+        try:
+            run_stage()
+            _, peak_memory_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+    except Exception as e:
+        print(f'The {stage} stage failed at scale {scale}: {e!r}')
+        return BenchmarkResult(stage, scale, rows, float('nan'), 0, repr(e))
+
+    print(f'{stage} at scale {scale} ({rows} rows): {seconds:.3f}s, peak memory {peak_memory_bytes / 2**20:.1f} MiB')
+    return BenchmarkResult(stage, scale, rows, seconds, peak_memory_bytes)
+
+def _read_dataset(dataset_path:str, max_rows:int|None) -> pd.DataFrame:
+    dataset = pd.read_csv(f'{dataset_path}/train.csv', index_col='id', nrows=max_rows)
+    dataset.attrs.update(data_prep.get_supplemental_dfs(dataset_path))
+    return data_prep.rename_raw_dfs_cols(dataset)
+
+def benchmark_pandas_stages(dataset_path:str, scale:int, max_rows:int|None=None, window_size:int=3, repetitions:int=3) -> list[BenchmarkResult]:
+    """
+    Benchmark merge_data_sources, DtypeCompactor, CustomOneHotEncoder and the window step of create_pipeline, rolling_window_dataset_by_series,
+    each one on the output of the stages before it.
+    """
+    renamed_dataset = _read_dataset(dataset_path, max_rows)
+    rows = len(renamed_dataset)
+    results = []
+
+    def merge():
+        return data_prep.merge_data_sources(renamed_dataset.copy(), merge_oil=True, merge_stores=True, merge_special_days=True, merge_transactions=True)
+    results.append(measure_stage('merge_data_sources', scale, rows, merge, repetitions))
+
+    pipeline = data_prep.create_pipeline(window_size)
+    prepare_features_position = [step_name for step_name, _ in pipeline.steps].index('prepare_features')
+    features_before_encoding = pipeline[:prepare_features_position].fit_transform(merge())
+    names_of_columns_to_ohe = pipeline.named_steps['prepare_features'].transformers[1][2]
+    def compact_dtypes():
+        return DtypeCompactor().fit_transform(features_before_encoding)
+    results.append(measure_stage('DtypeCompactor', scale, rows, compact_dtypes, repetitions))
+    print(get_memory_report(features_before_encoding, 'Before compacting the dtypes'))
+    print(get_memory_report(compact_dtypes(), 'After compacting the dtypes'))
+    def one_hot_encode():
+        return data_prep.CustomOneHotEncoder(names_of_columns_to_ohe).fit(features_before_encoding).transform(features_before_encoding.copy())
+    results.append(measure_stage('CustomOneHotEncoder', scale, rows, one_hot_encode, repetitions))
+
+    #Windowed by the step of the pipeline, so the benchmark follows the windowing create_pipeline actually runs.
+    features_before_windowing = pipeline[prepare_features_position].fit_transform(features_before_encoding.copy())
+    window_step = pipeline.named_steps['window_dataset'].fit(features_before_windowing)
+    def window():
+        return window_step.transform(features_before_windowing.copy())
+    results.append(measure_stage('rolling_window_dataset_by_series', scale, rows, window, repetitions))
+    return results
+
+def benchmark_spark_stages(spark, dataset_path:str, scale:int, ingestion_spark_sql_options:dict[str,str]|None=None, repetitions:int=3) -> list[BenchmarkResult]:
+    """
+    Benchmark find_matching_rows, and if spark sql options are given, the ingestion of the synthetic train.csv into the sales table of that database.
+    Spark is lazy, so each stage ends with a count to make it actually run.
+    """
+    from df_utils import find_matching_rows
+    train_df = spark.read.csv(f'{dataset_path}/train.csv', header=True, inferSchema=True)
+    stores_df = spark.read.csv(f'{dataset_path}/stores.csv', header=True, inferSchema=True)
+    rows = train_df.count()
+    results = [
+        measure_stage('find_matching_rows', scale, rows, lambda: find_matching_rows(train_df, stores_df, {'store_nbr': 'store_nbr'}).count(), repetitions)
+    ]
+
+    if ingestion_spark_sql_options is not None:
+        from base_data_management import BaseDataManager
+        from dataset_properties import properties_by_csv_sql_dataset
+        base_data_manager = BaseDataManager(spark, ingestion_spark_sql_options)
+        sales_props = properties_by_csv_sql_dataset['sales_agg_by_date_store_productfamily']
+        def ingest():
+            #Only the first repetition appends rows, the next ones find no new rows, which measures the cost of checking for them.
+            return base_data_manager.update_sql_with_new_csv_data(f'{dataset_path}/train.csv', sales_props.sql_col_csv_equivalents, sales_props.sql_table_name)
+        results.append(measure_stage('ingestion', scale, rows, ingest, repetitions))
+    return results
+
+def _get_git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown_commit'
+
+def save_benchmark_results(results:list[BenchmarkResult], output_path:str='./benchmark_results') -> str:
+    """Save the results as json, along with the commit and machine they were measured on. Returns the path of the file."""
+    os.makedirs(output_path, exist_ok=True)
+    git_commit = _get_git_commit()
+    file_path = os.path.join(output_path, f'{git_commit}.json')
+    with open(file_path, 'w') as results_file:
+        json.dump({
+            'git_commit': git_commit,
+            'measured_at': datetime.now().isoformat(timespec='seconds'),
+            'python_version': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'results': [result._asdict() for result in results],
+        }, results_file, indent=4)
+    print(f'Saved the benchmark results to {file_path}')
+    return file_path
+
+def compare_benchmark_results(baseline_path:str, candidate_path:str, tolerance:float=0.1) -> pd.DataFrame:
+    """Compare the results of two commits by stage and scale, printing the stages that got slower or used more memory than the tolerance allows."""
+    def load_results(path):
+        with open(path) as results_file:
+            return pd.DataFrame(json.load(results_file)['results']).set_index(['stage', 'scale'])[['seconds', 'peak_memory_bytes']]
+
+    comparison = load_results(baseline_path).join(load_results(candidate_path), lsuffix='_baseline', rsuffix='_candidate', how='inner')
+    comparison['seconds_ratio'] = comparison['seconds_candidate'] / comparison['seconds_baseline']
+    comparison['peak_memory_ratio'] = comparison['peak_memory_bytes_candidate'] / comparison['peak_memory_bytes_baseline']
+    regressions = comparison[(comparison['seconds_ratio'] > 1 + tolerance) | (comparison['peak_memory_ratio'] > 1 + tolerance)]
+    print(comparison[['seconds_ratio', 'peak_memory_ratio']].round(3).to_string())
+    if len(regressions):
+        print(f'{len(regressions)} stages regressed by more than {tolerance:.0%}:\n{regressions.index.tolist()}')
+    return comparison
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Benchmark the pipeline stages on the synthetic datasets.')
+    argument_parser.add_argument('--scales', type=int, nargs='+', default=[1])
+    argument_parser.add_argument('--synthetic-dataset-path', default='../synthetic_dataset', help='The folder synthetic_data.py generated the scales into')
+    argument_parser.add_argument('--max-rows', type=int, default=None, help='Only use the first rows of train.csv for the pandas stages, which need it in memory')
+    argument_parser.add_argument('--window-size', type=int, default=3)
+    argument_parser.add_argument('--repetitions', type=int, default=3)
+    argument_parser.add_argument('--spark', action='store_true', help='Also benchmark the spark stages')
+    argument_parser.add_argument('--ingestion', action='store_true', help='Also benchmark ingestion, into the database of db_settings.env, which should be a scratch one')
+    argument_parser.add_argument('--output-path', default='./benchmark_results')
+    argument_parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'), help='Compare two saved results instead of benchmarking')
+    arguments = argument_parser.parse_args()
+
+    if arguments.compare:
+        compare_benchmark_results(*arguments.compare)
+    else:
+        all_results = []
+        for scale in arguments.scales:
+            scale_dataset_path = os.path.join(arguments.synthetic_dataset_path, f'{scale}x')
+            all_results += benchmark_pandas_stages(scale_dataset_path, scale, arguments.max_rows, arguments.window_size, arguments.repetitions)
+            if arguments.spark or arguments.ingestion:
+                from db_connector import spark, spark_sql_options
+                all_results += benchmark_spark_stages(spark, scale_dataset_path, scale, spark_sql_options if arguments.ingestion else None, arguments.repetitions)
+        save_benchmark_results(all_results, arguments.output_path)
@@ -0,0 +1,189 @@
+"""
+A content addressed cache for the steps of a scikitlearn pipeline, meant to be passed as Pipeline(memory=...).
+Each step is keyed on the fingerprint of its input data plus the parameters and the code of the step, so optuna trials that only change
+the model hyperparameters, or parameters of the last steps like window_size, reuse the outputs of every unaffected step before them,
+and editing the code of a step, like the function of a FunctionTransformer, invalidates its entries instead of returning stale outputs.
+"""
+import os
+import hashlib
+import types
+import joblib
+import pandas as pd
+import pyarrow as pa
+
+def fingerprint_data(data) -> str:
+    """
+    Get a fingerprint of a dataset, which changes if its values, columns, dtypes, or attrs change.
+    pandas objects are hashed with pandas own vectorized hashing, which is way faster than pickling them.
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        try:
+            values_hash = hashlib.sha1(pd.util.hash_pandas_object(data, index=True).to_numpy()).hexdigest()
+        except TypeError: #Some values, like lists, can't be hashed by pandas.
+            values_hash = joblib.hash(data)
+        columns = list(data.columns) if isinstance(data, pd.DataFrame) else [data.name]
+        dtypes = [str(dtype) for dtype in data.dtypes] if isinstance(data, pd.DataFrame) else [str(data.dtype)]
+        attrs_fingerprints = {attr_name: fingerprint_data(attr_value) for attr_name, attr_value in data.attrs.items()}
+        return joblib.hash((values_hash, columns, dtypes, attrs_fingerprints))
+    return joblib.hash(data)
+
+
+def fingerprint_code(code:types.CodeType) -> str:
+    """A fingerprint of the bytecode of a function, its constants, including the code of the functions defined in it, and the names it uses."""
+    constants = tuple(fingerprint_code(constant) if isinstance(constant, types.CodeType) else constant for constant in code.co_consts)
+    return joblib.hash((code.co_code, constants, code.co_names))
+
+def _get_functions_of(value) -> list[types.FunctionType]:
+    """The functions a step parameter runs, like the func of a FunctionTransformer, including the ones wrapped in functools.partial."""
+    while hasattr(value, 'func') and not isinstance(value, types.FunctionType): #functools.partial
+        value = value.func
+    return [value] if isinstance(value, types.FunctionType) else []
+
+def fingerprint_transformer_code(transformer) -> str:
+    """
+    A fingerprint of the code a transformer runs: the methods of its class and the classes it inherits from, and the functions in its parameters,
+    of it and of the transformers nested in it, like the ones of a ColumnTransformer. Changes in the functions they call are not detected.
+    """
+    parameters = transformer.get_params(deep=True) if hasattr(transformer, 'get_params') else {}
+    estimators = [transformer, *(value for value in parameters.values() if hasattr(value, 'get_params') and not isinstance(value, type))]
+    code_fingerprints = []
+    for estimator in estimators:
+        for estimator_class in type(estimator).__mro__[:-1]: #All but object
+            for attribute_name, attribute in sorted(vars(estimator_class).items()):
+                if isinstance(attribute, types.FunctionType):
+                    code_fingerprints.append((estimator_class.__qualname__, attribute_name, fingerprint_code(attribute.__code__)))
+    for parameter_name, parameter_value in sorted(parameters.items()):
+        code_fingerprints.extend((parameter_name, fingerprint_code(function.__code__)) for function in _get_functions_of(parameter_value))
+    return joblib.hash(code_fingerprints)
+
+
+class PipelineStepCache:
+    """
+    A cache for pipeline steps, that can be used as memory of a scikitlearn Pipeline, since it has the same interface as joblib.Memory.
+    Stores the output of each step on disk as feather when it's a dataframe, which is written and read without pickling,
+    and the fitted transformer, and any other output, using joblib, evicting the least recently used entries
+    once there are more than max_entries entries, or they take more than max_bytes.
+    It keeps count of the hits and misses, so you can check if its worth it.
+
+    Example usage:
+    cache = PipelineStepCache('./.pipeline_cache', max_entries=64)
+    pipeline = create_pipeline(window_size, memory=cache)
+    ...run the trials...
+    print(cache.stats())
+    """
+    def __init__(self, location:str, max_entries:int=64, max_bytes:int|None=None, verbose:bool=False):
+        self.location = location
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        #The output of the last step and its key, so the next step doesn't need to hash the data again to get its fingerprint.
+        #Since each step's output is fully defined by its key, the key works as the fingerprint of the output.
+        self._last_output_with_key:tuple[object, str]|None = None
+        #The target is the same object for every step, so its fingerprint is kept too.
+        self._last_target_with_fingerprint:tuple[object, str]|None = None
+        os.makedirs(location, exist_ok=True)
+
+    def _get_fingerprint(self, data) -> str:
+        if self._last_output_with_key is not None and data is self._last_output_with_key[0]:
+            return self._last_output_with_key[1]
+        return fingerprint_data(data)
+
+    def _get_target_fingerprint(self, y) -> str:
+        if self._last_target_with_fingerprint is None or y is not self._last_target_with_fingerprint[0]:
+            self._last_target_with_fingerprint = (y, fingerprint_data(y))
+        return self._last_target_with_fingerprint[1]
+
+    def _get_entry_path(self, key:str) -> str:
+        """The joblib file of an entry, which is written last, so an entry exists once it does."""
+        return os.path.join(self.location, f'{key}.joblib')
+
+    def _get_feather_path(self, key:str) -> str:
+        return os.path.join(self.location, f'{key}.feather')
+
+    def _dump(self, key:str, result):
+        transformed, fitted_transformer = result
+        if isinstance(transformed, pd.DataFrame):
+            try:
+                transformed.to_feather(self._get_feather_path(key))
+            except (pa.ArrowException, TypeError, ValueError): #Like columns that aren't strings, or mixed types, that arrow can't store.
+                pass
+            else:
+                #feather doesn't keep the attrs, so they are stored with the transformer.
+                joblib.dump((None, fitted_transformer, transformed.attrs), self._get_entry_path(key))
+                return
+        joblib.dump((transformed, fitted_transformer, None), self._get_entry_path(key))
+
+    def _load(self, key:str):
+        transformed, fitted_transformer, attrs = joblib.load(self._get_entry_path(key))
+        if attrs is not None:
+            transformed = pd.read_feather(self._get_feather_path(key))
+            transformed.attrs.update(attrs)
+        return transformed, fitted_transformer
+
+    def cache(self, func):
+        """Wrap the function the pipeline uses to fit and transform each step, so its results are cached."""
+        def cached_func(transformer, X, y=None, *args, **kwargs):
+            #Messages only affect logging, so they shouldn't affect the key.
+            kwargs_affecting_result = {name: value for name, value in kwargs.items() if not name.startswith('message')}
+            key = joblib.hash((
+                func.__name__,
+                joblib.hash(transformer), #Pipeline passes an unfitted clone, so this is a hash of the step parameters.
+                fingerprint_transformer_code(transformer), #joblib hashes functions by name, so edits to their code need their own fingerprint.
+                self._get_fingerprint(X),
+                None if y is None else self._get_target_fingerprint(y),
+                args,
+                kwargs_affecting_result
+            ))
+            entry_path = self._get_entry_path(key)
+
+            if os.path.exists(entry_path):
+                result = self._load(key)
+                os.utime(entry_path) #Mark it as recently used
+                self.hits += 1
+                if self.verbose:
+                    print(f'PipelineStepCache hit for {type(transformer).__name__}')
+            else:
+                if isinstance(X, pd.DataFrame):
+                    #Many steps modify their input in place, a shallow copy prevents them from changing the fingerprint of the data we got.
+                    X = X.copy(deep=False)
+                result = func(transformer, X, y, *args, **kwargs)
+                self._dump(key, result)
+                self.misses += 1
+                self._evict_least_recently_used_entries()
+                if self.verbose:
+                    print(f'PipelineStepCache miss for {type(transformer).__name__}')
+
+            #The result is a tuple of the transformed data and the fitted transformer.
+            self._last_output_with_key = (result[0], key)
+            return result
+        return cached_func
+
+    def _get_entry_files(self, key:str) -> list[str]:
+        return [entry_file for entry_file in (self._get_entry_path(key), self._get_feather_path(key)) if os.path.exists(entry_file)]
+
+    def _evict_least_recently_used_entries(self):
+        keys = [file_name.removesuffix('.joblib') for file_name in os.listdir(self.location) if file_name.endswith('.joblib')]
+        keys.sort(key=lambda key: os.path.getmtime(self._get_entry_path(key))) #Least recently used first
+        size_by_key = {key: sum(os.path.getsize(entry_file) for entry_file in self._get_entry_files(key)) for key in keys}
+        total_bytes = sum(size_by_key.values())
+        while keys and (len(keys) > self.max_entries or (self.max_bytes is not None and total_bytes > self.max_bytes)):
+            key_to_evict = keys.pop(0)
+            total_bytes -= size_by_key[key_to_evict]
+            for entry_file in self._get_entry_files(key_to_evict):
+                os.remove(entry_file)
+
+    def stats(self) -> dict[str, int|float]:
+        lookups = self.hits + self.misses
+        return dict(hits=self.hits, misses=self.misses, hit_ratio=self.hits / lookups if lookups else 0.0)
+
+    def clear(self):
+        """Remove all the cached entries and reset the counters"""
+        for file_name in os.listdir(self.location):
+            if file_name.endswith(('.joblib', '.feather')):
+                os.remove(os.path.join(self.location, file_name))
+        self.hits = 0
+        self.misses = 0
+        self._last_output_with_key = None
+        self._last_target_with_fingerprint = None
@@ -0,0 +1,78 @@
+"""
+Lazily created shared resources, like the spark session or the database connections, so importing a module doesn't start them.
+Each one is made by its provider the first time it's needed, and can be stopped, used as a context manager, or replaced for tests.
+The modules that used to make them on import expose them through module __getattr__, so `from spark_interfacing import spark_interface` keeps working,
+but only starts spark when it's actually imported by name.
+"""
+import threading
+from typing import Callable, Generic, TypeVar
+
+T = TypeVar('T')
+
+class LazyProvider(Generic[T]):
+    """
+    Makes a resource with its factory the first time get() is called, and returns the same one until stop() is called.
+    stop_function: Releases the resource, for example stopping the spark session or closing the connection.
+
+    Example usage:
+    spark_interface_provider = LazyProvider(_make_spark_interface, lambda spark_interface: spark_interface.spark.stop(), 'spark_interface')
+    with spark_interface_provider as spark_interface: #Started here, and stopped when the block ends
+        spark_interface.get_current_data_in_sql_table('stores').show()
+    Or to inject another implementation, for example in tests:
+    spark_interface_provider.override(fake_spark_interface)
+    """
+    def __init__(self, factory:Callable[[], T], stop_function:Callable[[T], None]|None=None, name:str='resource'):
+        self.factory = factory
+        self.stop_function = stop_function
+        self.name = name
+        self._instance:T|None = None
+        self._instance_is_overridden = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_started(self) -> bool:
+        return self._instance is not None
+
+    def start(self) -> T:
+        """Make the resource if it doesn't exist yet, and return it."""
+        with self._lock:
+            if self._instance is None:
+                self._instance = self.factory()
+            return self._instance
+
+    def get(self) -> T:
+        instance = self._instance
+        return instance if instance is not None else self.start()
+
+    def stop(self):
+        """Release the resource, if it was started. An overridden resource isn't released, since the provider didn't make it."""
+        with self._lock:
+            instance, self._instance = self._instance, None
+            instance_is_overridden, self._instance_is_overridden = self._instance_is_overridden, False
+        if instance is not None and not instance_is_overridden and self.stop_function is not None:
+            self.stop_function(instance)
+
+    def override(self, instance:T):
+        """Use an already made resource instead of making one, stopping the one made before, if any."""
+        self.stop()
+        with self._lock:
+            self._instance = instance
+            self._instance_is_overridden = True
+
+    def __enter__(self) -> T:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def __repr__(self):
+        return f'LazyProvider({self.name}, started={self.is_started})'
+
+
+def make_module_getattr(module_name:str, provider_by_attribute_name:dict[str, LazyProvider]) -> Callable[[str], object]:
+    """Make a module __getattr__ that gets the attributes that used to be made on import from their providers."""
+    def __getattr__(attribute_name:str):
+        if attribute_name in provider_by_attribute_name:
+            return provider_by_attribute_name[attribute_name].get()
+        raise AttributeError(f'module {module_name!r} has no attribute {attribute_name!r}')
+    return __getattr__
@@ -0,0 +1,127 @@
+"""
+Recursive multi-step forecasting of the test horizon with a fitted create_pipeline.
+With lag features each predicted day is a lag input of the next day, so the naive approach re-runs rolling_window_dataset and the whole pipeline for every day.
+Instead RecursiveForecaster keeps a ring buffer per series, with the features of its last window_size - 1 days, taken from the tail of the training data.
+Each day it transforms only that day's rows, takes their lag features from the buffers, predicts, and writes the day with its predicted sales into the buffers.
+So the cost of each horizon step depends on the number of series, not on the length of the history.
+"""
+import numpy as np
+import pandas as pd
+from sklearn.pipeline import Pipeline
+from data_preparation_attempt4 import rolling_window_dataset_by_series
+
+class RecursiveForecaster:
+    """
+    Forecasts day by day, using the predictions of each day as the lag features of the next days.
+    The pipeline must window with rolling_window_dataset_by_series, like create_pipeline does, so it was fit with the same per series lags used here.
+    The predictions are clipped to 0, since there are no negative sales, before being used as lags.
+
+    Example usage:
+    forecaster = RecursiveForecaster(fitted_pipeline, days_since_start_origin='2013-01-01')
+    forecaster.initialize_from_training_tail(merged_train_features.tail(1782 * 30))
+    predictions = forecaster.forecast(merged_test_features)
+    """
+    def __init__(self, fitted_pipeline:Pipeline, days_since_start_origin:str, series_columns:tuple[str, ...]=('store_nbr', 'product_family'), date_column:str='date'):
+        self.fitted_pipeline = fitted_pipeline
+        self.series_columns = list(series_columns)
+        self.date_column = date_column
+        #days_since_start has to count from the first training date, instead of from each day, which would make it always 0.
+        self.fitted_pipeline.set_params(replace_date_with_date_related_columns__kw_args={'start_date': days_since_start_origin})
+
+        step_names = [step_name for step_name, _ in fitted_pipeline.steps]
+        window_step_position = step_names.index('window_dataset')
+        window_step = fitted_pipeline.named_steps['window_dataset']
+        if getattr(window_step, 'func', None) is not rolling_window_dataset_by_series:
+            raise ValueError(f'The window step of the pipeline is {window_step}, its lags would not be the per series lags of the forecaster, window it with rolling_window_dataset_by_series.')
+        self.window_size:int = window_step.kw_args['window_size']
+        self.series_id_column:str = window_step.kw_args.get('series_id_column', 'series_id')
+        self.number_of_lags = self.window_size - 1
+        self.pipeline_before_windowing:Pipeline = fitted_pipeline[:window_step_position]
+        self.pipeline_after_windowing:Pipeline = fitted_pipeline[window_step_position + 1:]
+
+    def _transform_rows_before_windowing(self, merged_rows:pd.DataFrame) -> pd.DataFrame:
+        merged_rows = merged_rows.copy()
+        if 'sales' not in merged_rows.columns:
+            merged_rows['sales'] = np.nan #Filled with the predictions once they are made.
+        transformed_rows = self.pipeline_before_windowing.transform(merged_rows)
+        if len(transformed_rows) != len(merged_rows):
+            raise ValueError(f'The pipeline steps before windowing changed the number of rows from {len(merged_rows)} to {len(transformed_rows)}, so they cant be matched to their series.')
+        #The window step drops the series ids, the series of the rows are found from their series columns instead.
+        return transformed_rows.drop(columns=self.series_id_column)
+
+    def _get_series_positions(self, merged_rows:pd.DataFrame) -> np.ndarray:
+        series_keys = merged_rows[self.series_columns].itertuples(index=False, name=None)
+        try:
+            return np.fromiter((self._position_by_series_key[series_key] for series_key in series_keys), dtype='int64', count=len(merged_rows))
+        except KeyError as missing_series_key:
+            raise ValueError(f'The series {missing_series_key} was not in the training tail the forecaster was initialized with.') from missing_series_key
+
+    def initialize_from_training_tail(self, merged_training_tail:pd.DataFrame):
+        """
+        Fill the ring buffers with the features of the last window_size - 1 days of each series.
+        merged_training_tail: the output of the merging pipeline (including sales) for at least the last window_size - 1 days of each series.
+        """
+        merged_training_tail = merged_training_tail.sort_values(self.date_column, kind='stable')
+        transformed_tail = self._transform_rows_before_windowing(merged_training_tail)
+        self.feature_names = list(transformed_tail.columns)
+        self.feature_dtypes = transformed_tail.dtypes
+
+        series_keys = pd.MultiIndex.from_frame(merged_training_tail[self.series_columns])
+        distinct_series_keys = series_keys.unique()
+        self._position_by_series_key = {series_key: position for position, series_key in enumerate(distinct_series_keys)}
+        series_positions = self._get_series_positions(merged_training_tail)
+
+        #buffer[series, slot, feature], the slot of each lag moves with the write position of its series, so nothing is ever shifted.
+        self._lag_buffer = np.zeros((len(distinct_series_keys), max(self.number_of_lags, 1), len(self.feature_names)), dtype='float64')
+        self._write_positions = np.zeros(len(distinct_series_keys), dtype='int64')
+        self._rows_written = np.zeros(len(distinct_series_keys), dtype='int64')
+        if self.number_of_lags > 0:
+            self._write_rows(series_positions, transformed_tail.to_numpy(dtype='float64'))
+
+        series_lacking_history = self._rows_written < self.number_of_lags
+        if series_lacking_history.any():
+            raise ValueError(f'{series_lacking_history.sum()} series have less than the {self.number_of_lags} days of history needed for their lag features, include more days in the training tail.')
+
+    def _write_rows(self, series_positions:np.ndarray, rows:np.ndarray):
+        """Write the rows into the buffers of their series, in order, so that later rows of a series are newer."""
+        if len(np.unique(series_positions)) == len(series_positions):
+            #A single day has one row per series, so all of them can be written at once.
+            self._lag_buffer[series_positions, self._write_positions[series_positions]] = rows
+            self._write_positions[series_positions] = (self._write_positions[series_positions] + 1) % self.number_of_lags
+            self._rows_written[series_positions] += 1
+            return
+        for series_position, row in zip(series_positions, rows):
+            self._lag_buffer[series_position, self._write_positions[series_position]] = row
+            self._write_positions[series_position] = (self._write_positions[series_position] + 1) % self.number_of_lags
+            self._rows_written[series_position] += 1
+
+    def _get_lag_features(self, series_positions:np.ndarray) -> list[pd.DataFrame]:
+        lag_features = []
+        for lag in range(1, self.window_size):
+            lag_slots = (self._write_positions[series_positions] - lag) % self.number_of_lags
+            lag_values = pd.DataFrame(self._lag_buffer[series_positions, lag_slots], columns=self.feature_names).astype(self.feature_dtypes)
+            lag_features.append(lag_values.add_suffix(f'_lag_{lag}'))
+        return lag_features
+
+    def predict_day(self, merged_day_rows:pd.DataFrame) -> np.ndarray:
+        """Predict the rows of a single day, and add the day with its predictions to the ring buffers."""
+        series_positions = self._get_series_positions(merged_day_rows)
+        day_features = self._transform_rows_before_windowing(merged_day_rows).reset_index(drop=True)
+
+        #Assemble the same columns rolling_window_dataset makes: the features, the backfilled flag, and then the features of each lag.
+        day_features_with_flag = day_features.copy()
+        day_features_with_flag['row_was_lagg_backfilled'] = False
+        windowed_day_features = pd.concat([day_features_with_flag, *self._get_lag_features(series_positions)], axis=1)
+        day_predictions = np.clip(self.pipeline_after_windowing.predict(windowed_day_features), 0, None)
+
+        if self.number_of_lags > 0:
+            day_features['sales'] = day_predictions
+            self._write_rows(series_positions, day_features.to_numpy(dtype='float64'))
+        return day_predictions
+
+    def forecast(self, merged_future_rows:pd.DataFrame) -> pd.Series:
+        """Predict all the future rows, one day at a time, in date order. Returns the predictions with the index of merged_future_rows."""
+        predictions = pd.Series(np.nan, index=merged_future_rows.index, name='sales')
+        for _, merged_day_rows in merged_future_rows.groupby(self.date_column, sort=True):
+            predictions.loc[merged_day_rows.index] = self.predict_day(merged_day_rows)
+        return predictions
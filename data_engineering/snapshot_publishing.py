@@ -0,0 +1,108 @@
+"""
+Publishing full refreshes of a table as snapshots, for tables whose rows all change on each refresh, like min max scaled features.
+The new version is built under a temporary name, unlogged and without indexes, loaded with COPY, indexed after loading,
+and then swapped in with renames in a single transaction. Readers keep reading the previous version until the swap commits,
+without waiting on any row lock, and never see a half updated table.
+The replaced versions are kept as {table_name}__replaced_{version}, the newest versions_to_keep of them, so a bad refresh can be rolled back.
+The swaps go through execute_engineering_queries, which rolls back and raises when any statement fails, so a failed refresh is never reported as published.
+"""
+from datetime import datetime
+from typing import Iterable
+
+#Postgres silently truncates longer names, which would make the versions of a table collide.
+max_identifier_length = 63
+
+def get_replaced_table_name(table_name:str, version:str) -> str:
+    return f'{table_name}__replaced_{version}'
+
+def get_replaced_versions_of_table(db_interface, table_name:str) -> list[str]:
+    """The names of the kept replaced versions of a table, newest first."""
+    return sorted(db_interface.get_table_names_starting_with(get_replaced_table_name(table_name, '')), reverse=True)
+
+def make_create_staging_table_statements(staging_table_name:str, source_table_name:str, identity_columns:Iterable[str], sql_column_strings:Iterable[str], unlogged:bool) -> list[str]:
+    """An empty table with the identity columns of the source table and the given columns. Unlogged tables skip the write ahead log while loading."""
+    return [
+        f'DROP TABLE IF EXISTS {staging_table_name}',
+        f"CREATE {'UNLOGGED ' if unlogged else ''}TABLE {staging_table_name} AS SELECT {', '.join(identity_columns)} FROM {source_table_name} WHERE false",
+        *[f'ALTER TABLE {staging_table_name} ADD COLUMN {sql_column_string}' for sql_column_string in sql_column_strings],
+    ]
+
+def make_swap_statements(table_name:str, new_table_name:str, replaced_table_name:str) -> list[str]:
+    return [
+        f'ALTER TABLE IF EXISTS {table_name} RENAME TO {replaced_table_name}',
+        f'ALTER TABLE {new_table_name} RENAME TO {table_name}',
+    ]
+
+def make_version() -> str:
+    """A version that sorts in the order the versions were made, with microseconds so refreshes in the same second don't collide."""
+    return datetime.now().strftime('%Y%m%d%H%M%S%f')
+
+def publish_table_snapshot(
+    db_interface,
+    table_name:str,
+    source_table_name:str,
+    identity_columns:list[str],
+    sql_column_strings:list[str],
+    column_names:list[str],
+    rows:Iterable,
+    statements_after_swap:list[str]|None=None,
+    versions_to_keep:int=3
+) -> str:
+    """
+    Build a new version of a table keyed by identity_columns, with the rows given, and swap it in place of the current one.
+    column_names: The columns of the rows, in order.
+    statements_after_swap: Run in the swap transaction, to recreate the views of the table, which keep pointing to the replaced version otherwise.
+    Returns the name the replaced version is kept as. If any step fails the current version is left as is, the new one is dropped, and the error raised.
+    """
+    version = make_version()
+    staging_table_name = f'{table_name}__v{version}'
+    replaced_table_name = get_replaced_table_name(table_name, version)
+    if len(replaced_table_name) > max_identifier_length:
+        raise ValueError(f'The versions of {table_name} would be named like {replaced_table_name}, longer than the {max_identifier_length} characters postgres keeps')
+    unlogged = db_interface.supports_unlogged_tables
+    db_interface.execute_engineering_queries(
+        make_create_staging_table_statements(staging_table_name, source_table_name, identity_columns, sql_column_strings, unlogged),
+        verbose=False
+    )
+    try:
+        db_interface.copy_rows(staging_table_name, column_names, rows)
+        #Building the index once after loading is faster than updating it on every row, and the table is logged before the swap so it survives crashes.
+        #duckdb can't rename a table with an index, and doesn't need it for its scans, so it's left without one there.
+        db_interface.execute_engineering_queries(
+            [
+                *([f'ALTER TABLE {staging_table_name} SET LOGGED'] if unlogged else []),
+                *([f"CREATE UNIQUE INDEX {staging_table_name}_identity_idx ON {staging_table_name} ({', '.join(identity_columns)})"] if db_interface.supports_renaming_indexed_tables else []),
+            ],
+            verbose=False
+        )
+        versions_to_drop = [replaced_table_name, *get_replaced_versions_of_table(db_interface, table_name)][versions_to_keep:]
+        db_interface.execute_engineering_queries(
+            [
+                *make_swap_statements(table_name, staging_table_name, replaced_table_name),
+                *(statements_after_swap or []),
+                *[f'DROP TABLE IF EXISTS {version_to_drop}' for version_to_drop in versions_to_drop],
+            ],
+            verbose=False
+        )
+    except Exception:
+        #The swap is a single transaction, so when it fails the staging table still has its own name.
+        db_interface.execute_engineering_queries([f'DROP TABLE IF EXISTS {staging_table_name}'], verbose=False)
+        raise
+    return replaced_table_name
+
+def rollback_table_snapshot(db_interface, table_name:str, statements_after_swap:list[str]|None=None) -> str:
+    """Discard the current version of a table, putting back the newest replaced version. Returns the name of the version put back."""
+    replaced_versions = get_replaced_versions_of_table(db_interface, table_name)
+    if not replaced_versions:
+        raise ValueError(f'There is no replaced version of {table_name} to roll back to')
+    discarded_table_name = f'{table_name}__discarded_{make_version()}'
+    db_interface.execute_engineering_queries(
+        [
+            f'ALTER TABLE {table_name} RENAME TO {discarded_table_name}',
+            f'ALTER TABLE {replaced_versions[0]} RENAME TO {table_name}',
+            *(statements_after_swap or []),
+            f'DROP TABLE {discarded_table_name}',
+        ],
+        verbose=False
+    )
+    return replaced_versions[0]
@@ -1,5 +1,10 @@
+from pyspark import StorageLevel
 from pyspark.sql import SparkSession, DataFrame
 import spark_utils
+from instrumentation import instrumented, current_span
+from providers import LazyProvider, make_module_getattr
+from spark_profiles import get_spark_execution_profile
+from spark_persistence import PersistenceScope
 
 class SparkInterface:
     """A class to interact with the spark backend, more easily, and without having to know dataset details"""
@@ -7,25 +12,35 @@ class SparkInterface:
         self.spark = spark
         self.spark_sql_options = spark_sql_options
     
+    @instrumented()
     def get_current_data_in_sql_table(self, table_name:str):
         """Get the data in a sql table as a lazy spark dataframe."""
         return spark_utils.get_current_data_in_sql_table(self.spark, self.spark_sql_options, table_name)
     
-    def save_table(self, table:DataFrame, table_name:str):
-        """Save a table using spark jdbc, overwritting any existing table"""
-        table.write.format('jdbc').options(**self.spark_sql_options).option('dbtable', table_name).save(mode='overwrite')
+    @instrumented()
+    def get_data_in_sql_table_between_dates(self, table_name:str, first_date, last_date, date_column:str='date'):
+        """Get the rows of a sql table from first_date to last_date, both included. On tables partitioned by date only the partitions of those dates are read."""
+        return spark_utils.get_data_in_sql_table_between_dates(self.spark, self.spark_sql_options, table_name, first_date, last_date, date_column)
 
-def _make_spark_interface():
+    @instrumented()
+    def save_table(self, table:DataFrame, table_name:str, truncate:bool=False):
+        """
+        Save a table using spark jdbc, overwritting any existing table
+        truncate: Empty the existing table instead of dropping it, keeping its column types, indexes and the views that depend on it.
+        """
+        current_span().set_attribute('table_name', table_name)
+        table.write.format('jdbc').options(**self.spark_sql_options).option('dbtable', table_name).option('truncate', str(truncate).lower()).save(mode='overwrite')
+
+    def persistence_scope(self, storage_level:StorageLevel=StorageLevel.MEMORY_AND_DISK, name:str='persistence_scope') -> PersistenceScope:
+        """A context manager or decorator that keeps the dataframes persisted in it cached until it ends, so several actions on them only scan the table once."""
+        return PersistenceScope(self.spark, storage_level, name)
+
+def get_spark_sql_options() -> dict[str,str]:
+    """Get the jdbc options to connect spark to the database, from db_settings.env"""
     from dotenv import load_dotenv
     load_dotenv('.\db_settings.env') #Load the database configuration into
     
     import os
-    #Fix an error about spark with python, probably necessary because we are not in the same folder as the .venv folder
-    os.environ['PYSPARK_PYTHON'] = '..\.venv\scripts\python.exe'#sys.executable
-    #os.environ['PYSPARK_DRIVER_PYTHON'] = '..\.venv\scripts\python.exe' #sys.executable
-    #Download the postgres jdbc driver and use it with spark
-    os.environ['PYSPARK_SUBMIT_ARGS'] = '--packages org.postgresql:postgresql:42.7.3 pyspark-shell'
-    
     db_host = os.getenv('db_host')
     db_port = os.getenv('db_port')
     db_data_engineer_user = os.getenv('db_data_engineer_user')
@@ -37,20 +52,43 @@ def _make_spark_interface():
         'url': f"jdbc:postgresql://{db_host}:{db_port}/{db_name}",
         'user': db_data_engineer_user,
         'password': db_data_engineer_password,
-        'format':'jdbc'
+        'format':'jdbc',
+        **get_spark_execution_profile().get_jdbc_options() #The rows per round trip of reads and writes
     }
-    
+    return spark_sql_options
+
+def _make_spark_session() -> SparkSession:
+    import os
+    #Fix an error about spark with python, probably necessary because we are not in the same folder as the .venv folder
+    os.environ['PYSPARK_PYTHON'] = '..\.venv\scripts\python.exe'#sys.executable
+    #os.environ['PYSPARK_DRIVER_PYTHON'] = '..\.venv\scripts\python.exe' #sys.executable
+    #Download the postgres jdbc driver, and the duckdb one for the duckdb backend, and use them with spark
+    jdbc_driver_packages = 'org.postgresql:postgresql:42.7.3' + (',org.duckdb:duckdb_jdbc:1.0.0' if os.getenv('storage_backend', 'postgres') == 'duckdb' else '')
+    os.environ['PYSPARK_SUBMIT_ARGS'] = f'--packages {jdbc_driver_packages} pyspark-shell'
+
     spark_session_builder:SparkSession.Builder = SparkSession.builder # type: ignore <-Ignore a wrong pylance warning, and make type detection work properly
+    #The cores, memory and partitions come from the profile of the spark_execution_profile env variable.
     spark:SparkSession = (
-        spark_session_builder
-        .master('local[3]')
+        get_spark_execution_profile().configure_builder(spark_session_builder)
         .appName('TimeSeriesForecastStoreSales Data Engineering')
         .getOrCreate()
     )
+    return spark
+
+def _make_spark_interface():
+    import os
+    spark_sql_options = get_spark_sql_options()
+    spark = _make_spark_session()
     
+    if os.getenv('storage_backend', 'postgres') == 'duckdb':
+        from duckdb_interfacing import DuckDBInterface, DuckDBSparkInterface
+        return DuckDBSparkInterface(spark, DuckDBInterface(os.getenv('duckdb_path', './store_sales.duckdb')))
+
     return SparkInterface(
         spark,
         spark_sql_options
     )
 
-spark_interface = _make_spark_interface()
\ No newline at end of file
+#The spark session is only started when spark_interface is first used, and stopped with spark_interface_provider.stop()
+spark_interface_provider:LazyProvider[SparkInterface] = LazyProvider(_make_spark_interface, lambda spark_interface: spark_interface.spark.stop(), 'spark_interface')
+__getattr__ = make_module_getattr(__name__, {'spark_interface': spark_interface_provider})
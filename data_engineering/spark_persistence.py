@@ -0,0 +1,123 @@
+"""
+Scoped persistence of spark dataframes that are used by more than one action.
+The dataframes read through jdbc are lazy, so each action on them (a count, a filter, a union of folds) runs the jdbc scan again.
+Inside a PersistenceScope they are persisted the first time, and unpersisted automatically when the unit of work ends,
+logging how much of them was actually served from the cache and how much memory and disk they took.
+
+Example usage:
+with spark_interface.persistence_scope(name='kfold splits'):
+    base_data = persist_in_current_scope(spark_interface.get_current_data_in_sql_table('sales'))
+    base_data.count()
+    base_data.filter('id < 100').count() #Read from the cache, not from the database.
+
+Or as a decorator, for methods of objects with a spark_interface or spark attribute:
+@with_persistence_scope()
+def store_splits(self): ...
+"""
+import functools
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+from typing import Callable
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, DataFrame
+from instrumentation import current_span, find_spark_session
+
+_current_persistence_scope:ContextVar['PersistenceScope|None'] = ContextVar('current_persistence_scope', default=None)
+
+def get_cached_rdds_storage_info(spark:SparkSession) -> dict[int, dict]:
+    """The storage info of each cached rdd (which includes the cached dataframes) by rdd id, as the spark block manager reports it."""
+    storage_info_by_rdd_id = {}
+    for rdd_info in spark.sparkContext._jsc.sc().getRDDStorageInfo(): # type: ignore <- There is no python api for the storage info
+        storage_info_by_rdd_id[rdd_info.id()] = {
+            'name': rdd_info.name(),
+            'number_of_partitions': rdd_info.numPartitions(),
+            'number_of_cached_partitions': rdd_info.numCachedPartitions(),
+            'memory_bytes': rdd_info.memSize(),
+            'disk_bytes': rdd_info.diskSize(),
+        }
+    return storage_info_by_rdd_id
+
+
+class PersistenceScope(ContextDecorator):
+    """
+    Persists dataframes for the duration of a with block (or decorated function), and unpersists them when it ends.
+    storage_level: The default storage level of the persisted dataframes. MEMORY_AND_DISK spills to disk instead of recomputing partitions that don't fit in memory.
+    The cache hit ratio logged is the fraction of the partitions of the persisted dataframes that were in the cache at the end of the scope,
+    the rest had to be recomputed (read again through jdbc) when they were used.
+    """
+    def __init__(self, spark:SparkSession, storage_level:StorageLevel=StorageLevel.MEMORY_AND_DISK, name:str='persistence_scope'):
+        self.spark = spark
+        self.storage_level = storage_level
+        self.name = name
+        self.persisted_dataframes:list[DataFrame] = []
+        self._rdd_ids_cached_before_scope:set[int] = set()
+        self._context_token = None
+
+    def _recreate_cm(self):
+        #Each call of a decorated function gets its own scope, so calls don't unpersist each other's dataframes.
+        return PersistenceScope(self.spark, self.storage_level, self.name)
+
+    def persist(self, df:DataFrame, storage_level:StorageLevel|None=None) -> DataFrame:
+        """Persist a dataframe until the scope ends. The data is cached by the first action that uses it."""
+        if df.storageLevel == StorageLevel.NONE:
+            df = df.persist(storage_level or self.storage_level)
+            self.persisted_dataframes.append(df)
+        return df
+
+    def __enter__(self) -> 'PersistenceScope':
+        self._rdd_ids_cached_before_scope = set(get_cached_rdds_storage_info(self.spark))
+        self._context_token = _current_persistence_scope.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _current_persistence_scope.reset(self._context_token)
+        try:
+            self.log_cache_usage()
+        finally:
+            for persisted_dataframe in self.persisted_dataframes:
+                persisted_dataframe.unpersist(blocking=False)
+            self.persisted_dataframes = []
+        return False
+
+    def get_cache_usage(self) -> dict:
+        """Get the partitions, cached partitions, and memory and disk used by the rdds cached during the scope."""
+        rdds_cached_during_scope = [
+            storage_info for rdd_id, storage_info in get_cached_rdds_storage_info(self.spark).items()
+            if rdd_id not in self._rdd_ids_cached_before_scope
+        ]
+        number_of_partitions = sum(storage_info['number_of_partitions'] for storage_info in rdds_cached_during_scope)
+        number_of_cached_partitions = sum(storage_info['number_of_cached_partitions'] for storage_info in rdds_cached_during_scope)
+        return {
+            'persisted_dataframes': len(self.persisted_dataframes),
+            'cached_rdds': len(rdds_cached_during_scope),
+            'cache_hit_ratio': number_of_cached_partitions / number_of_partitions if number_of_partitions else None,
+            'memory_bytes': sum(storage_info['memory_bytes'] for storage_info in rdds_cached_during_scope),
+            'disk_bytes': sum(storage_info['disk_bytes'] for storage_info in rdds_cached_during_scope),
+        }
+
+    def log_cache_usage(self):
+        if not self.persisted_dataframes:
+            return
+        cache_usage = self.get_cache_usage()
+        current_span().set_attribute(f'cache_usage_of_{self.name}', cache_usage)
+        cache_hit_ratio = 'unknown' if cache_usage['cache_hit_ratio'] is None else f"{cache_usage['cache_hit_ratio']:.1%}"
+        print(
+            f"{self.name}: {cache_usage['persisted_dataframes']} persisted dataframes, cache hit ratio {cache_hit_ratio}, "
+            f"{cache_usage['memory_bytes'] / 2**20:.1f} MiB in memory and {cache_usage['disk_bytes'] / 2**20:.1f} MiB on disk"
+        )
+
+
+def persist_in_current_scope(df:DataFrame, storage_level:StorageLevel|None=None) -> DataFrame:
+    """Persist the dataframe in the innermost running PersistenceScope. Outside of any scope the dataframe is returned as is."""
+    persistence_scope = _current_persistence_scope.get()
+    return persistence_scope.persist(df, storage_level) if persistence_scope is not None else df
+
+def with_persistence_scope(storage_level:StorageLevel=StorageLevel.MEMORY_AND_DISK, name:str|None=None) -> Callable:
+    """Decorator that runs a method inside a PersistenceScope, using the spark session of its object, as spark or spark_interface.spark."""
+    def decorator(method:Callable) -> Callable:
+        @functools.wraps(method)
+        def method_with_persistence_scope(self, *args, **kwargs):
+            with PersistenceScope(find_spark_session(self), storage_level, name or method.__qualname__):
+                return method(self, *args, **kwargs)
+        return method_with_persistence_scope
+    return decorator
@@ -0,0 +1,111 @@
+"""
+Named spark execution profiles, that set the cores, memory, adaptive query execution, shuffle partitions and jdbc defaults of the spark session.
+The profile used is chosen with the spark_execution_profile env variable (dev by default), for example spark_execution_profile=nightly_batch in db_settings.env.
+Profiles without a fixed number of shuffle partitions get them from the size of the tables being processed, as estimated by the database catalog,
+so small dimension tables aren't split into hundreds of tiny tasks, and big ones use all the cores.
+"""
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Iterable
+from pyspark.sql import SparkSession
+
+@dataclass(frozen=True)
+class SparkExecutionProfile():
+    """
+    cores: The number of local cores spark uses, all of them if None.
+    shuffle_partitions: Fixed number of shuffle partitions, if None they are estimated from table sizes by tune_shuffle_partitions_for_tables.
+    advisory_partition_size: The target size of each partition, used both by adaptive query execution and the partition estimates.
+    jdbc_fetch_size, jdbc_batch_size: Rows per round trip when reading and writing through jdbc. The postgres driver fetches all the rows at once without a fetch size.
+    """
+    name:str
+    cores:int|None
+    driver_memory:str
+    adaptive_query_execution:bool = True
+    shuffle_partitions:int|None = None
+    max_shuffle_partitions:int = 400
+    advisory_partition_size:str = '64m'
+    jdbc_fetch_size:int = 10_000
+    jdbc_batch_size:int = 10_000
+    extra_spark_config:dict[str,str] = field(default_factory=dict)
+
+    def get_number_of_cores(self) -> int:
+        return self.cores or os.cpu_count() or 1
+
+    def get_master(self) -> str:
+        return f"local[{self.cores or '*'}]"
+
+    def get_spark_config(self) -> dict[str,str]:
+        spark_config = {
+            'spark.driver.memory': self.driver_memory,
+            'spark.sql.adaptive.enabled': str(self.adaptive_query_execution).lower(),
+            'spark.sql.adaptive.coalescePartitions.enabled': str(self.adaptive_query_execution).lower(),
+            'spark.sql.adaptive.skewJoin.enabled': str(self.adaptive_query_execution).lower(),
+            'spark.sql.adaptive.advisoryPartitionSizeInBytes': self.advisory_partition_size,
+            #Until the partitions are tuned for the tables, use a couple per core instead of spark's default of 200.
+            'spark.sql.shuffle.partitions': str(self.shuffle_partitions or self.get_number_of_cores() * 2),
+            'spark.default.parallelism': str(self.get_number_of_cores() * 2),
+        }
+        return {**spark_config, **self.extra_spark_config}
+
+    def configure_builder(self, spark_session_builder:SparkSession.Builder) -> SparkSession.Builder:
+        """Set the master and configuration of the profile on a session builder. The memory can only be set before the session is started."""
+        spark_session_builder = spark_session_builder.master(self.get_master())
+        for config_key, config_value in self.get_spark_config().items():
+            spark_session_builder = spark_session_builder.config(config_key, config_value)
+        return spark_session_builder
+
+    def get_jdbc_options(self) -> dict[str,str]:
+        return {'fetchsize': str(self.jdbc_fetch_size), 'batchsize': str(self.jdbc_batch_size)}
+
+
+spark_execution_profiles:dict[str,SparkExecutionProfile] = dict(
+    #Small and quick to start, for notebooks and trying things out.
+    dev = SparkExecutionProfile('dev', cores=2, driver_memory='2g', shuffle_partitions=8, jdbc_fetch_size=5_000, jdbc_batch_size=5_000),
+    #The daily update of the base data and features, which only processes the new rows.
+    nightly_batch = SparkExecutionProfile('nightly_batch', cores=None, driver_memory='8g', jdbc_fetch_size=20_000, jdbc_batch_size=20_000),
+    #Recomputing everything from scratch, with bigger partitions and results.
+    backfill = SparkExecutionProfile(
+        'backfill', cores=None, driver_memory='16g', max_shuffle_partitions=2000, advisory_partition_size='128m', jdbc_fetch_size=50_000, jdbc_batch_size=50_000,
+        extra_spark_config={'spark.driver.maxResultSize': '8g', 'spark.sql.autoBroadcastJoinThreshold': '64m'}
+    ),
+)
+
+def get_spark_execution_profile(profile_name:str|None=None) -> SparkExecutionProfile:
+    """Get a profile by name, or the one of the spark_execution_profile env variable if no name is given."""
+    profile_name = profile_name or os.getenv('spark_execution_profile', 'dev')
+    try:
+        return spark_execution_profiles[profile_name]
+    except KeyError:
+        raise ValueError(f'There is no spark execution profile named {profile_name}, the profiles are: {list(spark_execution_profiles)}') from None
+
+
+def parse_size_in_bytes(size:str) -> int:
+    """Parse sizes written like spark does, for example 64m or 1g"""
+    size_match = re.fullmatch(r'(\d+)\s*([kmgt]?)b?', size.strip().lower())
+    if size_match is None:
+        raise ValueError(f'Can not parse the size {size}, it should look like 64m or 1g')
+    number, unit = size_match.groups()
+    return int(number) * 1024 ** ' kmgt'.index(unit or ' ')
+
+def estimate_shuffle_partitions(total_bytes:int, profile:SparkExecutionProfile) -> int:
+    """One partition per advisory_partition_size of data, rounded up to a multiple of the cores so no core is idle in the last wave of tasks."""
+    cores = profile.get_number_of_cores()
+    partitions = math.ceil(total_bytes / parse_size_in_bytes(profile.advisory_partition_size))
+    partitions = math.ceil(max(partitions, 1) / cores) * cores
+    return min(partitions, max(profile.max_shuffle_partitions, cores))
+
+def tune_shuffle_partitions_for_tables(spark:SparkSession, table_names:Iterable[str], db_interface, profile:SparkExecutionProfile|None=None) -> int:
+    """
+    Set the shuffle partitions of the session for processing the tables, estimating their size from the database catalog.
+    Profiles with a fixed number of shuffle partitions keep it. Returns the number of partitions set.
+    """
+    profile = profile or get_spark_execution_profile()
+    if profile.shuffle_partitions is not None:
+        shuffle_partitions = profile.shuffle_partitions
+    else:
+        table_sizes_in_bytes = db_interface.get_table_sizes_in_bytes(table_names)
+        shuffle_partitions = estimate_shuffle_partitions(sum(table_sizes_in_bytes.values()), profile)
+    spark.conf.set('spark.sql.shuffle.partitions', str(shuffle_partitions))
+    return shuffle_partitions
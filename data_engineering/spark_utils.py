@@ -13,6 +13,7 @@ from pyspark.sql import functions as F
 from pyspark.sql.types import FloatType, DataType
 from pyspark.ml.functions import vector_to_array
 from pyspark.sql import SparkSession
+from df_utils import asof_join
                                                                   
 class ColumnSelector(Transformer):
     """A custom transformer that selects some columns from the original dataframe
@@ -26,6 +27,18 @@ class ColumnSelector(Transformer):
     def _transform(self, dataset: DataFrame) -> DataFrame:
         return dataset.select(self.columns_to_select)
     
+class AsofValueFiller(Transformer):
+    """A custom transformer that fills the missing values of some columns with the latest known value at or before the date of each row,
+    with df_utils.asof_join, for sparse daily dimensions like the oil prices, that are missing on some holidays.
+    """
+    def __init__(self, date_column:str, columns_to_fill:list[str]):
+        super(AsofValueFiller, self).__init__()
+        self.date_column = date_column
+        self.columns_to_fill = columns_to_fill
+
+    def _transform(self, dataset: DataFrame) -> DataFrame:
+        return asof_join(dataset.drop(*self.columns_to_fill), dataset, on=self.date_column, value_columns=self.columns_to_fill)
+
 class ColumnDropper(Transformer):
     """A custom transformer that drops some columns from the original dataframe
     """
@@ -93,6 +106,61 @@ class VectorToArrayTransformer(Transformer):
             ) 
         return dataset
 
+class GroupAggregator(Transformer):
+    """
+    A custom transformer that aggregates the rows of each group into one, for feature groups with fewer rows than their source, like one per date and store.
+    
+    Example usage:
+    aggregator = GroupAggregator(['date', 'store_id'], [F.count('*').cast('smallint').alias('special_days_count')])
+    """
+    def __init__(self, group_columns:List[str], aggregate_columns:List[Column]):
+        super(GroupAggregator, self).__init__()
+        self.group_columns = group_columns
+        self.aggregate_columns = aggregate_columns
+    
+    def _transform(self, dataset: DataFrame) -> DataFrame:
+        return dataset.groupBy(*self.group_columns).agg(*self.aggregate_columns)
+
+class SeriesLagFeaturesMaker(Transformer):
+    """
+    A custom transformer that adds the lags, and rolling means, sums and standard deviations of a column, computed within each series with window functions.
+    Both are ranges of days before each row, not of rows, so missing dates, like christmas, don't shift the lags or stretch the rolling windows,
+    the lag of a day without a row is null. The rolling windows don't include the row itself, so they don't leak its value.
+    Each series must have at most one row per date.
+    
+    Example usage:
+    lag_features_maker = SeriesLagFeaturesMaker(['store_id', 'product_family'], 'date', 'sales_total', lags=[1, 7], rolling_horizons_in_days=[7, 28])
+    """
+    def __init__(self, series_columns:List[str], date_column:str, value_column:str, lags:Iterable[int], rolling_horizons_in_days:Iterable[int], output_prefix:str='sales'):
+        super(SeriesLagFeaturesMaker, self).__init__()
+        self.series_columns = series_columns
+        self.date_column = date_column
+        self.value_column = value_column
+        self.lags = list(lags)
+        self.rolling_horizons_in_days = list(rolling_horizons_in_days)
+        self.output_prefix = output_prefix
+
+    def get_output_columns(self) -> list[str]:
+        return [
+            *[f'{self.output_prefix}_lag_{lag}' for lag in self.lags],
+            *[f'{self.output_prefix}_rolling_{statistic}_{horizon}d' for horizon in self.rolling_horizons_in_days for statistic in ('mean', 'sum', 'std')],
+        ]
+    
+    def _transform(self, dataset: DataFrame) -> DataFrame:
+        from pyspark.sql import Window
+        #Range windows need a numeric order, the number of days since the unix epoch.
+        series_by_day_number = Window.partitionBy(*self.series_columns).orderBy(F.datediff(F.col(self.date_column), F.lit('1970-01-01')))
+        value = F.col(self.value_column)
+        #The range of a single day, lag days before, has the row of that date, if there is one.
+        new_columns = {f'{self.output_prefix}_lag_{lag}': F.first(value).over(series_by_day_number.rangeBetween(-lag, -lag)) for lag in self.lags}
+        for horizon in self.rolling_horizons_in_days:
+            previous_days = series_by_day_number.rangeBetween(-horizon, -1)
+            new_columns[f'{self.output_prefix}_rolling_mean_{horizon}d'] = F.avg(value).over(previous_days)
+            new_columns[f'{self.output_prefix}_rolling_sum_{horizon}d'] = F.sum(value).over(previous_days)
+            new_columns[f'{self.output_prefix}_rolling_std_{horizon}d'] = F.stddev(value).over(previous_days)
+        #All the windows share the partitioning, so spark shuffles the rows only once.
+        return dataset.withColumns(new_columns)
+
 """ 
 transformed_oil_data_arr = transformed_oil_data.withColumn(
     "oil_price_vect", vector_to_array("oil_price_vect")
@@ -113,4 +181,17 @@ transformed_oil_data_single_values = transformed_oil_data.withColumn(
 def get_current_data_in_sql_table(spark:SparkSession, spark_sql_options:dict[str,str], table_name:str):
     """Get the data in a sql table as a lazy spark dataframe."""
     stored_data = spark.read.format('jdbc').options(**spark_sql_options).option('dbtable', table_name).load()
-    return stored_data
\ No newline at end of file
+    return stored_data
+def get_data_in_sql_table_between_dates(spark:SparkSession, spark_sql_options:dict[str,str], table_name:str, first_date, last_date, date_column:str='date'):
+    """
+    Get the rows of a sql table from first_date to last_date, both included, as a lazy spark dataframe.
+    The filter is pushed down to the database, so on tables partitioned by date only the partitions of those dates are scanned.
+    """
+    stored_data = get_current_data_in_sql_table(spark, spark_sql_options, table_name)
+    return stored_data.filter((stored_data[date_column] >= F.lit(first_date)) & (stored_data[date_column] <= F.lit(last_date)))
+
+def convert_vector_columns_to_arrays(df:DataFrame) -> DataFrame:
+    """Turn the ml vector columns, that jdbc can't store, into arrays of doubles, stored as double precision[] in postgres."""
+    from pyspark.ml.linalg import VectorUDT
+    vector_columns = [field.name for field in df.schema.fields if isinstance(field.dataType, VectorUDT)]
+    return df.withColumns({vector_column: vector_to_array(vector_column) for vector_column in vector_columns}) # type: ignore <- vector_to_array accepts column names
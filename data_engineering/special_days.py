@@ -0,0 +1,115 @@
+"""
+The special days of each store, one row per date and store, instead of one row per event.
+Several events can take place on the same date, so joining holidays_events by date alone repeats every sales row of those dates once per event.
+Each event is only relevant to some stores: national ones to all of them, regional ones to the stores of their state, and local ones to the stores of their city.
+The events relevant to each store on each date are aggregated into:
+    The most relevant event, the one celebrated on that date (not transferred) with the most specific locale, in the same columns as holidays_events.
+    Bitmasks of the types and locales of all of them, and counts, as small ints, so no event is lost.
+It can be used by the pandas path directly, and the same aggregation is done in the database for the spark path, from the view made with make_create_special_days_by_date_store_view_statements.
+"""
+import numpy as np
+import pandas as pd
+
+#The bit of each value in the bitmasks, both fit in an int8.
+bit_of_day_type = {'Holiday': 1, 'Transfer': 2, 'Additional': 4, 'Bridge': 8, 'Work Day': 16, 'Event': 32}
+bit_of_locale_type = {'National': 1, 'Regional': 2, 'Local': 4}
+#Lower is more relevant, a local event tells more about the day of a store than a national one.
+priority_of_locale_type = {'Local': 0, 'Regional': 1, 'National': 2}
+
+special_day_count_columns = ['special_day_types_bitmask', 'special_day_locale_types_bitmask', 'special_days_count', 'transferred_special_days_count']
+
+def aggregate_special_days_by_date_store(special_days_df:pd.DataFrame, stores_df:pd.DataFrame) -> pd.DataFrame:
+    """
+    Get the special days relevant to each store, one row per date and store_nbr, with the columns named like after data_preparation_attempt4.rename_raw_dfs_cols.
+    stores_df: Indexed by store_nbr, with store_city and store_state.
+    Dates and stores without special days have no row, so after a left merge the counts must be filled with 0.
+    """
+    stores = stores_df.reset_index()[['store_nbr', 'store_city', 'store_state']]
+    #There are a few hundred special days and about 50 stores, so matching every pair is cheap.
+    special_days_of_stores = special_days_df.merge(stores, how='cross')
+    locale_type = special_days_of_stores['special_day_locale_type']
+    is_relevant_to_store = (
+        (locale_type == 'National')
+        | ((locale_type == 'Regional') & (special_days_of_stores['special_day_locale'] == special_days_of_stores['store_state']))
+        | ((locale_type == 'Local') & (special_days_of_stores['special_day_locale'] == special_days_of_stores['store_city']))
+    )
+    special_days_of_stores = special_days_of_stores.loc[is_relevant_to_store].drop(columns=['store_city', 'store_state'])
+
+    special_days_of_stores['_day_type_bit'] = special_days_of_stores['day_type'].map(bit_of_day_type).fillna(0).astype('int8')
+    special_days_of_stores['_locale_type_bit'] = special_days_of_stores['special_day_locale_type'].map(bit_of_locale_type).fillna(0).astype('int8')
+    special_days_of_stores['_locale_priority'] = special_days_of_stores['special_day_locale_type'].map(priority_of_locale_type).fillna(len(priority_of_locale_type))
+    special_days_of_stores['_is_transferred'] = special_days_of_stores['special_day_transferred'].astype(bool)
+
+    grouped_special_days = special_days_of_stores.groupby(['date', 'store_nbr'], sort=False)
+    counts = pd.DataFrame({
+        'special_day_types_bitmask': grouped_special_days['_day_type_bit'].agg(np.bitwise_or.reduce),
+        'special_day_locale_types_bitmask': grouped_special_days['_locale_type_bit'].agg(np.bitwise_or.reduce),
+        'special_days_count': grouped_special_days.size(),
+        'transferred_special_days_count': grouped_special_days['_is_transferred'].sum(),
+    }).astype('int8')
+
+    #A stable sort keeps the order of holidays_events between events of the same relevance.
+    most_relevant_special_days = (
+        special_days_of_stores
+        .sort_values(['_is_transferred', '_locale_priority'], kind='stable')
+        .drop_duplicates(['date', 'store_nbr'])
+        .drop(columns=['_day_type_bit', '_locale_type_bit', '_locale_priority', '_is_transferred'])
+    )
+    return most_relevant_special_days.merge(counts, left_on=['date', 'store_nbr'], right_index=True)
+
+def merge_special_days_by_date_store(dataset:pd.DataFrame, special_days_by_date_store:pd.DataFrame) -> pd.DataFrame:
+    """Left merge the special days of each store into the dataset, which keeps its number of rows, since there is at most one per date and store."""
+    dataset = dataset.merge(special_days_by_date_store, on=['date', 'store_nbr'], how='left', validate='many_to_one')
+    dataset[special_day_count_columns] = dataset[special_day_count_columns].fillna(0).astype('int8')
+    return dataset
+
+def _make_case_statement(column:str, value_by_category:dict, default) -> str:
+    cases = ' '.join(f"WHEN '{category}' THEN {value}" for category, value in value_by_category.items())
+    return f'CASE {column} {cases} ELSE {default} END'
+
+def make_create_special_days_by_date_store_view_statements(view_name:str, events_table_name:str, stores_table_name:str) -> list[str]:
+    """
+    The statements to (re)create a view with a row per event and store it is relevant to, with the bits and priority used to aggregate them per date and store.
+    Works both in postgres and duckdb.
+    """
+    return [
+        f'DROP VIEW IF EXISTS {view_name}',
+        f"""CREATE VIEW {view_name} AS
+SELECT
+    events.date,
+    stores.id AS store_id,
+    events.type,
+    events.locale,
+    events.locale_name,
+    events.description,
+    events.was_transferred,
+    {_make_case_statement('events.type', bit_of_day_type, 0)} AS day_type_bit,
+    {_make_case_statement('events.locale', bit_of_locale_type, 0)} AS locale_type_bit,
+    {_make_case_statement('events.locale', priority_of_locale_type, len(priority_of_locale_type))} AS locale_priority
+FROM {events_table_name} AS events
+JOIN {stores_table_name} AS stores ON
+    events.locale = 'National'
+    OR (events.locale = 'Regional' AND events.locale_name = stores.state)
+    OR (events.locale = 'Local' AND events.locale_name = stores.city)""",
+    ]
+
+def make_special_days_by_date_store_query(view_name:str) -> str:
+    """
+    The query of the special days of each store, aggregated from the view of make_create_special_days_by_date_store_view_statements, one row per date and store_id.
+    The window aggregates are computed before DISTINCT ON keeps the most relevant event of each date and store.
+    """
+    by_date_store = 'OVER (PARTITION BY date, store_id)'
+    return f"""SELECT DISTINCT ON (date, store_id)
+    date,
+    store_id,
+    type,
+    locale,
+    locale_name,
+    description,
+    was_transferred,
+    CAST(BIT_OR(day_type_bit) {by_date_store} AS SMALLINT) AS special_day_types_bitmask,
+    CAST(BIT_OR(locale_type_bit) {by_date_store} AS SMALLINT) AS special_day_locale_types_bitmask,
+    CAST(COUNT(*) {by_date_store} AS SMALLINT) AS special_days_count,
+    CAST(COUNT(*) FILTER (WHERE was_transferred) {by_date_store} AS SMALLINT) AS transferred_special_days_count
+FROM {view_name}
+ORDER BY date, store_id, was_transferred, locale_priority"""
@@ -1,5 +1,6 @@
 import psycopg
-from typing import Iterable, cast, LiteralString
+from itertools import islice
+from typing import Iterable, Iterator, cast, LiteralString
 from pyspark.sql import SparkSession, DataFrame as SparkDataFrame
 
 from order_utils import create_desc_filter
@@ -80,6 +81,19 @@ def execute_queries(sql_queries: Iterable[LiteralString|str], conn: psycopg.conn
             break
     conn.commit()
 
+def execute_queries_in_transaction(sql_queries: Iterable[LiteralString|str], conn: psycopg.connection.Connection) -> None:
+    """Execute multiple queries in a single transaction, commiting them only if they are all sucesfull, otherwise rolling them back and raising the error."""
+    with conn.cursor() as cur:
+        for sql_query in sql_queries:
+            try:
+                cur.execute(cast(LiteralString, sql_query))
+            except Exception as e:
+                print(f"{type(e).__name__}: {e}")
+                print(f"Query: {sql_query}")
+                conn.rollback()
+                raise
+    conn.commit()
+
 def create_tables_that_dont_exist(db_info, creation_queries):
     """TODO REMOVE AND USE EXECUTE_QUERIES INSTEAD"""
     for query in creation_queries:
@@ -147,3 +161,68 @@ def make_where_each_column_equals_values_statement(identity_columns:Iterable[str
     where_statement = where_statement[:-2] #remove trailing coma and space
     where_statement = cast(LiteralString, where_statement)
     return where_statement
+
+def iterate_in_chunks(values:Iterable, chunk_size:int) -> Iterator[list]:
+    """Group the values in lists of chunk_size values, without materializing more than one chunk at a time."""
+    values_iterator = iter(values)
+    while chunk := list(islice(values_iterator, chunk_size)):
+        yield chunk
+
+#The rows committed so far by each resumable chunked write, updated in the same transaction as each chunk.
+create_write_checkpoints_table_query:LiteralString = """
+CREATE TABLE IF NOT EXISTS pipeline_write_checkpoints (
+    checkpoint_name TEXT PRIMARY KEY,
+    rows_committed BIGINT NOT NULL,
+    updated_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+)"""
+get_write_checkpoint_query:LiteralString = 'SELECT rows_committed FROM pipeline_write_checkpoints WHERE checkpoint_name = %s'
+save_write_checkpoint_query:LiteralString = """
+INSERT INTO pipeline_write_checkpoints (checkpoint_name, rows_committed) VALUES (%s, %s)
+ON CONFLICT (checkpoint_name) DO UPDATE SET rows_committed = EXCLUDED.rows_committed, updated_at = CURRENT_TIMESTAMP"""
+delete_write_checkpoint_query:LiteralString = 'DELETE FROM pipeline_write_checkpoints WHERE checkpoint_name = %s'
+
+def get_write_checkpoint(checkpoint_name:str, connection:psycopg.connection.Connection) -> int:
+    """Get the rows already committed by a chunked write, creating the checkpoints table if needed. 0 if it has no checkpoint."""
+    with connection.cursor() as cursor:
+        cursor.execute(create_write_checkpoints_table_query)
+        cursor.execute(get_write_checkpoint_query, (checkpoint_name,))
+        checkpoint = cursor.fetchone()
+    connection.commit()
+    return checkpoint[0] if checkpoint else 0
+
+def save_write_checkpoint(checkpoint_name:str, rows_committed:int, connection:psycopg.connection.Connection) -> None:
+    """Save the checkpoint, without commiting, so it is commited together with the chunk it belongs to."""
+    with connection.cursor() as cursor:
+        cursor.execute(save_write_checkpoint_query, (checkpoint_name, rows_committed))
+
+def delete_write_checkpoint(checkpoint_name:str, connection:psycopg.connection.Connection) -> None:
+    with connection.cursor() as cursor:
+        cursor.execute(delete_write_checkpoint_query, (checkpoint_name,))
+
+def make_create_narrow_table_statements(table_name:str, source_table_name:str, identity_columns:Iterable[str], sql_column_strings:Iterable[str]) -> list[str]:
+    """
+    The statements to create a table with the identity columns of the source table, with their same types, and the columns of sql_column_strings.
+    The identity columns get a unique index, so the table can be joined to the source, and don't repeat rows.
+    """
+    identity_columns = list(identity_columns)
+    return [
+        f"CREATE TABLE IF NOT EXISTS {table_name} AS SELECT {', '.join(identity_columns)} FROM {source_table_name} WHERE false",
+        *[f'ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {sql_column_string}' for sql_column_string in sql_column_strings],
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_identity_idx ON {table_name} ({', '.join(identity_columns)})",
+    ]
+
+def make_create_joined_view_statements(view_name:str, source_table_name:str, joined_table_name:str, identity_columns:Iterable[str], joined_columns:Iterable[str]) -> list[str]:
+    """
+    The statements to (re)create a view of the source table, with the joined columns of the joined table added to each row, matched by the identity columns.
+    The view is dropped first, since CREATE OR REPLACE can't remove or reorder columns.
+    """
+    joined_columns_selection = ''.join(f', {joined_table_name}.{joined_column}' for joined_column in joined_columns)
+    return [
+        f'DROP VIEW IF EXISTS {view_name}',
+        f"CREATE VIEW {view_name} AS SELECT {source_table_name}.*{joined_columns_selection} FROM {source_table_name} LEFT JOIN {joined_table_name} USING ({', '.join(identity_columns)})",
+    ]
+
+#Escapes the _ in the prefix, which like treats as any character. Works both in postgres and duckdb.
+get_table_names_starting_with_query:LiteralString = """
+SELECT table_name FROM information_schema.tables
+WHERE table_schema = current_schema() AND table_name LIKE replace(%s, '_', '\\_') || '%%' ESCAPE '\\'"""
@@ -0,0 +1,218 @@
+"""
+Generates synthetic versions of the csv datasets of dataset_properties, at a multiple of the size of the kaggle train.csv,
+to measure how the pipeline stages behave above the size of the competition data.
+The files have the same names and columns as the kaggle ones, and similar cardinalities:
+33 product families, 22 cities in 16 states, 5 store types and 17 clusters, with the number of stores being multiplied by the scale.
+The holidays follow the same patterns as the kaggle ones, national, regional and local holidays, transferred holidays, bridges, additional days, and events,
+including dates with multiple events, which duplicate rows when merged.
+
+Usage:
+python synthetic_data.py --scales 1 10 100 --output-path ../synthetic_dataset
+"""
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from dataset_properties import properties_by_csv_sql_dataset
+
+PRODUCT_FAMILIES = [
+    'AUTOMOTIVE', 'BABY CARE', 'BEAUTY', 'BEVERAGES', 'BOOKS', 'BREAD/BAKERY', 'CELEBRATION', 'CLEANING', 'DAIRY', 'DELI', 'EGGS',
+    'FROZEN FOODS', 'GROCERY I', 'GROCERY II', 'HARDWARE', 'HOME AND KITCHEN I', 'HOME AND KITCHEN II', 'HOME APPLIANCES', 'HOME CARE',
+    'LADIESWEAR', 'LAWN AND GARDEN', 'LINGERIE', 'LIQUOR,WINE,BEER', 'MAGAZINES', 'MEATS', 'PERSONAL CARE', 'PET SUPPLIES',
+    'PLAYERS AND ELECTRONICS', 'POULTRY', 'PREPARED FOODS', 'PRODUCE', 'SCHOOL AND OFFICE SUPPLIES', 'SEAFOOD'
+]
+#City: (state, share of the stores), the shares are similar to the ones of the kaggle stores.
+STATE_AND_STORE_SHARE_BY_CITY = {
+    'Quito': ('Pichincha', 18), 'Guayaquil': ('Guayas', 8), 'Cuenca': ('Azuay', 3), 'Santo Domingo': ('Santo Domingo de los Tsachilas', 3),
+    'Manta': ('Manabi', 2), 'Machala': ('El Oro', 2), 'Latacunga': ('Cotopaxi', 2), 'Ambato': ('Tungurahua', 2), 'Riobamba': ('Chimborazo', 1),
+    'Loja': ('Loja', 1), 'Ibarra': ('Imbabura', 1), 'Babahoyo': ('Los Rios', 1), 'Quevedo': ('Los Rios', 1), 'Daule': ('Guayas', 1),
+    'Libertad': ('Guayas', 1), 'Salinas': ('Santa Elena', 1), 'Esmeraldas': ('Esmeraldas', 1), 'El Carmen': ('Manabi', 1), 'Playas': ('Guayas', 1),
+    'Guaranda': ('Bolivar', 1), 'Cayambe': ('Pichincha', 1), 'Puyo': ('Pastaza', 1),
+}
+STORE_TYPES = ['A', 'B', 'C', 'D', 'E']
+NUMBER_OF_STORE_CLUSTERS = 17
+KAGGLE_NUMBER_OF_STORES = 54
+DAYS_IN_TEST = 16
+#Sales multiplier of each day of the week, from monday to sunday.
+WEEKDAY_SALES_FACTORS = np.array([0.9, 0.85, 0.85, 0.8, 0.95, 1.2, 1.25])
+#month, day, description
+FIXED_NATIONAL_HOLIDAYS = [
+    (1, 1, 'Primer dia del ano'), (5, 1, 'Dia del Trabajo'), (5, 24, 'Batalla de Pichincha'), (8, 10, 'Primer Grito de Independencia'),
+    (10, 9, 'Independencia de Guayaquil'), (11, 2, 'Dia de Difuntos'), (11, 3, 'Independencia de Cuenca'), (12, 25, 'Navidad'),
+]
+
+def _get_csv_file_name_and_columns(dataset_name:str) -> tuple[str, list[str]]:
+    """Get the file name and the csv column names of a dataset, from its properties, so the synthetic files always match what ingestion expects."""
+    dataset_props = properties_by_csv_sql_dataset[dataset_name]
+    return os.path.basename(dataset_props.csv_file_path), list(dataset_props.sql_col_csv_equivalents.values())
+
+def _write_csv(df:pd.DataFrame, output_path:str, dataset_name:str, append=False) -> str:
+    file_name, csv_columns = _get_csv_file_name_and_columns(dataset_name)
+    file_path = os.path.join(output_path, file_name)
+    df[csv_columns].to_csv(file_path, index=False, mode='a' if append else 'w', header=not append)
+    return file_path
+
+def make_synthetic_stores(number_of_stores:int, rng:np.random.Generator) -> pd.DataFrame:
+    cities = list(STATE_AND_STORE_SHARE_BY_CITY)
+    store_shares = np.array([store_share for _, store_share in STATE_AND_STORE_SHARE_BY_CITY.values()], dtype='float64')
+    #Every city has at least one store when there are enough of them, like in the kaggle data.
+    store_cities = (cities + list(rng.choice(cities, max(0, number_of_stores - len(cities)), p=store_shares / store_shares.sum())))[:number_of_stores]
+    return pd.DataFrame({
+        'store_nbr': np.arange(1, number_of_stores + 1),
+        'city': store_cities,
+        'state': [STATE_AND_STORE_SHARE_BY_CITY[city][0] for city in store_cities],
+        'type': rng.choice(STORE_TYPES, number_of_stores, p=[0.17, 0.15, 0.28, 0.33, 0.07]),
+        'cluster': rng.integers(1, NUMBER_OF_STORE_CLUSTERS + 1, number_of_stores),
+    })
+
+def _get_easter_sunday(year:int) -> pd.Timestamp:
+    """The anonymous gregorian algorithm, used to place carnaval and good friday."""
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = divmod(b, 4)
+    g = (8 * b + 13) // 25
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month, day = divmod(h + l - 7 * m + 114, 31)
+    return pd.Timestamp(year, month, day + 1)
+
+def make_synthetic_holidays_events(stores_df:pd.DataFrame, first_date:str, last_date:str, rng:np.random.Generator) -> pd.DataFrame:
+    """Holidays and events with the same types, locales and patterns as holidays_events.csv"""
+    first_timestamp, last_timestamp = pd.Timestamp(first_date), pd.Timestamp(last_date)
+    #Each city and state gets its own foundation day, which doesn't change between years.
+    local_holidays = [(rng.integers(1, 13), rng.integers(1, 29), city) for city in stores_df['city'].unique()]
+    regional_holidays = [(rng.integers(1, 13), rng.integers(1, 29), state) for state in stores_df['state'].unique()]
+
+    holiday_rows = []
+    def add_holiday(date, holiday_type, locale, locale_name, description, transferred=False):
+        holiday_rows.append((date, holiday_type, locale, locale_name, description, transferred))
+
+    for year in range(first_timestamp.year, last_timestamp.year + 1):
+        for month, day, description in FIXED_NATIONAL_HOLIDAYS:
+            holiday_date = pd.Timestamp(year, month, day)
+            #Some holidays are moved to a nearby date, which appears as a Transfer day.
+            if description != 'Navidad' and rng.random() < 0.15:
+                add_holiday(holiday_date, 'Holiday', 'National', 'Ecuador', description, transferred=True)
+                add_holiday(holiday_date + pd.Timedelta(days=int(rng.integers(1, 4))), 'Transfer', 'National', 'Ecuador', f'Traslado {description}')
+            else:
+                add_holiday(holiday_date, 'Holiday', 'National', 'Ecuador', description)
+            if description in ('Primer dia del ano', 'Dia de Difuntos') and rng.random() < 0.4:
+                add_holiday(holiday_date + pd.Timedelta(days=1 if holiday_date.dayofweek == 4 else -1), 'Bridge', 'National', 'Ecuador', f'Puente {description}')
+                add_holiday(holiday_date + pd.Timedelta(days=int(rng.integers(7, 60))), 'Work Day', 'National', 'Ecuador', f'Recupero puente {description}')
+
+        #Christmas has additional days before and after it, and new year's eve.
+        for days_from_christmas in (-4, -3, -2, -1, 1, 6):
+            add_holiday(pd.Timestamp(year, 12, 25) + pd.Timedelta(days=days_from_christmas), 'Additional', 'National', 'Ecuador', f'Navidad{days_from_christmas:+d}')
+
+        easter_sunday = _get_easter_sunday(year)
+        add_holiday(easter_sunday - pd.Timedelta(days=48), 'Holiday', 'National', 'Ecuador', 'Carnaval')
+        add_holiday(easter_sunday - pd.Timedelta(days=47), 'Holiday', 'National', 'Ecuador', 'Carnaval')
+        add_holiday(easter_sunday - pd.Timedelta(days=2), 'Holiday', 'National', 'Ecuador', 'Viernes Santo')
+        mothers_day = pd.Timestamp(year, 5, 1) + pd.offsets.Week(weekday=6) + pd.offsets.Week(weekday=6)
+        add_holiday(mothers_day, 'Event', 'National', 'Ecuador', 'Dia de la Madre')
+        add_holiday(pd.Timestamp(year, 11, 1) + pd.offsets.Week(weekday=4) * 4, 'Event', 'National', 'Ecuador', 'Black Friday')
+
+        for month, day, city in local_holidays:
+            add_holiday(pd.Timestamp(year, month, day), 'Holiday', 'Local', city, f'Fundacion de {city}')
+        for month, day, state in regional_holidays:
+            add_holiday(pd.Timestamp(year, month, day), 'Holiday', 'Regional', state, f'Provincializacion de {state}')
+
+    holidays_events_df = pd.DataFrame(holiday_rows, columns=['date', 'type', 'locale', 'locale_name', 'description', 'transferred'])
+    holidays_events_df = holidays_events_df[holidays_events_df['date'].between(first_timestamp, last_timestamp)]
+    holidays_events_df = holidays_events_df.drop_duplicates(['date', 'type', 'locale', 'locale_name', 'description', 'transferred'])
+    return holidays_events_df.sort_values('date', kind='stable').assign(date=lambda df: df['date'].dt.strftime('%Y-%m-%d'))
+
+def make_synthetic_oil_prices(first_date:str, last_date:str, rng:np.random.Generator) -> pd.DataFrame:
+    """A random walk of the oil price on business days, with some missing values, like oil.csv"""
+    business_days = pd.bdate_range(first_date, last_date)
+    oil_prices = np.clip(93 + np.cumsum(rng.normal(0, 1.2, len(business_days))), 20, None).round(2)
+    oil_prices[rng.random(len(business_days)) < 0.03] = np.nan
+    oil_prices[0] = np.nan
+    return pd.DataFrame({'date': business_days.strftime('%Y-%m-%d'), 'dcoilwtico': oil_prices})
+
+def generate_synthetic_dataset(output_path:str, scale:int=1, seed:int=0, first_date:str='2013-01-01', last_date:str='2017-08-15', dates_per_chunk:int=31) -> dict[str, str]:
+    """
+    Write the synthetic csv files of the datasets of dataset_properties into output_path, plus a test.csv for the following 16 days.
+    scale: How many times bigger than the kaggle train.csv the synthetic one is. The number of stores is multiplied by it.
+    dates_per_chunk: train.csv is generated and written this many dates at a time, so memory doesn't grow with the scale.
+    Returns the path of each file by dataset name.
+    """
+    os.makedirs(output_path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    number_of_stores = KAGGLE_NUMBER_OF_STORES * scale
+    last_test_date = (pd.Timestamp(last_date) + pd.Timedelta(days=DAYS_IN_TEST)).strftime('%Y-%m-%d')
+
+    stores_df = make_synthetic_stores(number_of_stores, rng)
+    holidays_events_df = make_synthetic_holidays_events(stores_df, first_date, last_test_date, rng)
+    file_path_by_dataset_name = {
+        'stores': _write_csv(stores_df, output_path, 'stores'),
+        'events_by_date': _write_csv(holidays_events_df, output_path, 'events_by_date'),
+        'oil_price_by_date': _write_csv(make_synthetic_oil_prices(first_date, last_test_date, rng), output_path, 'oil_price_by_date'),
+    }
+
+    national_holiday_dates = pd.to_datetime(holidays_events_df.loc[(holidays_events_df['locale'] == 'National') & ~holidays_events_df['transferred'], 'date'])
+    #Each series has its own sales level, and some stores open after the first date, having no sales before it.
+    sales_level = rng.lognormal(0, 0.6, (number_of_stores, 1)) * rng.lognormal(3, 1.5, (1, len(PRODUCT_FAMILIES)))
+    promotion_rate = rng.gamma(0.5, 8, (1, len(PRODUCT_FAMILIES)))
+    all_dates = pd.date_range(first_date, last_test_date)
+    all_dates = all_dates[(all_dates.month != 12) | (all_dates.day != 25)] #All the stores are closed on christmas, so kaggle has no rows for it.
+    store_opening_dates = np.where(rng.random(number_of_stores) < 0.1, rng.choice(all_dates[:len(all_dates) // 2], number_of_stores), all_dates[0].to_datetime64())
+
+    next_id = 0
+    train_dates, test_dates = all_dates[all_dates <= pd.Timestamp(last_date)], all_dates[all_dates > pd.Timestamp(last_date)]
+    for dates, dataset_name in ((train_dates, 'sales_agg_by_date_store_productfamily'), (test_dates, 'test')):
+        first_id_of_dataset = next_id
+        for chunk_start in range(0, len(dates), dates_per_chunk):
+            chunk_dates = dates[chunk_start:chunk_start + dates_per_chunk]
+            date_factors = (
+                WEEKDAY_SALES_FACTORS[chunk_dates.dayofweek]
+                * np.where((chunk_dates.day == 15) | chunk_dates.is_month_end, 1.1, 1) #Paydays
+                * np.where(chunk_dates.isin(national_holiday_dates), 1.3, 1)
+                * np.where((chunk_dates.month == 1) & (chunk_dates.day == 1), 0.02, 1) #Most stores are closed on new year's day
+                * (1 + 0.3 * np.asarray((chunk_dates - all_dates[0]).days) / len(all_dates)) #A slow upwards trend
+            )
+            store_is_open = chunk_dates.to_numpy()[:, None] >= store_opening_dates[None, :]
+            sales = sales_level[None] * date_factors[:, None, None] * store_is_open[:, :, None] * rng.lognormal(0, 0.3, (len(chunk_dates), number_of_stores, len(PRODUCT_FAMILIES)))
+            #Promotions only started being registered in april 2014.
+            promotions = rng.poisson(promotion_rate[None] * store_is_open[:, :, None], sales.shape) * (chunk_dates >= pd.Timestamp('2014-04-01'))[:, None, None]
+
+            number_of_rows = sales.size
+            chunk_df = pd.DataFrame({
+                'id': np.arange(next_id, next_id + number_of_rows),
+                'date': np.repeat(chunk_dates.strftime('%Y-%m-%d'), number_of_stores * len(PRODUCT_FAMILIES)),
+                'store_nbr': np.tile(np.repeat(stores_df['store_nbr'].to_numpy(), len(PRODUCT_FAMILIES)), len(chunk_dates)),
+                'family': np.tile(PRODUCT_FAMILIES, len(chunk_dates) * number_of_stores),
+                'sales': sales.reshape(-1).round(3),
+                'onpromotion': promotions.reshape(-1),
+            })
+            next_id += number_of_rows
+            if dataset_name == 'test':
+                file_path_by_dataset_name['test'] = os.path.join(output_path, 'test.csv')
+                chunk_df.drop(columns='sales').to_csv(file_path_by_dataset_name['test'], index=False, mode='w' if chunk_start == 0 else 'a', header=chunk_start == 0)
+                continue
+            file_path_by_dataset_name[dataset_name] = _write_csv(chunk_df, output_path, dataset_name, append=chunk_start != 0)
+
+            #Transactions follow the sales of each store, and only exist for the stores that had any.
+            store_sales = sales.sum(axis=2)
+            transactions_df = pd.DataFrame({
+                'date': np.repeat(chunk_dates.strftime('%Y-%m-%d'), number_of_stores),
+                'store_nbr': np.tile(stores_df['store_nbr'].to_numpy(), len(chunk_dates)),
+                'transactions': np.round(store_sales.reshape(-1) ** 0.8 * rng.normal(1, 0.05, store_sales.size)).astype('int64'),
+            })
+            transactions_df = transactions_df[transactions_df['transactions'] > 0]
+            file_path_by_dataset_name['transactions_agg_by_date_store'] = _write_csv(transactions_df, output_path, 'transactions_agg_by_date_store', append=chunk_start != 0)
+        print(f'Wrote {next_id - first_id_of_dataset} rows of {dataset_name} for scale {scale}')
+
+    return file_path_by_dataset_name
+
+
+if __name__ == '__main__':
+    argument_parser = argparse.ArgumentParser(description='Generate synthetic versions of the store sales csv datasets at multiples of the kaggle size.')
+    argument_parser.add_argument('--scales', type=int, nargs='+', default=[1], help='Multiples of the kaggle train.csv size to generate, each one into its own folder')
+    argument_parser.add_argument('--output-path', default='../synthetic_dataset')
+    argument_parser.add_argument('--seed', type=int, default=0)
+    arguments = argument_parser.parse_args()
+
+    for scale in arguments.scales:
+        generate_synthetic_dataset(os.path.join(arguments.output_path, f'{scale}x'), scale, arguments.seed)
@@ -0,0 +1,103 @@
+"""
+Declarative definitions of the sql tables, that generate their DDL: the table, its comment, its secondary indexes,
+and for the big fact tables, monthly or yearly partitions by date range.
+With the partitions, reads filtered by date, like the ones of date range folds, only scan the partitions of those dates,
+and the indexes on store_id and date keep the linked split filters and joins from scanning the whole table.
+The partitions are created when rows of new dates are ingested, with create_partitions_for_date_range.
+"""
+from dataclasses import dataclass
+from datetime import date
+from typing import Literal
+
+@dataclass(frozen=True)
+class IndexSpec():
+    columns:tuple[str, ...]
+    method:str = 'btree' #For example brin, for columns correlated with the insertion order.
+
+    def get_name(self, table_name:str) -> str:
+        return f"{table_name}_{'_'.join(self.columns)}_idx"
+
+    def get_create_script(self, table_name:str, with_method:bool=True) -> str:
+        """
+        with_method: If False the method is left out, for databases with a single kind of index, like duckdb, which rejects USING btree.
+        The default btree is always left out, since it's what CREATE INDEX makes without USING.
+        """
+        #On a partitioned table the index is created on every partition, including the ones created later.
+        using_method = f' USING {self.method}' if with_method and self.method != 'btree' else ''
+        return f"CREATE INDEX IF NOT EXISTS {self.get_name(table_name)} ON {table_name}{using_method} ({', '.join(self.columns)})"
+
+
+@dataclass(frozen=True)
+class DateRangePartitioningSpec():
+    column:str = 'date'
+    interval:Literal['month', 'year'] = 'month'
+
+    def get_partition_start(self, any_date:date) -> date:
+        return date(any_date.year, any_date.month if self.interval == 'month' else 1, 1)
+
+    def get_next_partition_start(self, partition_start:date) -> date:
+        if self.interval == 'year':
+            return date(partition_start.year + 1, 1, 1)
+        return date(partition_start.year + partition_start.month // 12, partition_start.month % 12 + 1, 1)
+
+    def get_partition_starts(self, first_date:date, last_date:date) -> list[date]:
+        """The start of each partition needed to store rows from first_date to last_date, both included."""
+        partition_starts = []
+        partition_start = self.get_partition_start(first_date)
+        while partition_start <= last_date:
+            partition_starts.append(partition_start)
+            partition_start = self.get_next_partition_start(partition_start)
+        return partition_starts
+
+    def get_partition_name(self, table_name:str, partition_start:date) -> str:
+        return f"{table_name}_{partition_start.strftime('%Y_%m' if self.interval == 'month' else '%Y')}"
+
+
+@dataclass(frozen=True)
+class TableSpec():
+    """
+    columns: The sql definition of each column by name, for example dict(date='DATE NOT NULL', store_id='SMALLINT NOT NULL REFERENCES stores(id)')
+    primary_key: On partitioned tables postgres requires it to include the partitioning column.
+    """
+    name:str
+    columns:dict[str,str]
+    primary_key:tuple[str, ...]
+    comment:str|None = None
+    indexes:tuple[IndexSpec, ...] = ()
+    partitioning:DateRangePartitioningSpec|None = None
+
+    def __post_init__(self):
+        if self.partitioning is not None and self.partitioning.column not in self.primary_key:
+            raise ValueError(f'The primary key of {self.name} must include its partitioning column {self.partitioning.column}')
+
+    def get_create_table_script(self, partitioned:bool=True) -> str:
+        """partitioned: If False the partitioning is left out, for databases without declarative partitioning, like duckdb."""
+        column_definitions = [f'{column_name} {column_definition}' for column_name, column_definition in self.columns.items()]
+        column_definitions.append(f"PRIMARY KEY ({', '.join(self.primary_key)})")
+        create_table_script = f'CREATE TABLE IF NOT EXISTS {self.name}\n(\n    ' + ',\n    '.join(column_definitions) + '\n)'
+        if partitioned and self.partitioning is not None:
+            create_table_script = f'{create_table_script} PARTITION BY RANGE ({self.partitioning.column})'
+        return create_table_script
+
+    def get_creation_scripts(self, partitioned:bool=True, with_index_methods:bool=True) -> list[str]:
+        """
+        The table, its comment and its indexes. The partitions are created separately, for the dates of the rows stored.
+        partitioned and with_index_methods: False for databases without declarative partitioning or index methods, like duckdb.
+        """
+        creation_scripts = [self.get_create_table_script(partitioned)]
+        if self.comment is not None:
+            creation_scripts.append(f"COMMENT ON TABLE {self.name} IS '{self.comment}'")
+        creation_scripts.extend(index.get_create_script(self.name, with_index_methods) for index in self.indexes)
+        return creation_scripts
+
+    def get_create_partitions_scripts(self, first_date:date, last_date:date) -> list[str]:
+        """The scripts to create the partitions for the rows from first_date to last_date, that don't exist yet."""
+        if self.partitioning is None:
+            return []
+        create_partitions_scripts = []
+        for partition_start in self.partitioning.get_partition_starts(first_date, last_date):
+            create_partitions_scripts.append(
+                f'CREATE TABLE IF NOT EXISTS {self.partitioning.get_partition_name(self.name, partition_start)} PARTITION OF {self.name} '
+                f"FOR VALUES FROM ('{partition_start.isoformat()}') TO ('{self.partitioning.get_next_partition_start(partition_start).isoformat()}')"
+            )
+        return create_partitions_scripts
@@ -0,0 +1,82 @@
+"""
+Cross validation for the scikitlearn path that respects time.
+KFold mixes future and past rows in the train data, and cross_validate copies the fancy indexed fold subsets into every worker.
+DateOrderedTimeSeriesSplit computes its folds by date, and yields them as slices, so each fold is a view of the data instead of a copy.
+"""
+from typing import Iterator
+import numpy as np
+import pandas as pd
+from joblib import parallel_config
+from sklearn.model_selection import cross_validate
+
+class DateOrderedTimeSeriesSplit:
+    """
+    A time series cross validator, that splits the rows by date, for data sorted by date.
+    Each fold tests on the following test_size_in_days days after the previous fold, and trains on all the rows of the dates before them,
+    leaving out gap_in_days days between train and test (the embargo), so lag features of the test rows can't see the train targets.
+    Since the rows are sorted by date both the train and test rows are contiguous, so they are yielded as slices,
+    which scikitlearn turns into views of the underlying arrays instead of copies.
+
+    Example usage:
+    cv = DateOrderedTimeSeriesSplit(n_splits=5, test_size_in_days=16, gap_in_days=3)
+    cross_validate(pipeline, all_features, all_features['sales'], cv=cv, n_jobs=5)
+    """
+    def __init__(self, n_splits:int=5, test_size_in_days:int|None=None, gap_in_days:int=0, date_column:str='date', dates=None):
+        """
+        test_size_in_days: The number of days in each test fold. If None the dates are divided into n_splits + 1 equal parts, like TimeSeriesSplit.
+        dates: The date of each row. If None it's taken from the date_column of X.
+        """
+        self.n_splits = n_splits
+        self.test_size_in_days = test_size_in_days
+        self.gap_in_days = gap_in_days
+        self.date_column = date_column
+        self.dates = dates
+
+    def get_n_splits(self, X=None, y=None, groups=None) -> int:
+        return self.n_splits
+
+    def _get_dates(self, X) -> np.ndarray:
+        dates = self.dates if self.dates is not None else X[self.date_column]
+        #Only the distinct dates are parsed, since there are much less of them than rows.
+        position_of_distinct_date_per_row, distinct_dates = pd.factorize(np.asarray(dates))
+        distinct_dates = pd.to_datetime(distinct_dates).to_numpy()
+        return distinct_dates[position_of_distinct_date_per_row]
+
+    def get_fold_boundaries(self, X) -> list[tuple[int, int, int]]:
+        """Get the (train_end, test_start, test_end) row positions of each fold. Train rows always start at row 0."""
+        dates = self._get_dates(X)
+        if len(dates) > 1 and (dates[1:] < dates[:-1]).any():
+            raise ValueError('DateOrderedTimeSeriesSplit requires the rows to be sorted by date, but they are not. Sort them with sort_values(date_column, kind="stable") first.')
+
+        distinct_dates = np.unique(dates)
+        test_size_in_days = self.test_size_in_days if self.test_size_in_days is not None else len(distinct_dates) // (self.n_splits + 1)
+        if test_size_in_days < 1:
+            raise ValueError(f'Each test fold needs at least 1 day, but got {test_size_in_days}, from test_size_in_days={self.test_size_in_days} and {len(distinct_dates)} dates for {self.n_splits} folds.')
+        first_test_date_position = len(distinct_dates) - self.n_splits * test_size_in_days
+        if first_test_date_position - self.gap_in_days <= 0:
+            raise ValueError(f'There are only {len(distinct_dates)} dates, which is not enough for {self.n_splits} folds of {test_size_in_days} days with a gap of {self.gap_in_days} days.')
+
+        fold_boundaries = []
+        for split_number in range(self.n_splits):
+            test_start_date_position = first_test_date_position + split_number * test_size_in_days
+            train_end_date_position = test_start_date_position - self.gap_in_days
+            test_end_date_position = test_start_date_position + test_size_in_days
+            #searchsorted finds the first row of each date, since the rows are sorted by date.
+            train_end, test_start = np.searchsorted(dates, distinct_dates[[train_end_date_position, test_start_date_position]], side='left')
+            test_end = np.searchsorted(dates, distinct_dates[test_end_date_position], side='left') if test_end_date_position < len(distinct_dates) else len(dates)
+            fold_boundaries.append((int(train_end), int(test_start), int(test_end)))
+        return fold_boundaries
+
+    def split(self, X, y=None, groups=None) -> Iterator[tuple[slice, slice]]:
+        for train_end, test_start, test_end in self.get_fold_boundaries(X):
+            yield slice(0, train_end), slice(test_start, test_end)
+
+
+def cross_validate_with_memmapping(estimator, X, y, cv:DateOrderedTimeSeriesSplit, n_jobs:int, max_nbytes:str|int|None='1M', **cross_validate_kwargs):
+    """
+    Call cross_validate making joblib share the arrays of X and y with the workers by memory mapping them, instead of pickling a copy for each fold.
+    Arrays bigger than max_nbytes are dumped once to a memmapped file, and since the folds are slices they stay views of that memmap in the workers.
+    mmap_mode='c' (copy on write) is used since some of the pipeline steps modify their input in place, only the modified pages are copied.
+    """
+    with parallel_config(backend='loky', max_nbytes=max_nbytes, mmap_mode='c'):
+        return cross_validate(estimator, X, y, cv=cv, n_jobs=n_jobs, **cross_validate_kwargs)
@@ -52,7 +52,7 @@ def make_kfold_train_test_splits(sequentially_split_dataset:list[DataFrame], dat
         dataset_splits_to_assign = sequentially_split_dataset.copy()
         test_split = dataset_splits_to_assign.pop(split_number)
         train_splits = dataset_splits_to_assign
-        train_split = concat_spark_dfs(train_splits)
+        train_split = concat_spark_dfs(*train_splits)
         k_fold_train_test_split = TrainTestSplit(dataset_name, 'kfold',split_number, train_split, test_split)
         k_fold_train_test_splits.append(k_fold_train_test_split)
     
@@ -73,7 +73,11 @@ class TrainTestSplitDataset():
     """A storable train test split """
     
     def __init__(self, train_test_split:TrainTestSplit, train_storer:SparkTableStorageHandler, test_storer:SparkTableStorageHandler):
-        
+        self.train_test_split = train_test_split
+        self.train_storer = train_storer
+        self.test_storer = test_storer
     
     def store(self):
-        train_storer.
+        """Store the train and test data, each in the table named by its identifier."""
+        self.train_storer.store_table(self.train_test_split.train_data, self.train_test_split.get_train_identifier())
+        self.test_storer.store_table(self.train_test_split.test_data, self.train_test_split.get_test_identifier())
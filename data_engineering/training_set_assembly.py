@@ -0,0 +1,131 @@
+"""
+Assembles the wide training set in the database, with one query that joins the sales to the stores, oil prices, transactions, events
+and the engineered feature tables, using the indexes and hash joins of the database instead of re-reading the csvs and merging them in pandas.
+The result is streamed with COPY (query) TO STDOUT into arrow, and written as parquet partitioned by year, or returned as an arrow table.
+Its columns are named like the ones of data_preparation_attempt4.merge_data_sources after rename_raw_dfs_cols, with the oil prices already
+as of joined, so the frame can go to the steps of the pipeline after them, once read with read_training_set_parquet or get_as_pandas,
+which index it by the sales id and drop the year it's partitioned by, so neither reaches the model as a feature.
+
+Example usage:
+assembler = TrainingSetAssembler(db_interface, [FeatureTableJoin('store_features', ['city_numeric'], {'id': 'store_id'})])
+assembler.export_to_parquet('./training_set')
+training_set = read_training_set_parquet('./training_set')
+"""
+from dataclasses import dataclass
+import pandas as pd
+import dataset_properties
+from special_days import make_special_days_by_date_store_query, special_day_count_columns
+
+#Only used to partition the parquet files, the date related features come from the date.
+partition_column = 'year'
+
+def _get_table_name(dataset_name:str) -> str:
+    return dataset_properties.get_sql_table_name_of_dataset_of_name(dataset_name)
+
+def to_training_frame(training_set:pd.DataFrame) -> pd.DataFrame:
+    """Index the rows of an assembled training set by the sales id, in the order of the ids, and drop the partition column."""
+    return training_set.drop(columns=partition_column).set_index('id').sort_index()
+
+def read_training_set_parquet(input_path:str) -> pd.DataFrame:
+    """Read a training set written by TrainingSetAssembler.export_to_parquet, as a frame the pipeline can be fit on."""
+    training_set = pd.read_parquet(input_path)
+    #The hive partition column is read back as a category.
+    return to_training_frame(training_set)
+
+@dataclass(frozen=True)
+class FeatureTableJoin():
+    """
+    An engineered feature table to add to the training set.
+    join_columns: The column of the feature table that matches each column of the sales table, for example {'id': 'store_id'} for the store features.
+    """
+    table_name:str
+    feature_columns:list[str]
+    join_columns:dict[str,str]
+
+    @classmethod
+    def of_feature_group(cls, feature_group, join_columns:dict[str,str]) -> 'FeatureTableJoin':
+        """The features of a narrow table or snapshot swap feature group, from the table they are stored in."""
+        return cls(feature_group.name_of_table_to_store_features_in, list(feature_group.name_of_features_to_store), join_columns)
+
+
+class TrainingSetAssembler():
+    def __init__(self, db_interface, feature_table_joins:list[FeatureTableJoin]|None=None, special_days_view_name:str='special_days_by_date_store'):
+        """special_days_view_name: The view with a row per event and store it is relevant to, made by create_tables."""
+        self.db_interface = db_interface
+        self.feature_table_joins = feature_table_joins or []
+        self.special_days_view_name = special_days_view_name
+
+    def make_query(self, first_date:str|None=None, last_date:str|None=None) -> str:
+        """
+        The query of the training set, of the sales from first_date to last_date if given, which on the partitioned sales table only reads their partitions.
+        Each date gets the latest known oil price at or before it, or the first known one for dates before it, looked up once per distinct date with the oil date index.
+        The special days are aggregated to one per date and store, so every sales row appears exactly once.
+        """
+        sales, stores, oil, transactions = (
+            _get_table_name(dataset_name)
+            for dataset_name in ['sales_agg_by_date_store_productfamily', 'stores', 'oil_price_by_date', 'transactions_agg_by_date_store']
+        )
+        date_conditions = [*([f"sales.date >= DATE '{first_date}'"] if first_date else []), *([f"sales.date <= DATE '{last_date}'"] if last_date else [])]
+        where_statement = f"WHERE {' AND '.join(date_conditions)}" if date_conditions else ''
+
+        special_day_counts_selection = ''.join(f',\n    COALESCE(special_days.{column}, 0) AS {column}' for column in special_day_count_columns)
+        feature_columns_selection = ''.join(
+            f',\n    feature_table_{position}.{feature_column}'
+            for position, feature_table_join in enumerate(self.feature_table_joins)
+            for feature_column in feature_table_join.feature_columns
+        )
+        feature_tables_joins = ''.join(
+            f'\nLEFT JOIN {feature_table_join.table_name} AS feature_table_{position} ON '
+            + ' AND '.join(f'feature_table_{position}.{feature_column} = sales.{sales_column}' for feature_column, sales_column in feature_table_join.join_columns.items())
+            for position, feature_table_join in enumerate(self.feature_table_joins)
+        )
+
+        return f"""WITH oil_price_by_sales_date AS (
+    SELECT
+        sales_dates.date,
+        COALESCE(
+            (SELECT oil.oil_price FROM {oil} AS oil WHERE oil.date <= sales_dates.date AND oil.oil_price IS NOT NULL ORDER BY oil.date DESC LIMIT 1),
+            (SELECT oil.oil_price FROM {oil} AS oil WHERE oil.date > sales_dates.date AND oil.oil_price IS NOT NULL ORDER BY oil.date LIMIT 1)
+        ) AS oil_price
+    FROM (SELECT DISTINCT sales.date FROM {sales} AS sales {where_statement}) AS sales_dates
+),
+special_days AS (
+{make_special_days_by_date_store_query(self.special_days_view_name)}
+)
+SELECT
+    sales.id,
+    sales.date,
+    sales.store_id AS store_nbr,
+    sales.product_family,
+    sales.products_of_family_on_promotion_count AS products_of_family_on_promotion,
+    sales.sales_total AS sales,
+    stores.city AS store_city,
+    stores.state AS store_state,
+    stores.type AS store_type,
+    stores.cluster AS store_cluster,
+    oil_price_by_sales_date.oil_price,
+    transactions.transactions_count AS all_products_transactions,
+    special_days.type AS day_type,
+    special_days.locale AS special_day_locale_type,
+    special_days.locale_name AS special_day_locale,
+    special_days.description AS special_day_reason,
+    special_days.was_transferred AS special_day_transferred{special_day_counts_selection}{feature_columns_selection},
+    CAST(EXTRACT(YEAR FROM sales.date) AS INTEGER) AS {partition_column}
+FROM {sales} AS sales
+LEFT JOIN {stores} AS stores ON stores.id = sales.store_id
+LEFT JOIN oil_price_by_sales_date ON oil_price_by_sales_date.date = sales.date
+LEFT JOIN {transactions} AS transactions ON transactions.date = sales.date AND transactions.store_id = sales.store_id
+LEFT JOIN special_days ON special_days.date = sales.date AND special_days.store_id = sales.store_id{feature_tables_joins}
+{where_statement}"""
+
+    def export_to_parquet(self, output_path:str, first_date:str|None=None, last_date:str|None=None) -> int:
+        """Write the training set as parquet files partitioned by year, replacing the years already in output_path. Returns the number of rows."""
+        return self.db_interface.export_query_to_parquet(self.make_query(first_date, last_date), output_path, partition_by=[partition_column])
+
+    def get_as_arrow(self, first_date:str|None=None, last_date:str|None=None):
+        """The training set as an arrow table, with the id and partition columns, that to_pandas() turns into a dataframe without going row by row."""
+        return self.db_interface.query_as_arrow(self.make_query(first_date, last_date))
+
+    def get_as_pandas(self, first_date:str|None=None, last_date:str|None=None) -> pd.DataFrame:
+        """The training set as a frame the pipeline can be fit on, like read_training_set_parquet."""
+        return to_training_frame(self.get_as_arrow(first_date, last_date).to_pandas())
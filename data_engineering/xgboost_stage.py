@@ -0,0 +1,107 @@
+"""
+A model stage for create_pipeline, that trains xgboost with the hist tree method on a QuantileDMatrix built once per dataset version.
+XGBRegressor receives a dense pandas dataframe, and rebuilds its internal matrix on every fit, which runs out of memory once the lagged one hot encoded features stop fitting in ram.
+This stage reuses the QuantileDMatrix across fits, and can also train with xgboost external memory mode, from chunked feature files, for datasets bigger than ram.
+"""
+import os
+from collections import OrderedDict
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.base import BaseEstimator, RegressorMixin
+from pipeline_caching import fingerprint_data
+
+class ChunkedFeatureFiles(NamedTuple):
+    """
+    Feature files (parquet or feather) that together make up a dataset, each containing the features and the target column.
+    cache_directory is where xgboost stores its external memory cache pages.
+    """
+    paths: list[str]
+    target_column: str
+    cache_directory: str = './.xgboost_cache'
+
+def _read_feature_chunk(path:str) -> pd.DataFrame:
+    return pd.read_feather(path) if path.endswith('.feather') else pd.read_parquet(path)
+
+class ChunkedFeatureFilesIter(xgb.DataIter):
+    """An xgboost data iterator, that feeds xgboost the feature files one at a time, so only one of them needs to be in memory."""
+    def __init__(self, chunked_feature_files:ChunkedFeatureFiles):
+        self.chunked_feature_files = chunked_feature_files
+        self._position = 0
+        os.makedirs(chunked_feature_files.cache_directory, exist_ok=True)
+        super().__init__(cache_prefix=os.path.join(chunked_feature_files.cache_directory, 'cache'))
+
+    def next(self, input_data) -> int:
+        if self._position == len(self.chunked_feature_files.paths):
+            return 0 #Let xgboost know there are no more chunks
+        chunk = _read_feature_chunk(self.chunked_feature_files.paths[self._position])
+        target_column = self.chunked_feature_files.target_column
+        input_data(data=chunk.drop(columns=target_column), label=chunk[target_column])
+        self._position += 1
+        return 1
+
+    def reset(self):
+        self._position = 0
+
+
+#The QuantileDMatrix of the last datasets, by dataset version and max_bin, so fits on the same data (for example optuna trials) don't rebuild it.
+#Its module level since scikitlearn clones the estimator on each fit, which would lose it if it was an attribute.
+_quantile_dmatrix_by_dataset_version:OrderedDict[tuple[str, int], xgb.QuantileDMatrix] = OrderedDict()
+
+class QuantileDMatrixXGBRegressor(BaseEstimator, RegressorMixin):
+    """
+    An xgboost regressor that can be used as the model of create_pipeline, instead of XGBRegressor.
+    num_boost_round: The number of trees (n_estimators on XGBRegressor)
+    booster_params: Any other xgboost training parameters, like max_depth or eta.
+    nthread: The number of threads xgboost uses. If None all the cores are used.
+    dataset_version: An identifier of the training data. If None a fingerprint of the data is used, which requires hashing it.
+    max_cached_matrices: How many QuantileDMatrix to keep in memory, for different dataset versions.
+
+    Example usage:
+    pipeline = create_pipeline(window_size, model=QuantileDMatrixXGBRegressor(500, {'max_depth': 8}, nthread=8))
+    Or to train on data bigger than ram:
+    model = QuantileDMatrixXGBRegressor(500).fit(ChunkedFeatureFiles(feature_file_paths, 'sales'))
+    """
+    def __init__(self, num_boost_round:int=100, booster_params:dict|None=None, nthread:int|None=None, max_bin:int=256, dataset_version:str|None=None, max_cached_matrices:int=2):
+        self.num_boost_round = num_boost_round
+        self.booster_params = booster_params
+        self.nthread = nthread
+        self.max_bin = max_bin
+        self.dataset_version = dataset_version
+        self.max_cached_matrices = max_cached_matrices
+
+    def _get_nthread(self) -> int:
+        return self.nthread or os.cpu_count() or 1
+
+    def _get_quantile_dmatrix(self, X, y) -> xgb.QuantileDMatrix:
+        dataset_version = self.dataset_version or fingerprint_data((fingerprint_data(X), fingerprint_data(y)))
+        cache_key = (dataset_version, self.max_bin)
+        if cache_key in _quantile_dmatrix_by_dataset_version:
+            _quantile_dmatrix_by_dataset_version.move_to_end(cache_key) #Mark it as recently used
+        else:
+            _quantile_dmatrix_by_dataset_version[cache_key] = xgb.QuantileDMatrix(X, y, max_bin=self.max_bin, nthread=self._get_nthread())
+            while len(_quantile_dmatrix_by_dataset_version) > self.max_cached_matrices:
+                _quantile_dmatrix_by_dataset_version.popitem(last=False)
+        return _quantile_dmatrix_by_dataset_version[cache_key]
+
+    def fit(self, X, y=None):
+        if isinstance(X, ChunkedFeatureFiles):
+            #External memory mode, xgboost reads the chunks through the iterator and caches them on disk.
+            train_matrix = xgb.DMatrix(ChunkedFeatureFilesIter(X), nthread=self._get_nthread())
+        else:
+            train_matrix = self._get_quantile_dmatrix(X, y)
+
+        training_params = {**(self.booster_params or {}), 'tree_method': 'hist', 'max_bin': self.max_bin, 'nthread': self._get_nthread()}
+        self.booster_ = xgb.train(training_params, train_matrix, num_boost_round=self.num_boost_round)
+        self.n_features_in_ = train_matrix.num_col()
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        """Predict using inplace_predict, which doesn't need to build a DMatrix for the data."""
+        if isinstance(X, ChunkedFeatureFiles):
+            return np.concatenate([
+                self.booster_.inplace_predict(_read_feature_chunk(path).drop(columns=X.target_column))
+                for path in X.paths
+            ])
+        return self.booster_.inplace_predict(X)
@@ -0,0 +1,19 @@
+"""Checks of the as of join of sparse daily dimensions, like the oil prices, into the pandas features."""
+import numpy as np
+import pandas as pd
+from data_preparation_utils import asof_join
+
+def test_asof_join_takes_the_latest_known_values():
+    oil_df = pd.DataFrame({'date': ['2017-01-02', '2017-01-03', '2017-01-05', '2017-01-06'], 'oil_price': [50.0, np.nan, 52.0, 53.0]})
+    #Unsorted, with a date before the first price, and dates without a price, a missing one, and on a weekend.
+    df = pd.DataFrame({'date': ['2017-01-05', '2017-01-01', '2017-01-04', '2017-01-08', '2017-01-02', '2017-01-04'], 'sales': range(6)})
+
+    result = asof_join(df, oil_df, on='date')
+    assert result['sales'].tolist() == list(range(6))
+    assert result['oil_price'].tolist() == [52.0, 50.0, 50.0, 53.0, 50.0, 50.0]
+
+def test_asof_join_matches_the_by_columns_exactly():
+    transactions_df = pd.DataFrame({'date': ['2017-01-01', '2017-01-01', '2017-01-03'], 'store_nbr': [1, 2, 2], 'transactions': [10, 20, 30]})
+    df = pd.DataFrame({'date': ['2017-01-02', '2017-01-02', '2017-01-04'], 'store_nbr': [1, 2, 2]})
+    result = asof_join(df, transactions_df, on='date', by=['store_nbr'])
+    assert result['transactions'].tolist() == [10, 20, 30]
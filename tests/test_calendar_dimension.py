@@ -0,0 +1,38 @@
+"""Checks that the calendar features joined from the calendar dimension are the ones computed row by row before it."""
+import numpy as np
+import pandas as pd
+import pytest
+from pandas.tseries.offsets import MonthEnd
+
+pytest.importorskip('pyspark') #data_preparation_attempt4 imports the spark modules.
+import data_preparation_attempt4 as data_prep
+
+def replace_date_with_date_related_columns_before_calendar(features_df):
+    """The calendar features as they were computed row by row, before the calendar dimension."""
+    features_df['date'] = pd.to_datetime(features_df['date'], format='%Y-%m-%d')
+    features_df['days_since_start'] = ((features_df['date'] - features_df['date'].min()) // pd.Timedelta('1D')).astype('int32')
+    features_df['day_of_year'] = features_df['date'].dt.dayofyear
+    features_df['day_of_month'] = features_df['date'].dt.day
+    features_df['day_of_week'] = features_df['date'].dt.dayofweek
+    features_df['is_15th'] = (features_df['date'].dt.day == 15).astype(int)
+    features_df['is_last_day_of_month'] = (features_df['date'] == features_df['date'] + MonthEnd(1)).astype(int)
+    return features_df.drop(columns=['date'])
+
+def test_calendar_features_match_the_row_by_row_ones():
+    #Unsorted, repeated, and across a leap year, month and year ends.
+    dates = pd.date_range('2015-12-25', '2016-03-05', freq='D').strftime('%Y-%m-%d')
+    features_df = pd.DataFrame({'date': np.random.default_rng(0).choice(dates, 500), 'sales': 1.0}, index=pd.RangeIndex(1000, 1500, name='id'))
+
+    expected = replace_date_with_date_related_columns_before_calendar(features_df.copy())
+    result = data_prep.replace_date_with_date_related_columns(features_df.copy())
+    pd.testing.assert_frame_equal(result, expected[result.columns], check_dtype=False)
+
+def test_calendar_features_count_days_since_the_given_start_date():
+    features_df = pd.DataFrame({'date': ['2017-01-03', '2017-01-01']})
+    result = data_prep.replace_date_with_date_related_columns(features_df, start_date='2016-12-31')
+    assert result['days_since_start'].tolist() == [3, 1]
+
+def test_calendar_features_reject_missing_dates():
+    features_df = pd.DataFrame({'date': ['2017-01-03', None, '2017-01-01']})
+    with pytest.raises(ValueError):
+        data_prep.replace_date_with_date_related_columns(features_df)
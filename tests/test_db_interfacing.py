@@ -0,0 +1,67 @@
+"""Checks of the arrow reads of DBInterface, on a connection that replays the COPY blocks of a query, since there is no database in the tests."""
+from types import SimpleNamespace
+import pytest
+from db_interfacing import DBInterface
+
+pytest.importorskip('pyarrow')
+
+class ReplayedConnection:
+    """Answers the LIMIT 0 query and the COPY of _open_query_as_arrow_batches, recording which cursors and copies were closed."""
+    def __init__(self, copy_blocks:list[bytes]):
+        self.copy_blocks = copy_blocks
+        self.open_contexts:list[str] = []
+        self.adapters = SimpleNamespace(types={23: SimpleNamespace(name='int4'), 25: SimpleNamespace(name='text')})
+
+    def cursor(self):
+        return ReplayedCursor(self)
+
+class ReplayedContext:
+    def __init__(self, connection:ReplayedConnection, name:str):
+        self.connection = connection
+        self.name = name
+
+    def __enter__(self):
+        self.connection.open_contexts.append(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.connection.open_contexts.remove(self.name)
+
+class ReplayedCursor(ReplayedContext):
+    description = [SimpleNamespace(name='store_nbr', type_code=23), SimpleNamespace(name='city', type_code=25)]
+
+    def __init__(self, connection:ReplayedConnection):
+        super().__init__(connection, 'cursor')
+
+    def execute(self, query, parameters=None):
+        pass
+
+    def copy(self, query, parameters=None):
+        return ReplayedCopy(self.connection)
+
+class ReplayedCopy(ReplayedContext):
+    def __init__(self, connection:ReplayedConnection):
+        super().__init__(connection, 'copy')
+
+    def __iter__(self):
+        return iter(self.connection.copy_blocks)
+
+def test_query_as_arrow_batches_closes_the_copy_and_its_cursor():
+    connection = ReplayedConnection([b'1,Quito\n2,', b'Guayaquil\n3,\n'])
+    with DBInterface('localhost', 5432, '', '', '', '', 'store_sales')._open_query_as_arrow_batches(connection, 'SELECT store_nbr, city FROM stores') as batches:
+        assert connection.open_contexts == ['cursor', 'copy']
+        table = batches.read_all()
+    assert table.to_pydict() == {'store_nbr': [1, 2, 3], 'city': ['Quito', 'Guayaquil', None]}
+    assert connection.open_contexts == []
+
+def test_query_as_arrow_batches_closes_the_copy_when_not_read():
+    connection = ReplayedConnection([b'1,Quito\n'])
+    with pytest.raises(RuntimeError):
+        with DBInterface('localhost', 5432, '', '', '', '', 'store_sales')._open_query_as_arrow_batches(connection, 'SELECT store_nbr, city FROM stores'):
+            raise RuntimeError('Failed before reading the batches')
+    assert connection.open_contexts == []
+
+def test_query_as_arrow_batches_tells_apart_null_and_empty_texts():
+    connection = ReplayedConnection([b'1,""\n2,\n'])
+    with DBInterface('localhost', 5432, '', '', '', '', 'store_sales')._open_query_as_arrow_batches(connection, 'SELECT store_nbr, city FROM stores') as batches:
+        assert batches.read_all()['city'].to_pylist() == ['', None]
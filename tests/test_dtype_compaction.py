@@ -0,0 +1,29 @@
+"""Checks that DtypeCompactor gives the frames it transforms the dtypes it decided on fit."""
+import numpy as np
+import pandas as pd
+import pytest
+from dtype_compaction import DtypeCompactor
+
+def test_dtype_compactor_gives_train_and_test_the_same_dtypes():
+    train_df = pd.DataFrame({
+        'store_nbr': np.arange(1, 201) % 54,
+        'onpromotion': np.arange(200) * 3, #Needs an int16, more than the test values.
+        'product_family': ['BEVERAGES', 'DAIRY'] * 100,
+        'oil_price': np.linspace(40, 60, 200),
+        'store_name': [f'store {i}' for i in range(200)],
+    })
+    test_df = pd.DataFrame({'store_nbr': [1, 2], 'onpromotion': [0, 5], 'product_family': ['DAIRY', 'DAIRY'], 'oil_price': [45.5, 50.25], 'store_name': ['store 1', 'store 1']})
+
+    dtype_compactor = DtypeCompactor().fit(train_df)
+    compact_train_df, compact_test_df = dtype_compactor.transform(train_df), dtype_compactor.transform(test_df)
+    assert compact_train_df.dtypes.astype(str).tolist() == compact_test_df.dtypes.astype(str).tolist() == ['int8', 'int16', 'category', 'float32', 'object']
+    with pytest.raises(ValueError):
+        dtype_compactor.transform(test_df.assign(onpromotion=[0, 100_000]))
+
+def test_dtype_compactor_keeps_float64_out_of_the_float32_range():
+    features_df = pd.DataFrame({'in_range': [0.5, 1 / 3], 'out_of_range': [0.5, 1e300]})
+    assert DtypeCompactor().fit_transform(features_df).dtypes.astype(str).tolist() == ['float32', 'float64']
+
+def test_dtype_compactor_partial_fit_widens_the_ints_to_fit_every_chunk():
+    dtype_compactor = DtypeCompactor().partial_fit(pd.DataFrame({'onpromotion': [0, 10]})).partial_fit(pd.DataFrame({'onpromotion': [0, 1000]}))
+    assert dtype_compactor.transform(pd.DataFrame({'onpromotion': [1, 2]}))['onpromotion'].dtype == np.int16
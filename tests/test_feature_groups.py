@@ -0,0 +1,20 @@
+"""Checks of how the feature groups are stored, that don't need a database or spark session."""
+import pytest
+
+pytest.importorskip('pyspark')
+from data_engineering_management import FeatureGroup
+
+def test_feature_group_must_store_narrow_tables_apart_from_its_source():
+    feature_group_arguments = dict(
+        pipeline=None,
+        name_of_features_to_store=['oil_price_scaled'],
+        engineered_columns_definition=['oil_price_scaled REAL'],
+        identity_columns=['date'],
+        source_dataset_table_name='oil_price_by_date',
+        db_interface=None,
+        spark_interface=None,
+    )
+    with pytest.raises(ValueError):
+        FeatureGroup(name_of_table_to_store_features_in='oil_price_by_date', storage_mode='narrow_table', **feature_group_arguments)
+    feature_group = FeatureGroup(name_of_table_to_store_features_in='oil_price_features', storage_mode='narrow_table', **feature_group_arguments)
+    assert feature_group.name_of_view_with_features == 'oil_price_by_date_with_oil_price_features'
@@ -0,0 +1,43 @@
+"""Import every module meant to be imported, so a module that stops parsing or importing fails here, instead of when a script first uses it."""
+import importlib
+import pytest
+
+pytest.importorskip('pyspark')
+
+#The scripts, like create_tables or update_base_data, connect to the database or start spark when imported, so they aren't imported here.
+library_modules = [
+    'async_db_interfacing',
+    'base_data_management',
+    'batch_forecasting',
+    'calendar_dimension',
+    'chunked_preprocessing',
+    'data_engineering_management',
+    'data_preparation_attempt4',
+    'dtype_compaction',
+    'duckdb_interfacing',
+    'instrumentation',
+    'memory_utils',
+    'parallel_series',
+    'parallel_tuning',
+    'pipeline_caching',
+    'recursive_forecasting',
+    'snapshot_publishing',
+    'spark_persistence',
+    'spark_profiles',
+    'spark_utils',
+    'special_days',
+    'table_specs',
+    'time_series_cv',
+    'train_test_splitting_utils',
+    'training_set_assembly',
+]
+
+@pytest.mark.parametrize('module_name', library_modules)
+def test_module_imports(module_name):
+    importlib.import_module(module_name)
+
+def test_data_engineering_manager_is_made_without_connecting():
+    data_engineering_management = importlib.import_module('data_engineering_management')
+    #The interfaces are only used when a feature group is made or stored.
+    data_engineering_manager = data_engineering_management.DataEngineeringManager(db_interface=object(), spark_interface=object())
+    assert data_engineering_manager.db_interface is not None
@@ -0,0 +1,12 @@
+from instrumentation import Span, estimate_rows_bytes, iterate_adding_rows_bytes
+
+def test_streamed_rows_add_their_estimated_bytes_to_the_span():
+    rows = [(row_number, f'store_{row_number % 54}', 1.5) for row_number in range(2500)]
+    span = Span('stream')
+    assert list(iterate_adding_rows_bytes(iter(rows), span, sample_size=100)) == rows
+    assert span.bytes_transferred == int(estimate_rows_bytes(rows[:100]) / 100 * len(rows))
+
+def test_no_bytes_are_added_without_rows():
+    span = Span('stream')
+    assert list(iterate_adding_rows_bytes(iter([]), span)) == []
+    assert span.bytes_transferred is None
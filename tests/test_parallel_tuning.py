@@ -0,0 +1,16 @@
+"""Checks of the inputs of the parallel hyperparameter search, that are validated before building the feature matrix."""
+import pandas as pd
+import pytest
+
+pytest.importorskip('xgboost')
+pytest.importorskip('pyspark') #data_preparation_attempt4 imports the spark modules.
+from parallel_tuning import run_parallel_hyperparameter_search, run_parallel_optuna_study
+
+def test_search_requires_model_param_sets(tmp_path):
+    with pytest.raises(ValueError):
+        run_parallel_hyperparameter_search(pd.DataFrame(), pd.Series(dtype=float), [], work_dir=str(tmp_path))
+    assert not list(tmp_path.iterdir())
+
+def test_optuna_study_requires_trials(tmp_path):
+    with pytest.raises(ValueError):
+        run_parallel_optuna_study(None, lambda trial: {}, 0, pd.DataFrame(), pd.Series(dtype=float), work_dir=str(tmp_path))
@@ -0,0 +1,49 @@
+"""Checks of the hits and misses of PipelineStepCache, including edits to the code of a step."""
+import importlib
+import pandas as pd
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline, FunctionTransformer
+from pipeline_caching import PipelineStepCache
+
+def write_step_module(module_path, added_value:int):
+    module_path.write_text(f'def add_value(features_df):\n    return features_df + {added_value}\n')
+
+def test_pipeline_step_cache_hits_unchanged_steps_and_misses_edited_ones(tmp_path, monkeypatch):
+    #The step is a function of a module of its own, so its code can be edited like a real step would.
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr('sys.dont_write_bytecode', True)
+    write_step_module(tmp_path / 'cached_step.py', 1)
+    import cached_step
+
+    cache = PipelineStepCache(str(tmp_path / 'cache'))
+    features_df = pd.DataFrame({'a': [1.0, 2.0, 3.0]})
+    target = pd.Series([1.0, 2.0, 3.0])
+    def fit_and_transform():
+        pipeline = Pipeline([('add_value', FunctionTransformer(cached_step.add_value)), ('model', LinearRegression())], memory=cache)
+        pipeline.fit(features_df, target)
+        return pipeline[:-1].transform(features_df)['a'].tolist()
+
+    assert fit_and_transform() == [2.0, 3.0, 4.0]
+    assert cache.stats()['hits'] == 0 and cache.stats()['misses'] == 1
+    assert fit_and_transform() == [2.0, 3.0, 4.0]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+    write_step_module(tmp_path / 'cached_step.py', 10)
+    importlib.reload(cached_step)
+    assert fit_and_transform() == [11.0, 12.0, 13.0]
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 2
+
+def test_pipeline_step_cache_keys_on_the_data_and_parameters(tmp_path):
+    cache = PipelineStepCache(str(tmp_path))
+    def fit(features_df, kw_args):
+        pipeline = Pipeline([('scale', FunctionTransformer(pd.DataFrame.mul, kw_args=kw_args)), ('model', LinearRegression())], memory=cache)
+        pipeline.fit(features_df, pd.Series([1.0, 2.0]))
+
+    fit(pd.DataFrame({'a': [1.0, 2.0]}), {'other': 2})
+    fit(pd.DataFrame({'a': [1.0, 2.0]}), {'other': 2})
+    fit(pd.DataFrame({'a': [1.0, 5.0]}), {'other': 2})
+    fit(pd.DataFrame({'a': [1.0, 2.0]}), {'other': 3})
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+    cache.clear()
+    assert cache.stats()['misses'] == 0 and not list(tmp_path.iterdir())
@@ -0,0 +1,25 @@
+"""Checks that merging the special days of each store keeps one row per sales row."""
+import pandas as pd
+from special_days import aggregate_special_days_by_date_store, merge_special_days_by_date_store
+
+def test_special_days_merge_keeps_one_row_per_sales_row():
+    special_days_df = pd.DataFrame({
+        'date': ['2017-01-01', '2017-01-01', '2017-01-01', '2017-01-02'],
+        'day_type': ['Holiday', 'Event', 'Holiday', 'Holiday'],
+        'special_day_locale_type': ['National', 'National', 'Local', 'Regional'],
+        'special_day_locale': ['Ecuador', 'Ecuador', 'Quito', 'Guayas'],
+        'special_day_reason': ['Primer dia del ano', 'Evento', 'Fundacion de Quito', 'Provincializacion de Guayas'],
+        'special_day_transferred': [False, False, False, True],
+    })
+    stores_df = pd.DataFrame({'store_city': ['Quito', 'Guayaquil'], 'store_state': ['Pichincha', 'Guayas']}, index=pd.Index([1, 2], name='store_nbr'))
+    dataset = pd.DataFrame({'date': ['2017-01-01', '2017-01-01', '2017-01-02', '2017-01-02', '2017-01-03'], 'store_nbr': [1, 2, 1, 2, 1], 'sales': range(5)})
+
+    special_days_by_date_store = aggregate_special_days_by_date_store(special_days_df, stores_df)
+    merged = merge_special_days_by_date_store(dataset, special_days_by_date_store)
+
+    assert len(merged) == len(dataset)
+    assert merged['sales'].tolist() == list(range(5))
+    assert merged['special_days_count'].tolist() == [3, 2, 0, 1, 0]
+    assert merged['transferred_special_days_count'].tolist() == [0, 0, 0, 1, 0]
+    #The local holiday is the most relevant to the store of its city.
+    assert merged['special_day_reason'].tolist()[:2] == ['Fundacion de Quito', 'Primer dia del ano']
@@ -0,0 +1,38 @@
+"""Checks that the duckdb backend can replace the postgres one, having the methods and attributes the rest of the code uses, with the same parameters."""
+import inspect
+import pytest
+
+pytest.importorskip('duckdb')
+pytest.importorskip('pyspark')
+from db_interfacing import DBInterface
+from spark_interfacing import SparkInterface
+from duckdb_interfacing import DuckDBInterface, DuckDBSparkInterface
+
+def get_parameters_of_public_methods(interface_class) -> dict[str, list[inspect.Parameter]]:
+    return {
+        method_name: list(inspect.signature(method).parameters.values())
+        for method_name, method in inspect.getmembers(interface_class, inspect.isfunction)
+        if not method_name.startswith('_')
+    }
+
+@pytest.mark.parametrize('interface_class, duckdb_interface_class', [(DBInterface, DuckDBInterface), (SparkInterface, DuckDBSparkInterface)])
+def test_duckdb_interfaces_have_the_methods_of_the_postgres_ones(interface_class, duckdb_interface_class):
+    #The duckdb interfaces can have methods of their own, but every method of the postgres ones must take the same parameters.
+    duckdb_parameters_by_method = get_parameters_of_public_methods(duckdb_interface_class)
+    for method_name, parameters in get_parameters_of_public_methods(interface_class).items():
+        assert method_name in duckdb_parameters_by_method, f'{duckdb_interface_class.__name__} has no {method_name}'
+        assert [(parameter.name, parameter.default) for parameter in duckdb_parameters_by_method[method_name]] == [(parameter.name, parameter.default) for parameter in parameters], method_name
+
+def test_duckdb_spark_interface_has_the_spark_sql_options_of_the_database(tmp_path):
+    class SparkWithConf:
+        class conf:
+            @staticmethod
+            def set(key, value):
+                pass
+    duckdb_spark_interface = DuckDBSparkInterface(SparkWithConf(), DuckDBInterface(str(tmp_path / 'store_sales.duckdb')))
+    assert duckdb_spark_interface.spark_sql_options['url'] == f"jdbc:duckdb:{tmp_path / 'store_sales.duckdb'}"
+    assert duckdb_spark_interface.spark_sql_options['driver'] == 'org.duckdb.DuckDBDriver'
+
+def test_duckdb_query_as_arrow_takes_psycopg_parameters(tmp_path):
+    duckdb_interface = DuckDBInterface(str(tmp_path / 'store_sales.duckdb'))
+    assert duckdb_interface.query_as_arrow('SELECT %s + 1 AS two', [1])['two'].to_pylist() == [2]
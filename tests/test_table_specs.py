@@ -0,0 +1,60 @@
+"""Checks of the DDL of the table specs, as text for postgres, and executed in a duckdb database."""
+from datetime import date
+import pytest
+from table_specs import TableSpec, IndexSpec, DateRangePartitioningSpec
+
+sales_spec = TableSpec(
+    'sales',
+    dict(id='INTEGER NOT NULL', date='DATE NOT NULL', store_id='SMALLINT NOT NULL', sales_total='REAL'),
+    primary_key=('id', 'date'),
+    comment='The sales',
+    indexes=(IndexSpec(('store_id', 'date')), IndexSpec(('date',), method='brin')),
+    partitioning=DateRangePartitioningSpec('date', 'month'),
+)
+
+def test_postgres_ddl_is_partitioned_with_index_methods():
+    create_table_script, comment_script, btree_index_script, brin_index_script = sales_spec.get_creation_scripts()
+    assert create_table_script.startswith('CREATE TABLE IF NOT EXISTS sales\n(')
+    assert 'PRIMARY KEY (id, date)' in create_table_script
+    assert create_table_script.endswith('PARTITION BY RANGE (date)')
+    assert comment_script == "COMMENT ON TABLE sales IS 'The sales'"
+    assert btree_index_script == 'CREATE INDEX IF NOT EXISTS sales_store_id_date_idx ON sales (store_id, date)'
+    assert brin_index_script == 'CREATE INDEX IF NOT EXISTS sales_date_idx ON sales USING brin (date)'
+
+def test_postgres_partitions_cover_the_dates():
+    assert sales_spec.get_create_partitions_scripts(date(2016, 12, 15), date(2017, 1, 2)) == [
+        "CREATE TABLE IF NOT EXISTS sales_2016_12 PARTITION OF sales FOR VALUES FROM ('2016-12-01') TO ('2017-01-01')",
+        "CREATE TABLE IF NOT EXISTS sales_2017_01 PARTITION OF sales FOR VALUES FROM ('2017-01-01') TO ('2017-02-01')",
+    ]
+
+def test_partitioning_column_must_be_in_the_primary_key():
+    with pytest.raises(ValueError):
+        TableSpec('sales', dict(id='INTEGER', date='DATE'), primary_key=('id',), partitioning=DateRangePartitioningSpec('date'))
+
+
+def test_duckdb_executes_the_ddl_of_every_table(tmp_path):
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('pyspark') #duckdb_interfacing and dataset_properties import the spark modules.
+    from duckdb_interfacing import DuckDBInterface
+    from dataset_properties import properties_by_csv_sql_dataset
+    duckdb_interface = DuckDBInterface(str(tmp_path / 'store_sales.duckdb'))
+    table_specs = [*(dataset_properties.table_spec for dataset_properties in properties_by_csv_sql_dataset.values()), sales_spec]
+
+    duckdb_interface.create_tables_of_specs(table_specs, verbose=False)
+    duckdb_interface.create_tables_of_specs(table_specs, verbose=False) #IF NOT EXISTS makes it rerunnable.
+    with duckdb.connect(duckdb_interface.database_path) as connection:
+        created_table_names = {table_name for table_name, in connection.execute('SELECT table_name FROM information_schema.tables').fetchall()}
+        created_index_names = {index_name for index_name, in connection.execute('SELECT index_name FROM duckdb_indexes()').fetchall()}
+    assert {table_spec.name for table_spec in table_specs} <= created_table_names
+    assert {index.get_name(table_spec.name) for table_spec in table_specs for index in table_spec.indexes} <= created_index_names
+
+def test_duckdb_raises_on_failed_ddl(tmp_path):
+    duckdb = pytest.importorskip('duckdb')
+    pytest.importorskip('pyspark')
+    from duckdb_interfacing import DuckDBInterface
+    duckdb_interface = DuckDBInterface(str(tmp_path / 'store_sales.duckdb'))
+    with pytest.raises(Exception):
+        duckdb_interface.execute_engineering_queries(['CREATE TABLE valid_table (id INTEGER)', 'CREATE INDEX missing_idx ON missing_table (id)'], verbose=False)
+    #The statements before the failed one are rolled back.
+    with duckdb.connect(duckdb_interface.database_path) as connection:
+        assert connection.execute("SELECT table_name FROM information_schema.tables WHERE table_name = 'valid_table'").fetchall() == []
@@ -0,0 +1,39 @@
+"""Checks of the fold boundaries of DateOrderedTimeSeriesSplit."""
+import numpy as np
+import pandas as pd
+import pytest
+from time_series_cv import DateOrderedTimeSeriesSplit
+
+def make_rows_by_date(number_of_dates:int, rows_per_date:int) -> pd.DataFrame:
+    dates = pd.date_range('2017-01-01', periods=number_of_dates, freq='D').strftime('%Y-%m-%d')
+    return pd.DataFrame({'date': np.repeat(dates, rows_per_date), 'sales': 1.0})
+
+def test_folds_test_on_consecutive_days_after_the_gap():
+    features_df = make_rows_by_date(10, 2)
+    cv = DateOrderedTimeSeriesSplit(n_splits=2, test_size_in_days=2, gap_in_days=1)
+
+    assert cv.get_fold_boundaries(features_df) == [(10, 12, 16), (14, 16, 20)]
+    for train_rows, test_rows in cv.split(features_df):
+        train_dates, test_dates = pd.to_datetime(features_df['date'][train_rows]), pd.to_datetime(features_df['date'][test_rows])
+        assert train_rows.start == 0
+        assert (test_dates.min() - train_dates.max()).days == 2 #The day of the gap is in neither.
+        assert test_dates.nunique() == 2
+
+def test_folds_default_to_equal_parts_of_the_dates():
+    features_df = make_rows_by_date(12, 3)
+    fold_boundaries = DateOrderedTimeSeriesSplit(n_splits=3).get_fold_boundaries(features_df)
+    assert fold_boundaries == [(9, 9, 18), (18, 18, 27), (27, 27, 36)]
+
+def test_folds_require_rows_sorted_by_date():
+    features_df = make_rows_by_date(10, 2).iloc[::-1]
+    with pytest.raises(ValueError):
+        DateOrderedTimeSeriesSplit(n_splits=2, test_size_in_days=2).get_fold_boundaries(features_df)
+
+def test_folds_require_enough_dates():
+    with pytest.raises(ValueError):
+        DateOrderedTimeSeriesSplit(n_splits=5, test_size_in_days=2, gap_in_days=1).get_fold_boundaries(make_rows_by_date(10, 1))
+
+@pytest.mark.parametrize('number_of_dates, test_size_in_days', [(2, None), (10, 0)])
+def test_folds_require_test_days(number_of_dates, test_size_in_days):
+    with pytest.raises(ValueError):
+        DateOrderedTimeSeriesSplit(n_splits=3, test_size_in_days=test_size_in_days).get_fold_boundaries(make_rows_by_date(number_of_dates, 1))